@@ -2,43 +2,79 @@
 FdF (Fil de Fer) - 3D Wireframe Model Viewer
 This program reads FDF files and displays them as 3D wireframe models.
 """
+import os
 import sys
+import copy
 import math
 import pygame
+import numpy as np
+from fdf_transform import VertexTransform, ISOMETRIC, PROJECTIONS
+from fdf_mesh import (HeightMesh, unpack_color, build_lod_pyramid,
+                      select_lod_level, grid_edges)
+from fdf_parser import parse_fdf
+from fdf_cache import MapCache
+from fdf_culling import TileIndex, clip_segments
+from fdf_colors import HeightLUT, linear_gradient, unpack_colors
+from fdf_layers import Compositor
+from fdf_raster import LINE_BACKENDS, PYGAME, RASTER_THREADS, draw_lines
+from fdf_profile import FrameProfiler
+from fdf_loader import BackgroundLoader
+
+# Верхний предел частоты кадров при взаимодействии и период обновления
+# хода загрузки на HUD (секунды), пока кадр иначе не меняется
+MAX_FPS = 60
+LOADING_REFRESH = 0.1
+# Состояние модели, которое фоновая загрузка готовит на копии рендерера
+MODEL_STATE = ('mesh', 'edges', 'min_z', 'max_z', 'transform', 'height_lut',
+               'lod_levels', 'lod_topology', 'lod_level', 'tile_index')
 
 
 class Point3D:
-    """3D    x, y, z"""
+    """3D точка с координатами x, y, z"""
 
-    def _init_(self, x=0, y=0, z=0):
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x=0, y=0, z=0):
         self.x = float(x)
         self.y = float(y)
         self.z = float(z)
 
-    def _str_(self):
+    def __str__(self):
         return f"({self.x}, {self.y}, {self.z})"
 
 
 class FDFRenderer:
-    """   FDF """
+    """Рендерер для отображения FDF моделей"""
 
-    def _init_(self, width=1200, height=800):
+    def __init__(self, width=1200, height=800, headless=False):
+        if headless:
+            # Без дисплея: SDL без окна, рисуем в обычную поверхность
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
         pygame.init()
         self.width = width
         self.height = height
-        self.screen = pygame.display.set_mode((width, height))
-        pygame.display.set_caption("FdF - 3D Wireframe Viewer")
+        self.headless = headless
+        if headless:
+            self.screen = pygame.Surface((width, height))
+        else:
+            self.screen = pygame.display.set_mode((width, height))
+            pygame.display.set_caption("FdF - 3D Wireframe Viewer")
         self.clock = pygame.time.Clock()
-        self.fps = 60
-
-        # 
+        self.fps = MAX_FPS
+        # Кадр перерисовывается, только если что-то изменилось
+        self.dirty = True
+        self.loading_status = None
+        # Зажатые клавиши двигали камеру - опрашиваем их каждый кадр, не ожидая событий
+        self.keys_active = False
+
+        # Цвета
         self.bg_color = (10, 10, 30)
         self.grid_color = (100, 100, 150)
         self.high_color = (255, 100, 100)
         self.low_color = (100, 200, 255)
         self.text_color = (200, 200, 200)
 
-        #    
+        # Параметры камеры и преобразований
         self.scale = 20
         self.offset_x = width // 2
         self.offset_y = height // 2
@@ -48,62 +84,118 @@ class FDFRenderer:
         self.auto_rotate = False
         self.show_axes = True
         self.show_grid = True
+        self.show_hud = True
+
+        # Способ растеризации линий: pygame.draw.line или NumPy буфер
+        self.line_backend = PYGAME
+        # Потоки растеризатора NumPy (полосы экрана рисуются параллельно)
+        self.raster_threads = RASTER_THREADS
 
-        #  
-        self.points = []
-        self.edges = []
+        # Данные модели
+        self.mesh = HeightMesh([[]])
+        self.edges = np.zeros((0, 2), dtype=np.int32)
         self.min_z = 0
         self.max_z = 0
+        self.transform = VertexTransform(ISOMETRIC)
+        self.cache = MapCache()
+
+        # Уровни детализации (LOD)
+        self.lod_enabled = True
+        self.lod_levels = [self.mesh]
+        self.lod_topology = {}
+        self.lod_level = 0
+
+        # Пространственный индекс ребер для отсечения по экрану
+        self.tile_index = TileIndex(self.mesh, self.edges)
+
+        # Таблица цветов по высоте и готовые цвета ребер (E, 3)
+        self.height_lut = HeightLUT(linear_gradient)
+        self.edge_colors = np.zeros((0, 3), dtype=np.uint8)
+        self.colors_key = None
 
-        # 
+        # Фоновая загрузка: загрузчик и функция отчета о ходе загрузки
+        self.loader = None
+        self.progress = None
+
+        # Шрифт
         self.font = pygame.font.SysFont('Consolas', 20)
+        self.font_small = pygame.font.SysFont('Consolas', 16)
+
+        # Замеры этапов кадра (включаются клавишей P)
+        self.profiler = FrameProfiler()
+
+        # Кэшированные слои экрана
+        self.setup_layers()
+
+    def setup_layers(self):
+        """Слои экрана снизу вверх: фон с сеткой, модель, оси, интерфейс"""
+        profiled = self.profiler.wrap
+        self.layers = Compositor(self, (self.width, self.height))
+        self.layers.add('grid', profiled('draw_grid', self.draw_background),
+                        lambda: (self.show_grid, self.camera_key()), background=self.bg_color)
+        self.layers.add('model', profiled('draw_model', self.draw_model),
+                        lambda: (self.camera_key(), self.lod_enabled, self.line_backend))
+        self.layers.add('axes', profiled('draw_axes', self.draw_axes), self.camera_key)
+        self.layers.add('hud', profiled('draw_ui', self.draw_ui),
+                        lambda: (tuple(self.ui_lines()), self.auto_rotate))
+
+    def camera_key(self):
+        """Параметры камеры: слои, зависящие от них, перерисовываются при изменении"""
+        return (self.angle_x, self.angle_y, self.angle_z,
+                self.scale, self.offset_x, self.offset_y, self.transform.projection)
+
+    def render_frame(self):
+        """Сборка кадра из слоев (перерисовываются только изменившиеся)"""
+        self.layers['axes'].enabled = self.show_axes
+        self.layers['hud'].enabled = self.show_hud
+        self.layers.compose(self.screen)
+
+    def save_frame(self, filename):
+        """Сборка кадра и сохранение в файл (PNG по расширению)"""
+        self.render_frame()
+        pygame.image.save(self.screen, filename)
 
     def read_fdf_file(self, filename):
-        """ FDF    """
+        """Чтение FDF файла и парсинг данных"""
         try:
-            with open(filename, 'r') as file:
-                lines = file.readlines()
-
-            self.points = []
-            row = 0
-
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-
-                #    
-                values = line.split()
-                col = 0
-                for value in values:
-                    #     ( )
-                    if ',' in value:
-                        z_val, color = value.split(',')
-                    else:
-                        z_val = value
-                        color = None
-
-                    try:
-                        z = float(z_val)
-                        point = Point3D(col, row, z)
-                        self.points.append((point, color))
-                        col += 1
-                    except ValueError:
-                        continue
-
-                row += 1
-
-            if not self.points:
+            cached = self.cache.load(filename, 'fdf-edges')
+            if cached:
+                self.mesh = HeightMesh(cached['heights'], cached.get('colors'))
+                self.edges = cached['edges']
+                # Диапазон высот сохранен в кэше - сетку заново не сканируем
+                self.min_z = cached['min_z']
+                self.max_z = cached['max_z']
+                print(f"Loaded {filename} from cache")
+            else:
+                self.mesh, stats = parse_fdf(
+                    filename, progress=lambda fraction: self.report_progress('Parsing', fraction))
+                print(stats)
+
+            if not self.mesh.count:
                 print(f"Error: No valid data found in {filename}")
                 return False
 
-            #  min  max Z   
-            self.min_z = min(p[0].z for p in self.points)
-            self.max_z = max(p[0].z for p in self.points)
-
-            #   (   )
-            self.create_edges()
-            print(f"Loaded {len(self.points)} points, {len(self.edges)} edges")
+            self.transform.set_vertices(self.mesh.vertices())
+
+            if not cached:
+                # Находим min и max Z для цветовой градиенты
+                self.min_z = self.mesh.min_z
+                self.max_z = self.mesh.max_z
+                # Создаем ребра (соединяем точки в сетку)
+                self.report_progress('Building edges')
+                self.create_edges()
+                self.report_progress('Caching')
+                self.cache.store(
+                    filename, 'fdf-edges',
+                    values={'min_z': self.min_z, 'max_z': self.max_z},
+                    heights=self.mesh.heights,
+                    colors=self.mesh.colors,
+                    edges=self.edges
+                )
+            self.report_progress('Building LOD')
+            self.build_lod()
+            print(f"Loaded {self.mesh.count} points, {len(self.edges)} edges "
+                  f"({self.mesh.nbytes / 1e6:.1f} MB), {len(self.lod_levels)} LOD levels")
             return True
 
         except FileNotFoundError:
@@ -113,53 +205,101 @@ class FDFRenderer:
             print(f"Error reading file: {e}")
             return False
 
-    def create_edges(self):
-        """    """
-        self.edges = []
-
-        #   
-        max_x = max(int(p[0].x) for p in self.points)
-        max_y = max(int(p[0].y) for p in self.points)
-
-        #  2D   
-        grid = [[-1 for _ in range(max_x + 1)] for _ in range(max_y + 1)]
-
-        for idx, (point, _) in enumerate(self.points):
-            x, y = int(point.x), int(point.y)
-            if 0 <= x <= max_x and 0 <= y <= max_y:
-                grid[y][x] = idx
+    def report_progress(self, stage, fraction=None):
+        """Этап загрузки для HUD (только при фоновой загрузке)"""
+        if self.progress is not None:
+            self.progress(stage, fraction)
+
+    def staging_copy(self):
+        """Копия рендерера для загрузки в фоне: свои преобразование и таблица цветов"""
+        staging = copy.copy(self)
+        staging.transform = VertexTransform(self.transform.projection)
+        staging.height_lut = HeightLUT(linear_gradient)
+        return staging
+
+    def preview_options(self):
+        """Параметры грубой сетки (изображения базовый рендерер не читает)"""
+        return {}
+
+    def show_preview(self, mesh):
+        """Показ грубой сетки, пока в фоне грузится полная"""
+        if not mesh.count:
+            return
+        self.mesh = mesh
+        self.min_z = mesh.min_z
+        self.max_z = mesh.max_z
+        self.transform.set_vertices(mesh.vertices())
+        self.create_edges()
+        self.build_lod()
+
+    def adopt(self, staging):
+        """Замена модели на загруженную в фоне (в главном потоке, между кадрами)"""
+        for name in MODEL_STATE:
+            setattr(self, name, getattr(staging, name))
+        self.colors_key = None
+        self.layers.invalidate()
+
+    def poll_loading(self):
+        """События фоновой загрузки; True/False по ее окончании, иначе None"""
+        for kind, value in self.loader.poll():
+            if kind == 'preview':
+                self.show_preview(value)
+            elif kind == 'done':
+                if value:
+                    self.adopt(self.loader.staging)
+                self.loader = None
+                return value
+        return None
+
+    def build_lod(self):
+        """Построение пирамиды уровней детализации (один раз при загрузке)"""
+        self.lod_levels = build_lod_pyramid(self.mesh)
+        self.tile_index = TileIndex(self.mesh, self.edges)
+        self.lod_topology = {0: (self.edges, self.tile_index)}
+        self.lod_level = 0
+        self.colors_key = None
+        self.layers.invalidate()
+
+    def select_lod(self):
+        """Выбор уровня, у которого шаг сетки на экране около 1-2 пикселей"""
+        level = 0
+        if self.lod_enabled:
+            level = select_lod_level(self.lod_levels, self.scale)
+        if level == self.lod_level:
+            return
 
-        #   
-        for y in range(max_y + 1):
-            for x in range(max_x):
-                if grid[y][x] != -1 and grid[y][x + 1] != -1:
-                    self.edges.append((grid[y][x], grid[y][x + 1]))
+        self.lod_level = level
+        self.mesh = self.lod_levels[level]
+        if level not in self.lod_topology:
+            self.create_edges()
+            self.lod_topology[level] = (self.edges, TileIndex(self.mesh, self.edges))
+        self.edges, self.tile_index = self.lod_topology[level]
+        self.transform.set_vertices(self.mesh.vertices())
 
-        #   
-        for y in range(max_y):
-            for x in range(max_x + 1):
-                if grid[y][x] != -1 and grid[y + 1][x] != -1:
-                    self.edges.append((grid[y][x], grid[y + 1][x]))
+    def create_edges(self):
+        """Создание ребер между соседними точками: массив индексов (E, 2)"""
+        # Индекс точки в сетке: row * cols + col
+        self.edges = grid_edges(self.mesh.valid)
 
     def rotate_point(self, point, angle_x, angle_y, angle_z):
-        """ 3D    """
+        """Вращение 3D точки по трем осям"""
         x, y, z = point.x, point.y, point.z
 
-        #    X
+        # Вращение вокруг оси X
         if angle_x:
             cos_x = math.cos(angle_x)
             sin_x = math.sin(angle_x)
             y = point.y * cos_x - point.z * sin_x
             z = point.y * sin_x + point.z * cos_x
 
-        #    Y
+        # Вращение вокруг оси Y
         if angle_y:
             cos_y = math.cos(angle_y)
             sin_y = math.sin(angle_y)
             x = point.x * cos_y + z * sin_y
             z = -point.x * sin_y + z * cos_y
 
-        #    Z
+        # Вращение вокруг оси Z
         if angle_z:
             cos_z = math.cos(angle_z)
             sin_z = math.sin(angle_z)
@@ -169,125 +309,127 @@ class FDFRenderer:
         return Point3D(x, y, z)
 
     def project_point(self, point):
-        """ 3D   2D  ( )"""
-        #  
+        """Проекция 3D точки на 2D плоскость (изометрическая проекция)"""
+        # Изометрическая проекция
         iso_x = (point.x - point.y) * math.cos(math.radians(30))
         iso_y = point.z + (point.x + point.y) * math.sin(math.radians(30))
 
-        #   
+        # Масштабирование и смещение
         screen_x = iso_x * self.scale + self.offset_x
         screen_y = iso_y * self.scale + self.offset_y
 
         return (screen_x, screen_y)
 
-    def get_color_for_height(self, z, custom_color=None):
-        """     """
-        if custom_color:
-            #  hex 
-            try:
-                if custom_color.startswith('0x'):
-                    hex_color = custom_color[2:]
-                else:
-                    hex_color = custom_color
-                r = int(hex_color[0:2], 16)
-                g = int(hex_color[2:4], 16)
-                b = int(hex_color[4:6], 16)
-                return (r, g, b)
-            except (ValueError, IndexError):
-                pass
-
-        #   low_color  high_color
-        if self.max_z == self.min_z:
-            ratio = 0.5
-        else:
-            ratio = (z - self.min_z) / (self.max_z - self.min_z)
+    def project_points(self, points):
+        """Экранные координаты точек (N, 2) той же матрицей камеры, что и модель"""
+        screen, _ = self.transform.apply(self.angle_x, self.angle_y, self.angle_z,
+                                         self.scale, self.offset_x, self.offset_y,
+                                         vertices=points)
+        return screen
 
-        r = int(self.low_color[0] * (1 - ratio) + self.high_color[0] * ratio)
-        g = int(self.low_color[1] * (1 - ratio) + self.high_color[1] * ratio)
-        b = int(self.low_color[2] * (1 - ratio) + self.high_color[2] * ratio)
+    def toggle_projection(self):
+        """Следующая проекция камеры (изометрия, параллельная, перспектива)"""
+        names = list(PROJECTIONS)
+        index = names.index(self.transform.projection)
+        self.transform.set_projection(names[(index + 1) % len(names)])
 
-        return (max(0, min(255, r)), max(0, min(255, g)), max(0, min(255, b)))
+    def get_color_for_height(self, z, custom_color=None):
+        """Получение цвета в зависимости от высоты"""
+        if custom_color:
+            # Упакованный цвет 0xFFRRGGBB
+            return unpack_color(custom_color)
+
+        # Градиент от low_color к high_color по таблице
+        self.height_lut.update(self.min_z, self.max_z, self.low_color, self.high_color)
+        return self.height_lut.color(z)
+
+    def update_colors(self):
+        """Пересчет цветов ребер только при смене палитры, диапазона высот или LOD"""
+        self.height_lut.update(self.min_z, self.max_z, self.low_color, self.high_color)
+        key = (self.lod_level, self.height_lut.version)
+        if key == self.colors_key:
+            return
+        self.colors_key = key
+
+        # Цвет первой точки ребра или градиент по средней высоте
+        heights = self.mesh.heights.ravel()
+        first = self.edges[:, 0]
+        second = self.edges[:, 1]
+        packed = self.height_lut.lookup((heights[first] + heights[second]) / 2)
+        if self.mesh.colors is not None:
+            custom = self.mesh.colors.ravel()[first]
+            packed = np.where(custom != 0, custom, packed)
+        self.edge_colors = unpack_colors(packed)
 
     def draw_model(self):
-        """ """
-        if not self.points:
+        """Отрисовка модели"""
+        self.select_lod()
+        if not self.mesh.count:
             return
 
-        #   
-        projected_points = []
-        for point_3d, color in self.points:
-            rotated = self.rotate_point(
-                point_3d,
+        # Проецируем все точки одним матричным преобразованием
+        with self.profiler.stage('transform'):
+            screen, _ = self.transform.apply(
                 self.angle_x,
                 self.angle_y,
-                self.angle_z
+                self.angle_z,
+                self.scale,
+                self.offset_x,
+                self.offset_y
             )
-            projected = self.project_point(rotated)
-            projected_points.append((projected, point_3d.z, color))
-
-        #  
-        for edge in self.edges:
-            if edge[0] < len(projected_points) and edge[1] < len(projected_points):
-                p1, z1, color1 = projected_points[edge[0]]
-                p2, z2, color2 = projected_points[edge[1]]
 
-                #      
-                if color1:
-                    edge_color = self.get_color_for_height(z1, color1)
-                else:
-                    avg_z = (z1 + z2) / 2
-                    edge_color = self.get_color_for_height(avg_z)
+        # Отбрасываем тайлы вне экрана, оставшиеся ребра обрезаем по экрану
+        with self.profiler.stage('cull'):
+            visible = self.tile_index.visible_tiles(
+                lambda vertices: self.transform.apply(
+                    self.angle_x, self.angle_y, self.angle_z,
+                    self.scale, self.offset_x, self.offset_y, vertices=vertices),
+                self.width, self.height, margin=2
+            )
+            edge_ids = self.tile_index.visible_edges(visible)
+        with self.profiler.stage('clip'):
+            edges = self.edges[edge_ids]
+            start, end, keep = clip_segments(screen[edges[:, 0]], screen[edges[:, 1]],
+                                             self.width, self.height, margin=2)
 
-                pygame.draw.line(self.screen, edge_color, p1, p2, 2)
+        # Цвета ребер берем из готового буфера
+        self.update_colors()
+        colors = self.edge_colors[edge_ids[keep]]
 
-        #    ( )
-        if self.show_axes:
-            self.draw_axes()
+        # Отрисовка ребер
+        with self.profiler.stage('draw_lines'):
+            draw_lines(self.screen, start[keep], end[keep], colors, 2, self.line_backend,
+                       self.raster_threads)
 
     def draw_axes(self):
-        """  """
-        origin = Point3D(0, 0, 0)
-
-        #  X ()
-        x_end = Point3D(5, 0, 0)
-        x_end_rot = self.rotate_point(x_end, self.angle_x, self.angle_y, self.angle_z)
-        x_start_proj = self.project_point(self.rotate_point(
-            origin, self.angle_x, self.angle_y, self.angle_z))
-        x_end_proj = self.project_point(x_end_rot)
-        pygame.draw.line(self.screen, (255, 50, 50), x_start_proj, x_end_proj, 3)
-
-        #  Y ()
-        y_end = Point3D(0, 5, 0)
-        y_end_rot = self.rotate_point(y_end, self.angle_x, self.angle_y, self.angle_z)
-        y_end_proj = self.project_point(y_end_rot)
-        pygame.draw.line(self.screen, (50, 255, 50), x_start_proj, y_end_proj, 3)
-
-        #  Z ()
-        z_end = Point3D(0, 0, 5)
-        z_end_rot = self.rotate_point(z_end, self.angle_x, self.angle_y, self.angle_z)
-        z_end_proj = self.project_point(z_end_rot)
-        pygame.draw.line(self.screen, (50, 50, 255), x_start_proj, z_end_proj, 3)
-
-        #  
-        font_small = pygame.font.SysFont('Consolas', 16)
-        x_text = font_small.render('X', True, (255, 100, 100))
-        y_text = font_small.render('Y', True, (100, 255, 100))
-        z_text = font_small.render('Z', True, (100, 100, 255))
-
-        self.screen.blit(x_text, (x_end_proj[0] + 5, x_end_proj[1] - 10))
-        self.screen.blit(y_text, (y_end_proj[0] + 5, y_end_proj[1] - 10))
-        self.screen.blit(z_text, (z_end_proj[0] + 5, z_end_proj[1] - 10))
-
-    def draw_ui(self):
-        """  """
-        #   
-        info_lines = [
-            f"Points: {len(self.points)}",
+        """Отрисовка осей координат"""
+        # Начало координат и концы осей X, Y, Z - одним преобразованием
+        origin, x_end, y_end, z_end = self.project_points(
+            [(0, 0, 0), (5, 0, 0), (0, 5, 0), (0, 0, 5)]).tolist()
+        pygame.draw.line(self.screen, (255, 50, 50), origin, x_end, 3)
+        pygame.draw.line(self.screen, (50, 255, 50), origin, y_end, 3)
+        pygame.draw.line(self.screen, (50, 50, 255), origin, z_end, 3)
+
+        # Подписи осей
+        x_text = self.font_small.render('X', True, (255, 100, 100))
+        y_text = self.font_small.render('Y', True, (100, 255, 100))
+        z_text = self.font_small.render('Z', True, (100, 100, 255))
+
+        self.screen.blit(x_text, (x_end[0] + 5, x_end[1] - 10))
+        self.screen.blit(y_text, (y_end[0] + 5, y_end[1] - 10))
+        self.screen.blit(z_text, (z_end[0] + 5, z_end[1] - 10))
+
+    def ui_lines(self):
+        """Строки интерфейса: информация о модели и подсказки"""
+        loading = [self.loader.status()] if self.loader is not None else []
+        return loading + [
+            f"Points: {self.mesh.count}",
             f"Edges: {len(self.edges)}",
             f"Height range: {self.min_z:.1f} - {self.max_z:.1f}",
             f"Scale: {self.scale:.1f}",
-            f"Rotation X: {math.degrees(self.angle_x):.1f}",
-            f"Rotation Y: {math.degrees(self.angle_y):.1f}",
+            f"LOD: {self.lod_level} (step {self.mesh.step})",
+            f"Rotation X: {math.degrees(self.angle_x):.1f}°",
+            f"Rotation Y: {math.degrees(self.angle_y):.1f}°",
             "",
             "Controls:",
             "W/S - Rotate X axis",
@@ -298,27 +440,35 @@ class FDFRenderer:
             "T - Auto rotate",
             "G - Toggle grid",
             "X - Toggle axes",
+            "L - Toggle LOD",
+            f"B - Lines: {self.line_backend}",
+            f"V - Projection: {self.transform.projection}",
+            f"P - Profiler: {'ON' if self.profiler.enabled else 'OFF'}",
+            "F12 - Save trace",
             "ESC - Quit"
         ]
 
+    def draw_ui(self):
+        """Отрисовка пользовательского интерфейса"""
         y_offset = 10
-        for line in info_lines:
+        for line in self.ui_lines():
             text = self.font.render(line, True, self.text_color)
             self.screen.blit(text, (10, y_offset))
             y_offset += 25
 
-        #  -
+        # Статус авто-вращения
         if self.auto_rotate:
             status = self.font.render("AUTO ROTATE: ON", True, (0, 255, 0))
             self.screen.blit(status, (self.width - 200, 10))
 
     def handle_keys(self):
-        """  """
+        """Обработка зажатых клавиш; True, если камера изменилась"""
+        camera = self.camera_key()
         keys = pygame.key.get_pressed()
         rotation_speed = 0.05
         zoom_speed = 1.0
 
-        # 
+        # Вращение
         if keys[pygame.K_w]:
             self.angle_x -= rotation_speed
         if keys[pygame.K_s]:
@@ -332,13 +482,13 @@ class FDFRenderer:
         if keys[pygame.K_e]:
             self.angle_z += rotation_speed
 
-        # 
+        # Масштабирование
         if keys[pygame.K_PLUS] or keys[pygame.K_EQUALS]:
             self.scale += zoom_speed
         if keys[pygame.K_MINUS]:
             self.scale = max(1, self.scale - zoom_speed)
 
-        # 
+        # Смещение
         pan_speed = 5
         if keys[pygame.K_LEFT]:
             self.offset_x -= pan_speed
@@ -349,92 +499,168 @@ class FDFRenderer:
         if keys[pygame.K_DOWN]:
             self.offset_y += pan_speed
 
+        return self.camera_key() != camera
+
+    def idle_timeout(self):
+        """Сколько ждать событий окна, пока кадр не меняется (с; None - без срока)"""
+        return LOADING_REFRESH if self.loader is not None else None
+
+    def wait_events(self, timeout=0):
+        """События окна; timeout - сколько ждать первого (0 - не ждать, None - без срока)"""
+        if timeout == 0:
+            return pygame.event.get()
+        if timeout is None:
+            event = pygame.event.wait()
+        else:
+            event = pygame.event.wait(max(1, int(timeout * 1000)))
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event] + pygame.event.get()
+
+    def handle_events(self, events=None):
+        """Обработка событий окна; False, если пора выходить"""
+        running = True
+        for event in pygame.event.get() if events is None else events:
+            if event.type != pygame.MOUSEMOTION:
+                # Нажатия, изменения окна и т.п. - кадр нужно перерисовать
+                self.dirty = True
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_r:
+                    # Сброс вида
+                    self.scale = 20
+                    self.offset_x = self.width // 2
+                    self.offset_y = self.height // 2
+                    self.angle_x = 0
+                    self.angle_y = 0
+                    self.angle_z = 0
+                elif event.key == pygame.K_t:
+                    self.auto_rotate = not self.auto_rotate
+                elif event.key == pygame.K_g:
+                    self.show_grid = not self.show_grid
+                elif event.key == pygame.K_x:
+                    self.show_axes = not self.show_axes
+                elif event.key == pygame.K_l:
+                    self.lod_enabled = not self.lod_enabled
+                elif event.key == pygame.K_b:
+                    # Переключение растеризатора линий
+                    index = LINE_BACKENDS.index(self.line_backend)
+                    self.line_backend = LINE_BACKENDS[(index + 1) % len(LINE_BACKENDS)]
+                elif event.key == pygame.K_v:
+                    self.toggle_projection()
+                elif event.key == pygame.K_p:
+                    self.profiler.toggle()
+                elif event.key == pygame.K_F12:
+                    self.save_trace()
+        return running
+
+    def save_trace(self):
+        """Сохранение замеров кадров в Chrome trace JSON"""
+        if not self.profiler.count:
+            print("Profiler is off: press P to start recording")
+            return False
+        try:
+            filename = self.profiler.dump()
+        except OSError as e:
+            print(f"Error writing trace: {e}")
+            return False
+        print(f"Saved trace to {filename} (open in ui.perfetto.dev or chrome://tracing)")
+        return True
+
     def run(self, filename):
-        """  """
-        if not self.read_fdf_file(filename):
-            print("Failed to load FDF file")
-            return
+        """Основной цикл программы"""
+        # Окно работает сразу, карта грузится в фоне
+        self.loader = BackgroundLoader(self, filename)
 
+        profiler = self.profiler
         running = True
+        self.dirty = True
         while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
+            # Кадр сам не меняется - ждем событие окна или срок фоновой работы
+            active = self.dirty or self.auto_rotate or self.keys_active
+            timeout = 0 if active else self.idle_timeout()
+            profiler.frame()
+            with profiler.stage('idle'):
+                events = self.wait_events(timeout)
+            with profiler.stage('events'):
+                running = self.handle_events(events)
+
+            if self.loader is not None:
+                with profiler.stage('loading'):
+                    if self.poll_loading() is False:
+                        print("Failed to load FDF file")
                         running = False
-                    elif event.key == pygame.K_r:
-                        #  
-                        self.scale = 20
-                        self.offset_x = self.width // 2
-                        self.offset_y = self.height // 2
-                        self.angle_x = 0
-                        self.angle_y = 0
-                        self.angle_z = 0
-                    elif event.key == pygame.K_t:
-                        self.auto_rotate = not self.auto_rotate
-                    elif event.key == pygame.K_g:
-                        self.show_grid = not self.show_grid
-                    elif event.key == pygame.K_x:
-                        self.show_axes = not self.show_axes
-
-            #  
+            # Ход загрузки на HUD, предпросмотр и готовая модель
+            status = self.loader.status() if self.loader is not None else None
+            if status != self.loading_status:
+                self.loading_status = status
+                self.dirty = True
+
+            # Автоматическое вращение
             if self.auto_rotate:
                 self.angle_y += 0.01
                 self.angle_x += 0.005
-
-            #  
-            self.handle_keys()
-
-            # 
-            self.screen.fill(self.bg_color)
-
-            #  ( )
-            if self.show_grid:
-                self.draw_grid()
-
-            # 
-            self.draw_model()
-
-            # UI
-            self.draw_ui()
-
-            pygame.display.flip()
-            self.clock.tick(self.fps)
+                self.dirty = True
+
+            # Обработка клавиш
+            with profiler.stage('handle_keys'):
+                self.keys_active = self.handle_keys()
+                if self.keys_active:
+                    self.dirty = True
+
+            if not self.dirty:
+                continue
+            self.dirty = False
+
+            # Отрисовка: сетка, модель, оси и UI из кэшированных слоев
+            with profiler.stage('render'):
+                self.render_frame()
+            if profiler.enabled:
+                with profiler.stage('profiler'):
+                    profiler.draw_graph(self.screen, self.font_small)
+
+            with profiler.stage('flip'):
+                pygame.display.flip()
+            # Предел частоты кадров, пока модель вращается или меняется
+            with profiler.stage('wait'):
+                self.clock.tick(self.fps)
 
         pygame.quit()
         sys.exit()
 
+    def draw_background(self):
+        """Фоновый слой: сетка (если включена)"""
+        if self.show_grid:
+            self.draw_grid()
+
     def draw_grid(self):
-        """ """
+        """Отрисовка сетки"""
         grid_size = 10
         half_grid = grid_size // 2
 
-        for i in range(-half_grid, half_grid + 1):
-            #  
-            start_x = Point3D(-half_grid, 0, i)
-            end_x = Point3D(half_grid, 0, i)
-            start_proj = self.project_point(self.rotate_point(
-                start_x, self.angle_x, self.angle_y, self.angle_z))
-            end_proj = self.project_point(self.rotate_point(
-                end_x, self.angle_x, self.angle_y, self.angle_z))
-            pygame.draw.line(self.screen, (50, 50, 80), start_proj, end_proj, 1)
-
-            #  
-            start_y = Point3D(i, 0, -half_grid)
-            end_y = Point3D(i, 0, half_grid)
-            start_proj = self.project_point(self.rotate_point(
-                start_y, self.angle_x, self.angle_y, self.angle_z))
-            end_proj = self.project_point(self.rotate_point(
-                end_y, self.angle_x, self.angle_y, self.angle_z))
+        # Горизонтальные линии (-h, 0, i)-(h, 0, i), вертикальные (i, 0, -h)-(i, 0, h)
+        ticks = np.arange(-half_grid, half_grid + 1, dtype=np.float32)
+        zeros = np.zeros_like(ticks)
+        ends = np.full_like(ticks, half_grid)
+        start = np.concatenate((np.column_stack((-ends, zeros, ticks)),
+                                np.column_stack((ticks, zeros, -ends))))
+        end = np.concatenate((np.column_stack((ends, zeros, ticks)),
+                              np.column_stack((ticks, zeros, ends))))
+
+        screen = self.project_points(np.concatenate((start, end))).tolist()
+        for start_proj, end_proj in zip(screen[:len(start)], screen[len(start):]):
             pygame.draw.line(self.screen, (50, 50, 80), start_proj, end_proj, 1)
 
 
 def main():
-    """ """
+    """Основная функция"""
     if len(sys.argv) != 2:
         print("Usage: python fdf.py <filename.fdf>")
         print("Example: python fdf.py test_maps/42.fdf")
+        print("Headless: python fdf_render.py <file> -o snapshot.png")
         return
 
     filename = sys.argv[1]
@@ -442,5 +668,5 @@ def main():
     renderer.run(filename)
 
 
-if _name_ == "_main_":
-    main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
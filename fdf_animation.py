@@ -0,0 +1,159 @@
+"""
+FdF animation - vectorized height wave and time-series heightmap playback.
+The auto-rotate wave is one sin over a precomputed phase array written into
+a reused buffer. A sequence of heightmaps (a directory of .fdf files or
+images of the same size) is decoded by a background thread into a bounded
+ring of ready frames; the viewer takes them at a fixed playback rate.
+"""
+import os
+import re
+import math
+import time
+import queue
+import threading
+import numpy as np
+
+
+WAVE_AMPLITUDE = 0.5
+WAVE_PHASE_STEP = 0.1
+WAVE_SPEED = 0.01
+SEQUENCE_EXTENSIONS = ('.fdf', '.png', '.jpg', '.jpeg', '.bmp',
+                       '.tif', '.tiff', '.pgm', '.ppm', '.gif')
+DEFAULT_SEQUENCE_FPS = 10
+DEFAULT_RING_FRAMES = 4
+POLL_SECONDS = 0.1
+TWO_PI = 2 * math.pi
+
+
+class WaveAnimation:
+    """Волна высот: z += sin(t + i * phase_step) * amplitude для всех вершин сразу"""
+
+    def __init__(self, amplitude=WAVE_AMPLITUDE, phase_step=WAVE_PHASE_STEP,
+                 speed=WAVE_SPEED):
+        self.amplitude = amplitude
+        self.phase_step = phase_step
+        self.speed = speed
+        self.time = 0.0
+        self.phase = np.zeros(0, dtype=np.float32)
+        self.buffer = np.zeros(0, dtype=np.float32)
+
+    def step(self):
+        """Следующий кадр анимации"""
+        # Время по модулю 2 pi: аргумент sin остается точным в float32
+        self.time = (self.time + self.speed) % TWO_PI
+
+    def offsets(self, count):
+        """Смещения высот (count,) для текущего времени; буфер переиспользуется"""
+        if len(self.phase) != count:
+            # Фаза считается один раз на размер сетки (в float64, затем по модулю 2 pi)
+            phase = np.arange(count, dtype=np.float64) * self.phase_step
+            self.phase = np.mod(phase, TWO_PI).astype(np.float32)
+            self.buffer = np.empty(count, dtype=np.float32)
+        buffer = self.buffer
+        np.add(self.phase, np.float32(self.time), out=buffer)
+        np.sin(buffer, out=buffer)
+        buffer *= np.float32(self.amplitude)
+        return buffer
+
+
+def _natural_key(name):
+    """Ключ сортировки, при котором frame_2 идет раньше frame_10"""
+    return [int(part) if part.isdigit() else part.lower()
+            for part in re.split(r'(\d+)', name)]
+
+
+def find_frames(directory):
+    """Кадры последовательности в каталоге в естественном порядке имен"""
+    names = [name for name in os.listdir(directory)
+             if name.lower().endswith(SEQUENCE_EXTENSIONS)
+             and os.path.isfile(os.path.join(directory, name))]
+    return [os.path.join(directory, name) for name in sorted(names, key=_natural_key)]
+
+
+class SequencePlayer:
+    """Проигрывание последовательности кадров с фоновой подготовкой
+
+    load(filename) возвращает данные кадра (например, массив высот). Фоновый
+    поток читает кадры по кругу и складывает их в очередь на ring кадров;
+    poll отдает очередной кадр не чаще fps раз в секунду.
+    """
+
+    def __init__(self, files, load, fps=DEFAULT_SEQUENCE_FPS, ring=DEFAULT_RING_FRAMES,
+                 start=0):
+        self.files = list(files)
+        self.load = load
+        self.fps = fps
+        self.ready = queue.Queue(ring)
+        self.index = start
+        self.paused = False
+        # Кадры, не готовые к сроку (поток чтения не успевает)
+        self.late = 0
+        self.errors = 0
+        self._next_time = None
+        self._missed = False
+        self._stop = threading.Event()
+        self._thread = None
+        if len(self.files) > 1:
+            self._thread = threading.Thread(target=self._prefetch, args=(start + 1,),
+                                            daemon=True)
+            self._thread.start()
+
+    def __len__(self):
+        return len(self.files)
+
+    def _prefetch(self, index):
+        """Цикл фонового потока: чтение кадров по кругу в очередь"""
+        while not self._stop.is_set():
+            index %= len(self.files)
+            try:
+                frame = self.load(self.files[index])
+            except Exception as e:
+                self.errors += 1
+                print(f"Error loading frame {self.files[index]}: {e}")
+                frame = None
+                # Битые кадры пропускаем, но не крутимся вхолостую
+                self._stop.wait(POLL_SECONDS)
+            while frame is not None and not self._stop.is_set():
+                try:
+                    self.ready.put((index, frame), timeout=POLL_SECONDS)
+                    break
+                except queue.Full:
+                    pass
+            index += 1
+
+    def toggle_pause(self):
+        self.paused = not self.paused
+        self._next_time = None
+        return self.paused
+
+    def poll(self, now=None):
+        """Следующий кадр (индекс, данные), если подошло его время, иначе None"""
+        if self.paused or len(self.files) < 2:
+            return None
+        now = time.perf_counter() if now is None else now
+        period = 1.0 / self.fps
+        if self._next_time is None:
+            self._next_time = now + period
+        if now < self._next_time:
+            return None
+        try:
+            index, frame = self.ready.get_nowait()
+        except queue.Empty:
+            if not self._missed:
+                self.late += 1
+                self._missed = True
+            return None
+
+        # Ровный темп: следующий срок от предыдущего, после отставания - от текущего
+        self._next_time += period
+        if self._next_time < now:
+            self._next_time = now + period
+        self._missed = False
+        self.index = index
+        return index, frame
+
+    def stop(self):
+        """Остановка фонового потока"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
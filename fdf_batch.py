@@ -0,0 +1,218 @@
+"""
+FdF batch renderer - thumbnails for whole directories of maps.
+A fixed pool of long-lived worker processes (one per core by default) each
+keeps a single headless renderer and pulls files from a bounded queue. A
+failing or crashing file only fails itself; the run ends with a throughput
+summary (files/sec, p50/p95 per-file latency).
+"""
+import io
+import os
+import sys
+import time
+import queue
+import contextlib
+import argparse
+import multiprocessing
+import numpy as np
+from fdf_render import add_render_options
+
+
+MAP_EXTENSIONS = ('.fdf', '.fdft', '.png', '.jpg', '.jpeg', '.bmp',
+                  '.tif', '.tiff', '.pgm', '.ppm', '.gif')
+QUEUE_PER_WORKER = 2
+POLL_SECONDS = 0.5
+
+
+def find_maps(directory, recursive=False, exclude=None):
+    """Список карт в каталоге (файлы из каталога exclude пропускаются)"""
+    exclude = os.path.abspath(exclude) if exclude else None
+    found = []
+    for root, dirs, files in os.walk(directory):
+        if exclude and os.path.abspath(root).startswith(exclude):
+            dirs[:] = []
+            continue
+        for name in sorted(files):
+            if name.lower().endswith(MAP_EXTENSIONS):
+                found.append(os.path.join(root, name))
+        if not recursive:
+            break
+        dirs.sort()
+    return found
+
+
+def output_path(filename, directory, output_dir):
+    """PNG в output_dir с тем же относительным путем, что и у исходника"""
+    relative = os.path.relpath(filename, directory)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + '.png')
+
+
+def last_line(text):
+    """Последняя непустая строка вывода (обычно сообщение об ошибке) или None"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return lines[-1] if lines else None
+
+
+def worker_main(slot, tasks, results, current, args):
+    """Цикл рабочего процесса: один рендерер на все файлы"""
+    # Вывод рендерера не печатается - итог печатает главный процесс, а
+    # сообщение об ошибке файла уходит вместе с результатом
+    from fdf_render import create_renderer, render_file
+    with contextlib.redirect_stdout(io.StringIO()):
+        renderer = create_renderer(args)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, filename, output = task
+        # Номер задания в общей памяти: переживет аварийное завершение процесса
+        current[slot] = index
+        started = time.perf_counter()
+        log = io.StringIO()
+        try:
+            os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+            with contextlib.redirect_stdout(log):
+                ok = render_file(renderer, filename, output, args)
+            error = None if ok else last_line(log.getvalue()) or "could not load or render"
+        except Exception as e:
+            ok = False
+            error = f"{type(e).__name__}: {e}"
+        results.put((index, ok, time.perf_counter() - started, error))
+        current[slot] = -1
+
+
+class BatchRenderer:
+    """Пул долгоживущих процессов с ограниченной очередью заданий"""
+
+    def __init__(self, args, workers=None):
+        self.args = args
+        self.workers = workers or os.cpu_count() or 1
+        self.tasks = multiprocessing.Queue(self.workers * QUEUE_PER_WORKER)
+        self.results = multiprocessing.Queue()
+        self.current = multiprocessing.Array('q', [-1] * self.workers, lock=False)
+        self.processes = [None] * self.workers
+        self.jobs = []
+        self.done = set()
+        self.latencies = []
+        self.failures = []
+
+    def start_worker(self, slot):
+        self.current[slot] = -1
+        process = multiprocessing.Process(
+            target=worker_main,
+            args=(slot, self.tasks, self.results, self.current, self.args),
+            daemon=True)
+        process.start()
+        self.processes[slot] = process
+
+    def finish(self, index, ok, seconds, error):
+        """Учет завершенного файла; False если он уже учтен"""
+        if index in self.done:
+            return False
+        self.done.add(index)
+        if seconds is not None:
+            self.latencies.append(seconds)
+        if not ok:
+            self.failures.append((self.jobs[index][0], error))
+        return True
+
+    def reap(self):
+        """Замена упавших процессов; их текущий файл считается ошибкой"""
+        finished = 0
+        for slot, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            index = self.current[slot]
+            if index >= 0:
+                finished += self.finish(
+                    index, False, None, f"worker crashed (exit code {process.exitcode})")
+            self.start_worker(slot)
+        return finished
+
+    def drain(self):
+        """Прием результатов; возвращает число завершенных файлов"""
+        finished = 0
+        try:
+            message = self.results.get(timeout=POLL_SECONDS)
+            while True:
+                finished += self.finish(*message)
+                message = self.results.get_nowait()
+        except queue.Empty:
+            pass
+        return finished
+
+    def run(self, jobs):
+        """Рендеринг списка (файл, png); возвращает время работы в секундах"""
+        started = time.perf_counter()
+        self.jobs = jobs
+        for slot in range(self.workers):
+            self.start_worker(slot)
+
+        pending = list(reversed(range(len(jobs))))
+        remaining = len(jobs)
+        try:
+            while remaining:
+                # Подкладываем задания, пока очередь не заполнена
+                while pending:
+                    try:
+                        self.tasks.put((pending[-1],) + tuple(jobs[pending[-1]]), timeout=0.01)
+                    except queue.Full:
+                        break
+                    pending.pop()
+                remaining -= self.drain()
+                remaining -= self.reap()
+        finally:
+            for _ in self.processes:
+                self.tasks.put(None)
+            for process in self.processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+        return time.perf_counter() - started
+
+    def summary(self, seconds):
+        """Итоговая статистика"""
+        total = len(self.jobs)
+        lines = [f"Rendered {total - len(self.failures)}/{total} files in {seconds:.1f} s "
+                 f"with {self.workers} workers: {total / max(seconds, 1e-9):.2f} files/s"]
+        if self.latencies:
+            p50, p95 = np.percentile(self.latencies, [50, 95])
+            lines.append(f"Per-file latency: p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms")
+        for filename, error in self.failures:
+            lines.append(f"  FAILED {filename}: {error}")
+        return '\n'.join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='fdf_batch.py',
+        description="Render every map in a directory to PNG using a process pool")
+    parser.add_argument('directory', help="directory with .fdf, .fdft and image maps")
+    parser.add_argument('-o', '--output-dir',
+                        help="where to write PNGs (default: <directory>/render)")
+    parser.add_argument('-j', '--workers', type=int,
+                        help="worker processes (default: one per core)")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="include subdirectories")
+    add_render_options(parser)
+    return parser
+
+
+def main(argv=None):
+    """Точка входа"""
+    args = build_parser().parse_args(argv)
+    output_dir = args.output_dir or os.path.join(args.directory, 'render')
+    files = find_maps(args.directory, args.recursive, exclude=output_dir)
+    if not files:
+        print(f"No maps found in {args.directory}")
+        return 1
+
+    jobs = [(filename, output_path(filename, args.directory, output_dir)) for filename in files]
+    batch = BatchRenderer(args, args.workers)
+    seconds = batch.run(jobs)
+    print(batch.summary(seconds))
+    return 1 if batch.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,493 @@
+"""
+FdF benchmark suite - reproducible timings of every pipeline stage.
+Generates synthetic maps (flat, noisy and hex-colored) from the size of
+test_maps.fdf up to 4000x4000, times parsing, topology, transform and
+drawing headlessly and writes the results as JSON. The compare command
+flags stages that got slower between two result files, and the scaling
+command reports frame rate against the number of rasterizer threads.
+"""
+import io
+import gc
+import os
+import sys
+import json
+import time
+import queue
+import platform
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+
+# Приветствие pygame печатается в stdout и испортило бы JSON
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import pygame  # noqa: E402
+from fdf_parser import parse_fdf  # noqa: E402
+from fdf_render import fit_view  # noqa: E402
+from fdf_raster import NUMPY  # noqa: E402
+
+
+MAP_KINDS = ('flat', 'noisy', 'colors')
+DEFAULT_SIZES = ('10x13', '500', '1000', '2000', '4000')
+STAGES = ('parse', 'read_fdf_file', 'create_edges', 'create_mesh', 'transform',
+          'rotate_project', 'draw_wireframe', 'draw_solid', 'draw_points')
+SEED = 42
+# Скалярный путь rotate_point/project_point меряем на выборке точек
+SCALAR_SAMPLE = 10000
+# Порог регрессии: относительный и абсолютный (секунды)
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_MIN_DELTA = 0.001
+# Отчет о масштабировании: число потоков и режимы с растеризатором NumPy
+DEFAULT_THREADS = (1, 2, 4, 8, 16)
+SCALING_MODES = ('wireframe', 'solid')
+SCALING_SIZES = ('1000', '2000', '4000')
+
+
+def parse_grid_size(text):
+    """Размер карты ROWSxCOLS или N для квадратной"""
+    try:
+        values = [int(value) for value in text.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid map size: {text}")
+    if len(values) == 1:
+        values *= 2
+    if len(values) != 2 or min(values) < 2:
+        raise argparse.ArgumentTypeError(f"invalid map size: {text}")
+    return tuple(values)
+
+
+def synthetic_heights(rows, cols, kind, seed=SEED):
+    """Сетка высот (rows, cols) int32 для вида карты kind"""
+    if kind == 'flat':
+        return np.zeros((rows, cols), dtype=np.int32)
+
+    # Холмы из нескольких синусоид плюс шум - похоже на рельеф
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 4 * np.pi, rows, dtype=np.float32)[:, None]
+    x = np.linspace(0, 4 * np.pi, cols, dtype=np.float32)[None, :]
+    hills = 20 * np.sin(x) * np.cos(y) + 10 * np.sin(0.5 * x + 1.3 * y)
+    noise = rng.normal(0, 3, (rows, cols)).astype(np.float32)
+    return np.rint(hills + noise).astype(np.int32)
+
+
+def synthetic_colors(heights):
+    """Цвета 0xRRGGBB по высоте для карты с явными цветами"""
+    ratio = (heights - heights.min()) / max(1, np.ptp(heights))
+    red = (255 * ratio).astype(np.uint32)
+    blue = (255 * (1 - ratio)).astype(np.uint32)
+    return (red << 16) | (np.uint32(128) << 8) | blue
+
+
+def write_map(path, rows, cols, kind, seed=SEED):
+    """Запись синтетической карты в FDF файл"""
+    heights = synthetic_heights(rows, cols, kind, seed)
+    colors = synthetic_colors(heights) if kind == 'colors' else None
+    with open(path, 'w') as file:
+        for row in range(rows):
+            values = heights[row].tolist()
+            if colors is None:
+                file.write(' '.join(map(str, values)))
+            else:
+                file.write(' '.join(f"{z},0x{color:06X}"
+                                    for z, color in zip(values, colors[row].tolist())))
+            file.write('\n')
+
+
+def map_file(data_dir, rows, cols, kind, seed=SEED):
+    """Путь к синтетической карте; файл создается, если его еще нет"""
+    path = os.path.join(data_dir, f"{kind}-{rows}x{cols}-{seed}.fdf")
+    if not os.path.exists(path):
+        print(f"Generating {os.path.basename(path)}...", file=sys.stderr)
+        partial = path + '.part'
+        write_map(partial, rows, cols, kind, seed)
+        os.replace(partial, path)
+    return path
+
+
+def measure(stage, repeat=3, warmup=1):
+    """Времена repeat запусков stage() в секундах после warmup пробных"""
+    times = []
+    for run in range(warmup + repeat):
+        started = time.perf_counter()
+        stage()
+        elapsed = time.perf_counter() - started
+        if run >= warmup:
+            times.append(elapsed)
+    return times
+
+
+def summarize(name, stage, items, times):
+    """Запись результата одного этапа"""
+    return {
+        'map': name,
+        'stage': stage,
+        'items': int(items),
+        'runs': [round(t, 6) for t in times],
+        'min': round(min(times), 6),
+        'median': round(float(np.median(times)), 6),
+    }
+
+
+def scalar_transform(renderer, vertices):
+    """Старый путь: rotate_point и project_point для каждой точки"""
+    from fdf_bonus import Point3D
+    for x, y, z in vertices.tolist():
+        point = renderer.rotate_point(Point3D(x, y, z), renderer.angle_x,
+                                      renderer.angle_y, renderer.angle_z)
+        renderer.project_point(point)
+
+
+def draw_stage(renderer, mode):
+    """Полная отрисовка модели в режиме mode (с отбором тайлов и LOD)"""
+    def draw():
+        renderer.render_mode = mode
+        renderer.screen.fill(renderer.bg_color)
+        renderer.draw_model()
+    return draw
+
+
+def bench_map(path, name, stages, args, report):
+    """Замеры всех этапов для одной карты; report(запись) после каждого этапа"""
+    from fdf import FDFRenderer
+    from fdf_bonus import ExtendedFDFRenderer
+    width, height = args.size
+
+    def run(stage, items, func):
+        if stage not in stages:
+            return
+        entry = summarize(name, stage, items, measure(func, args.repeat, args.warmup))
+        print(f"  {stage:<15} {entry['median'] * 1000:10.2f} ms", file=sys.stderr)
+        report(entry)
+
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        points = parse_fdf(path)[0].size
+        run('parse', points, lambda: parse_fdf(path))
+
+        basic = FDFRenderer(width, height, headless=True)
+        basic.cache.enabled = False
+        run('read_fdf_file', points, lambda: basic.read_fdf_file(path))
+        if not basic.mesh.count:
+            basic.read_fdf_file(path)
+        run('create_edges', points, basic.create_edges)
+        # Слои ссылаются на рендерер - без gc память не освободится
+        basic = None
+        gc.collect()
+
+        renderer = ExtendedFDFRenderer(width, height, headless=True)
+        renderer.cache.enabled = False
+        renderer.lod_enabled = not args.no_lod
+        if not renderer.load_file(path):
+            raise RuntimeError(f"could not load {path}")
+        # Замер пересоздает топологию - возвращаем исходную, копию освобождаем
+        topology = renderer.edges, renderer.faces, renderer.colors, renderer.face_slots
+        run('create_mesh', points, renderer.create_mesh)
+        renderer.edges, renderer.faces, renderer.colors, renderer.face_slots = topology
+        del topology
+        gc.collect()
+
+        fit_view(renderer)
+        camera = (renderer.angle_x, renderer.angle_y, renderer.angle_z,
+                  renderer.scale, renderer.offset_x, renderer.offset_y)
+        run('transform', points, lambda: renderer.transform.apply(*camera))
+
+        sample = renderer.transform.vertices[:SCALAR_SAMPLE]
+        run('rotate_project', len(sample), lambda: scalar_transform(renderer, sample))
+
+        for mode in ('wireframe', 'solid', 'points'):
+            run('draw_' + mode, points, draw_stage(renderer, mode))
+
+
+def scaling_map(path, name, modes, args, report):
+    """Кадров в секунду при разном числе потоков растеризатора для одной карты"""
+    from fdf_bonus import ExtendedFDFRenderer
+    width, height = args.size
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        renderer = ExtendedFDFRenderer(width, height, headless=True)
+        renderer.cache.enabled = False
+        renderer.lod_enabled = not args.no_lod
+        renderer.line_backend = NUMPY
+        renderer.solid_backend = NUMPY
+        if not renderer.load_file(path):
+            raise RuntimeError(f"could not load {path}")
+        fit_view(renderer)
+        points = renderer.mesh.size
+
+        for mode in modes:
+            single = None
+            for threads in args.threads:
+                renderer.raster_threads = threads
+                times = measure(draw_stage(renderer, mode), args.repeat, args.warmup)
+                entry = summarize(name, 'draw_' + mode, points, times)
+                single = single or entry['median']
+                entry.update(threads=threads, fps=round(1 / entry['median'], 2),
+                             speedup=round(single / entry['median'], 2))
+                print(f"  {mode:<10} {threads:3d} threads {entry['fps']:8.2f} fps "
+                      f"x{entry['speedup']:.2f}", file=sys.stderr)
+                report(entry)
+
+
+def bench_process(bench, path, name, stages, args, messages):
+    """Замеры в отдельном процессе: ('result', запись), ('error', текст), None"""
+    try:
+        bench(path, name, stages, args, lambda entry: messages.put(('result', entry)))
+    except Exception as e:
+        messages.put(('error', f"{type(e).__name__}: {e}"))
+    messages.put(None)
+
+
+def bench_isolated(path, name, stages, args, bench=bench_map):
+    """Замеры карты в дочернем процессе: чистая память для каждой карты, а
+    нехватка памяти или падение теряет только оставшиеся этапы этой карты.
+    Возвращает (записи, ошибка или None)"""
+    messages = multiprocessing.Queue()
+    process = multiprocessing.Process(target=bench_process,
+                                      args=(bench, path, name, stages, args, messages))
+    process.start()
+    results = []
+    error = None
+    while True:
+        try:
+            message = messages.get(timeout=0.5)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            error = f"benchmark process died (exit code {process.exitcode})"
+            break
+        if message is None:
+            break
+        kind, value = message
+        if kind == 'result':
+            results.append(value)
+        else:
+            error = value
+    process.join()
+    if error:
+        print(f"  FAILED: {error}", file=sys.stderr)
+    return results, error
+
+
+def environment():
+    """Описание окружения для файла результатов"""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run_suite(args):
+    """Команда run: генерация карт, замеры и запись JSON"""
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), 'fdf_bench')
+    os.makedirs(data_dir, exist_ok=True)
+    stages = set(args.stages)
+
+    results = []
+    failures = []
+    for rows, cols in args.sizes:
+        for kind in args.kinds:
+            name = f"{kind}-{rows}x{cols}"
+            print(name, file=sys.stderr)
+            path = map_file(data_dir, rows, cols, kind, args.seed)
+            entries, error = bench_isolated(path, name, stages, args)
+            results.extend(entries)
+            if error:
+                failures.append({'map': name, 'error': error})
+
+    report = {
+        'environment': environment(),
+        'settings': {
+            'size': list(args.size),
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'lod': not args.no_lod,
+        },
+        'results': results,
+        'failures': failures,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+        print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 1 if failures else 0
+
+
+def scaling_table(results, threads):
+    """Таблица отчета о масштабировании: fps и ускорение для каждого числа потоков"""
+    header = f"{'map':<22} {'mode':<15}" + ''.join(f"{n:>7} thr" for n in threads)
+    lines = [header]
+    rows = {}
+    for entry in results:
+        rows.setdefault((entry['map'], entry['stage']), {})[entry['threads']] = entry
+    for (name, stage), entries in rows.items():
+        fps = ''.join(f"{entries[n]['fps']:11.2f}" if n in entries else f"{'-':>11}"
+                      for n in threads)
+        speedup = ''.join(f"{'x%.2f' % entries[n]['speedup']:>11}" if n in entries
+                          else f"{'-':>11}" for n in threads)
+        lines.append(f"{name:<22} {stage:<15}{fps}")
+        lines.append(f"{'':<22} {'speedup':<15}{speedup}")
+    return '\n'.join(lines)
+
+
+def run_scaling(args):
+    """Команда scaling: fps отрисовки в зависимости от числа потоков"""
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), 'fdf_bench')
+    os.makedirs(data_dir, exist_ok=True)
+
+    results = []
+    failures = []
+    for rows, cols in args.sizes:
+        for kind in args.kinds:
+            name = f"{kind}-{rows}x{cols}"
+            print(name, file=sys.stderr)
+            path = map_file(data_dir, rows, cols, kind, args.seed)
+            entries, error = bench_isolated(path, name, args.modes, args, scaling_map)
+            results.extend(entries)
+            if error:
+                failures.append({'map': name, 'error': error})
+
+    print(scaling_table(results, args.threads))
+    if args.output:
+        report = {
+            'environment': environment(),
+            'settings': {
+                'size': list(args.size),
+                'repeat': args.repeat,
+                'warmup': args.warmup,
+                'seed': args.seed,
+                'lod': not args.no_lod,
+                'threads': list(args.threads),
+            },
+            'results': results,
+            'failures': failures,
+        }
+        with open(args.output, 'w') as file:
+            file.write(json.dumps(report, indent=2) + '\n')
+        print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def load_results(filename):
+    """Результаты из JSON файла: {(карта, этап): запись}"""
+    with open(filename) as file:
+        report = json.load(file)
+    return {(entry['map'], entry['stage']): entry for entry in report['results']}
+
+
+def compare_results(base, new, threshold=DEFAULT_THRESHOLD, min_delta=DEFAULT_MIN_DELTA):
+    """Сравнение медиан; список (карта, этап, было, стало, отношение, статус)"""
+    rows = []
+    for key in sorted(base.keys() | new.keys()):
+        if key not in new or key not in base:
+            # Этап, пропавший из новых результатов, обычно значит падение
+            status = 'MISSING' if key not in new else 'new'
+            rows.append(key + (base.get(key, {}).get('median'),
+                               new.get(key, {}).get('median'), None, status))
+            continue
+        before = base[key]['median']
+        after = new[key]['median']
+        ratio = after / before if before > 0 else float('inf')
+        status = 'ok'
+        if after - before > min_delta and ratio > 1 + threshold:
+            status = 'REGRESSION'
+        elif before - after > min_delta and ratio < 1 - threshold:
+            status = 'faster'
+        rows.append(key + (before, after, ratio, status))
+    return rows
+
+
+def compare(args):
+    """Команда compare: таблица изменений и код 1 при регрессиях"""
+    rows = compare_results(load_results(args.base), load_results(args.new),
+                           args.threshold, args.min_delta)
+
+    def ms(value):
+        return f"{value * 1000:10.2f}" if value is not None else f"{'-':>10}"
+
+    print(f"{'map':<22} {'stage':<15} {'base ms':>10} {'new ms':>10} {'ratio':>7}  status")
+    for name, stage, before, after, ratio, status in rows:
+        ratio_text = f"{ratio:7.2f}" if ratio is not None else f"{'-':>7}"
+        print(f"{name:<22} {stage:<15} {ms(before)} {ms(after)} {ratio_text}  {status}")
+
+    regressions = sum(row[-1] in ('REGRESSION', 'MISSING') for row in rows)
+    print(f"{regressions} regression(s) above {args.threshold:.0%} "
+          f"(and {args.min_delta * 1000:.1f} ms)")
+    return 1 if regressions else 0
+
+
+def build_parser():
+    from fdf_render import parse_size
+    parser = argparse.ArgumentParser(
+        prog='fdf_bench.py',
+        description="Benchmark the FdF pipeline on synthetic maps")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="run the benchmarks and write JSON")
+    run.add_argument('-o', '--output', help="result file (default: stdout)")
+    run.add_argument('--sizes', type=parse_grid_size, nargs='+',
+                     default=[parse_grid_size(size) for size in DEFAULT_SIZES],
+                     help="map sizes as ROWSxCOLS or N (default: 10x13 500 1000 2000 4000)")
+    run.add_argument('--kinds', nargs='+', choices=MAP_KINDS, default=list(MAP_KINDS),
+                     help="synthetic map kinds")
+    run.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                     help="stages to time")
+    run.add_argument('--repeat', type=int, default=3, help="timed runs per stage")
+    run.add_argument('--warmup', type=int, default=1, help="untimed runs per stage")
+    run.add_argument('--size', type=parse_size, default=(1200, 800),
+                     help="frame size for draw stages (default: 1200x800)")
+    run.add_argument('--no-lod', action='store_true', help="draw stages at full detail")
+    run.add_argument('--seed', type=int, default=SEED, help="random seed for noisy maps")
+    run.add_argument('--data-dir', help="where generated maps are kept "
+                                        "(default: <tmp>/fdf_bench)")
+    run.set_defaults(func=run_suite)
+
+    scaling = commands.add_parser('scaling', help="frame rate against rasterizer threads")
+    scaling.add_argument('-o', '--output', help="also write the results as JSON")
+    scaling.add_argument('--threads', type=int, nargs='+', default=list(DEFAULT_THREADS),
+                         help="thread counts (default: 1 2 4 8 16)")
+    scaling.add_argument('--modes', nargs='+', choices=SCALING_MODES,
+                         default=list(SCALING_MODES), help="render modes")
+    scaling.add_argument('--sizes', type=parse_grid_size, nargs='+',
+                         default=[parse_grid_size(size) for size in SCALING_SIZES],
+                         help="map sizes as ROWSxCOLS or N (default: 1000 2000 4000)")
+    scaling.add_argument('--kinds', nargs='+', choices=MAP_KINDS, default=['noisy'],
+                         help="synthetic map kinds (default: noisy)")
+    scaling.add_argument('--repeat', type=int, default=5, help="timed frames per setting")
+    scaling.add_argument('--warmup', type=int, default=1, help="untimed frames per setting")
+    scaling.add_argument('--size', type=parse_size, default=(1920, 1080),
+                         help="frame size (default: 1920x1080)")
+    scaling.add_argument('--no-lod', action='store_true', help="draw at full detail")
+    scaling.add_argument('--seed', type=int, default=SEED, help="random seed for noisy maps")
+    scaling.add_argument('--data-dir', help="where generated maps are kept "
+                                            "(default: <tmp>/fdf_bench)")
+    scaling.set_defaults(func=run_scaling)
+
+    diff = commands.add_parser('compare', help="compare two result files")
+    diff.add_argument('base', help="baseline results")
+    diff.add_argument('new', help="new results")
+    diff.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                      help="relative slowdown treated as a regression (default: 0.10)")
+    diff.add_argument('--min-delta', type=float, default=DEFAULT_MIN_DELTA,
+                      help="ignore differences below this many seconds (default: 0.001)")
+    diff.set_defaults(func=compare)
+    return parser
+
+
+def main(argv=None):
+    """Точка входа"""
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,38 +2,86 @@
 FdF Bonus - Extended version with image support
 Supports FDF files and various image formats (PNG, JPEG, etc.)
 """
+import os
 import sys
+import copy
 import math
+import time
 import pygame
-from PIL import Image
 import numpy as np
+from fdf_transform import VertexTransform, PERSPECTIVE, PROJECTIONS
+from fdf_mesh import (HeightMesh, unpack_color, build_lod_pyramid,
+                      select_lod_level, lod_for_spacing, grid_mesh,
+                      grid_face_slots, grid_face_order)
+from fdf_parser import parse_fdf
+from fdf_cache import MapCache
+from fdf_tiles import TiledHeightMap
+from fdf_image import read_heightmap
+from fdf_culling import TileIndex, box_corners, boxes_on_screen, clip_segments
+from fdf_colors import HeightLUT, hsv_gradient, unpack_colors
+from fdf_layers import Compositor
+from fdf_raster import (LINE_BACKENDS, SOLID_BACKENDS, PYGAME, NUMPY, RASTER_THREADS,
+                        draw_lines, draw_triangles)
+from fdf_profile import FrameProfiler
+from fdf_animation import WaveAnimation, SequencePlayer, find_frames, DEFAULT_SEQUENCE_FPS
+from fdf_loader import BackgroundLoader
+from fdf_watch import FileWatcher
+
+
+# Верхний предел частоты кадров при взаимодействии и период обновления
+# хода загрузки на HUD (секунды), пока кадр иначе не меняется
+MAX_FPS = 60
+LOADING_REFRESH = 0.1
+# Дистанция перспективы по умолчанию и ее запас относительно радиуса модели
+CAMERA_DISTANCE = 500
+DISTANCE_PER_RADIUS = 4
+# Состояние модели, которое фоновая загрузка готовит на копии рендерера
+MODEL_STATE = (
+    'mesh', 'edges', 'faces', 'colors', 'face_slots', 'min_z', 'max_z',
+    'transform', 'height_lut', 'tiled_map', 'tile_bounds', 'tile_window', 'visible_tiles',
+    'lod_levels', 'lod_topology', 'lod_level', 'tile_index', 'sequence', 'sequence_frame',
+)
 
 
 class Point3D:
-    """3D    x, y, z"""
+    """3D точка с координатами x, y, z"""
 
-    def _init_(self, x=0, y=0, z=0):
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x=0, y=0, z=0):
         self.x = float(x)
         self.y = float(y)
         self.z = float(z)
 
-    def _str_(self):
+    def __str__(self):
         return f"({self.x}, {self.y}, {self.z})"
 
 
 class ExtendedFDFRenderer:
-    """    """
+    """Расширенный рендерер с поддержкой изображений"""
 
-    def _init_(self, width=1200, height=800):
+    def __init__(self, width=1200, height=800, headless=False):
+        if headless:
+            # Без дисплея: SDL без окна, рисуем в обычную поверхность
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
         pygame.init()
         self.width = width
         self.height = height
-        self.screen = pygame.display.set_mode((width, height))
-        pygame.display.set_caption("FdF Extended - 3D Wireframe Viewer")
+        self.headless = headless
+        if headless:
+            self.screen = pygame.Surface((width, height))
+        else:
+            self.screen = pygame.display.set_mode((width, height))
+            pygame.display.set_caption("FdF Extended - 3D Wireframe Viewer")
         self.clock = pygame.time.Clock()
-        self.fps = 60
-
-        # 
+        self.fps = MAX_FPS
+        # Кадр перерисовывается, только если что-то изменилось
+        self.dirty = True
+        self.loading_status = None
+        # Зажатые клавиши двигали камеру - опрашиваем их каждый кадр, не ожидая событий
+        self.keys_active = False
+
+        # Цвета
         self.bg_color = (15, 15, 35)
         self.grid_color = (120, 120, 180)
         self.high_color = (255, 120, 120)
@@ -41,7 +89,7 @@ class ExtendedFDFRenderer:
         self.text_color = (220, 220, 220)
         self.wireframe_color = (200, 200, 255)
 
-        #  
+        # Параметры камеры
         self.scale = 20
         self.offset_x = width // 2
         self.offset_y = height // 2
@@ -51,72 +99,448 @@ class ExtendedFDFRenderer:
         self.auto_rotate = False
         self.show_axes = True
         self.show_grid = True
+        self.show_hud = True
+
+        # Способ растеризации линий: pygame.draw.line или NumPy буфер
+        self.line_backend = PYGAME
+        # Потоки растеризатора NumPy (полосы экрана рисуются параллельно)
+        self.raster_threads = RASTER_THREADS
+        # Заливка граней: z-буфер NumPy или сортировка и pygame.draw.polygon
+        self.solid_backend = NUMPY
+        self.solid_outline = True
+        self.outline_color = (50, 50, 80)
         self.render_mode = 'wireframe'  # 'wireframe', 'points', 'solid'
 
-        #  
-        self.points = []
-        self.edges = []
-        self.faces = []
-        self.colors = []
+        # Данные модели
+        self.mesh = HeightMesh([[]])
+        self.edges = np.zeros((0, 2), dtype=np.int32)
+        self.faces = np.zeros((0, 3), dtype=np.int32)
+        self.colors = np.zeros((0, 3), dtype=np.uint8)
+        # Квадраты сетки -> номера граней для обхода без сортировки (None - не сетка)
+        self.face_slots = None
         self.min_z = 0
         self.max_z = 0
-        self.image_data = None
-
-        # 
+        # Большая сторона сетки из изображения (None - исходное разрешение)
+        self.image_max_size = None
+        # Перевод пикселей в высоты: scale, offset, invert, nodata (см. HeightScale)
+        self.height_scale = {}
+        self.transform = VertexTransform(PERSPECTIVE, distance=CAMERA_DISTANCE)
+        self.cache = MapCache()
+
+        # Тайловая карта (подгрузка видимых тайлов по требованию)
+        self.tiled_map = None
+        self.tile_bounds = None
+        self.tile_window = None
+        self.visible_tiles = 0
+        self.tile_budget = 250000
+
+        # Уровни детализации (LOD)
+        self.lod_enabled = True
+        self.lod_levels = [self.mesh]
+        self.lod_topology = {}
+        self.lod_level = 0
+
+        # Пространственный индекс ребер и граней для отсечения по экрану
+        self.tile_index = TileIndex(self.mesh, self.edges, self.faces)
+
+        # Таблица цветов по высоте и упакованные цвета вершин
+        self.height_lut = HeightLUT(hsv_gradient)
+        self.vertex_colors = np.zeros(0, dtype=np.uint32)
+        self.colors_key = None
+
+        # Шрифты
         self.font = pygame.font.SysFont('Consolas', 20)
         self.font_large = pygame.font.SysFont('Consolas', 28)
-
-        # 
-        self.animation_time = 0
+        self.font_small = pygame.font.SysFont('Consolas', 18)
+
+        # Анимация: волна высот и проигрывание последовательности карт
+        self.wave = WaveAnimation()
+        self.sequence = None
+        self.sequence_fps = DEFAULT_SEQUENCE_FPS
+        self.sequence_frame = 0
+
+        # Фоновая загрузка: загрузчик и функция отчета о ходе загрузки
+        self.filename = None
+        self.loader = None
+        self.progress = None
+        # Слежение за изменениями .fdf файла (клавиша F5)
+        self.watcher = None
+
+        # Замеры этапов кадра (включаются клавишей P)
+        self.profiler = FrameProfiler()
+
+        # Кэшированные слои экрана
+        self.setup_layers()
+
+    def setup_layers(self):
+        """Слои экрана снизу вверх: фон с сеткой, модель, оси, интерфейс"""
+        profiled = self.profiler.wrap
+        self.layers = Compositor(self, (self.width, self.height))
+        self.layers.add('grid', profiled('draw_grid', self.draw_background),
+                        lambda: (self.show_grid, self.camera_key()), background=self.bg_color)
+        self.layers.add('model', profiled('draw_model', self.draw_model),
+                        lambda: (self.camera_key(), self.render_mode, self.lod_enabled,
+                                 self.auto_rotate, self.line_backend, self.solid_backend,
+                                 self.solid_outline, self.sequence_frame))
+        self.layers.add('axes', profiled('draw_axes', self.draw_axes), self.camera_key)
+        self.layers.add('hud', profiled('draw_ui', self.draw_ui),
+                        lambda: (tuple(self.ui_lines()), self.auto_rotate, self.show_grid))
+
+    def camera_key(self):
+        """Параметры камеры: слои, зависящие от них, перерисовываются при изменении"""
+        return (self.angle_x, self.angle_y, self.angle_z,
+                self.scale, self.offset_x, self.offset_y, self.transform.projection)
+
+    def render_frame(self):
+        """Сборка кадра из слоев (перерисовываются только изменившиеся)"""
+        self.layers['axes'].enabled = self.show_axes
+        self.layers['hud'].enabled = self.show_hud
+        self.layers.compose(self.screen)
+
+    def save_frame(self, filename):
+        """Сборка кадра и сохранение в файл (PNG по расширению)"""
+        self.render_frame()
+        pygame.image.save(self.screen, filename)
 
     def load_file(self, filename):
-        """  (FDF  )"""
+        """Загрузка файла (FDF, тайловая карта, изображение или каталог кадров)"""
+        self.reset_map()
+        if os.path.isdir(filename):
+            loaded = self.load_sequence(filename)
+        elif filename.lower().endswith('.fdf'):
+            loaded = self.load_fdf(filename)
+        elif filename.lower().endswith('.fdft'):
+            loaded = self.load_tiled(filename)
+        else:
+            loaded = self.load_image(filename)
+        if loaded:
+            self.fit_camera_distance()
+            self.layers.invalidate()
+        return loaded
+
+    def reset_map(self):
+        """Сброс состояния предыдущей карты: последовательность и тайловая карта"""
+        if self.sequence is not None:
+            self.sequence.stop()
+            self.sequence = None
+        self.sequence_frame = 0
+        self.tiled_map = None
+        self.tile_bounds = None
+        self.tile_window = None
+        self.visible_tiles = 0
+
+    def report_progress(self, stage, fraction=None):
+        """Этап загрузки для HUD (только при фоновой загрузке)"""
+        if self.progress is not None:
+            self.progress(stage, fraction)
+
+    def staging_copy(self):
+        """Копия рендерера для загрузки в фоне: свои преобразование и таблица цветов"""
+        staging = copy.copy(self)
+        staging.transform = VertexTransform(self.transform.projection, CAMERA_DISTANCE)
+        staging.height_lut = HeightLUT(hsv_gradient)
+        # Текущую последовательность останавливает adopt, а не фоновый поток
+        staging.sequence = None
+        return staging
+
+    def preview_options(self):
+        """Параметры грубой сетки - те же, что у полной загрузки"""
+        return dict(self.height_scale, image_max_size=self.image_max_size)
+
+    def show_preview(self, mesh):
+        """Показ грубой сетки, пока в фоне грузится полная"""
+        if not mesh.count:
+            return
+        self.tiled_map = None
+        self.mesh = mesh
+        self.min_z = mesh.min_z
+        self.max_z = mesh.max_z
+        self.transform.set_vertices(mesh.vertices())
+        self.create_mesh()
+        self.build_lod()
+        self.fit_camera_distance()
+        self.layers.invalidate()
+
+    def adopt(self, staging):
+        """Замена модели на загруженную в фоне (в главном потоке, между кадрами)"""
+        if self.sequence is not None:
+            self.sequence.stop()
+        for name in MODEL_STATE:
+            setattr(self, name, getattr(staging, name))
+        self.colors_key = None
+        self.layers.invalidate()
+
+    def poll_loading(self):
+        """События фоновой загрузки; True/False по ее окончании, иначе None"""
+        for kind, value in self.loader.poll():
+            if kind == 'preview':
+                self.show_preview(value)
+            elif kind == 'done':
+                if value:
+                    self.adopt(self.loader.staging)
+                self.loader = None
+                return value
+        return None
+
+    def load_sequence(self, directory):
+        """Последовательность карт высот одного размера; первый кадр грузится сразу"""
+        files = find_frames(directory)
+        if not files:
+            print(f"Error: No frames in {directory}")
+            return False
+        first = files[0]
+        loaded = self.load_fdf(first) if first.lower().endswith('.fdf') else self.load_image(first)
+        if not loaded:
+            return False
+        # Кадры пишутся в массивы модели - первый кадр мог прийти из кэша
+        self.ensure_writable()
+        self.sequence = SequencePlayer(files, self.read_frame, self.sequence_fps)
+        self.sequence_frame = 0
+        print(f"Playing {len(files)} frames at {self.sequence_fps} fps")
+        return True
+
+    def read_frame(self, filename):
+        """Чтение кадра последовательности (в фоновом потоке): (высоты, цвета)"""
         if filename.lower().endswith('.fdf'):
-            return self.load_fdf(filename)
+            mesh, _ = parse_fdf(filename)
+            return mesh.heights, mesh.colors
+        return read_heightmap(filename, self.image_max_size, **self.height_scale), None
+
+    def advance_sequence(self):
+        """Переход к следующему кадру последовательности, если подошло время"""
+        frame = self.sequence.poll()
+        if frame is None:
+            return False
+        index, (heights, colors) = frame
+        if not self.apply_heights(heights, colors):
+            print(f"Skipping frame {self.sequence.files[index]}: size differs")
+        self.sequence_frame += 1
+        return True
+
+    def apply_heights(self, heights, colors=None):
+        """Новые высоты той же сетки без пересборки топологии, если дыры не изменились"""
+        base = self.lod_levels[0]
+        if heights.shape != base.shape or (colors is None) != (base.colors is None):
+            return False
+        holes_changed = not np.array_equal(np.isnan(heights), ~base.valid)
+        self.ensure_writable()
+
+        # Уровни LOD - срезы базовой сетки, поэтому обновляются вместе с ней
+        np.copyto(base.heights, heights)
+        if colors is not None:
+            np.copyto(base.colors, colors)
+        # Диапазон высот только растет: цвета не "прыгают" от кадра к кадру
+        self.min_z = min(self.min_z, base.min_z)
+        self.max_z = max(self.max_z, base.max_z)
+        self.colors_key = None
+
+        if holes_changed:
+            self.rebuild_topology()
+            return True
+
+        for level, (edges, faces, colors, slots, tile_index) in self.lod_topology.items():
+            self.lod_topology[level] = (edges, faces,
+                                        self.face_colors(self.lod_levels[level], faces),
+                                        slots, tile_index)
+            tile_index.update_bounds()
+        self.colors = self.lod_topology[self.lod_level][2]
+        self.transform.vertices[:, 2] = self.mesh.heights.ravel()
+        return True
+
+    def rebuild_topology(self):
+        """Новые ребра и грани базовой сетки после изменения дыр"""
+        for level in self.lod_levels:
+            level.invalidate()
+        self.mesh = self.lod_levels[0]
+        self.create_mesh()
+        self.build_lod()
+        self.transform.set_vertices(self.mesh.vertices())
+
+    def ensure_writable(self):
+        """Копия массивов из дискового кэша перед изменением модели на месте
+
+        Кэш отдает массивы np.load(mmap_mode='r') только для чтения. Уровни
+        LOD - срезы базовой сетки, поэтому переводятся на срезы копии; сетки
+        остаются теми же объектами, так что ссылки на них не устаревают.
+        """
+        base = self.lod_levels[0]
+        arrays = [base.heights] if base.colors is None else [base.heights, base.colors]
+        if not all(array.flags.writeable for array in arrays):
+            base.heights = np.array(base.heights)
+            if base.colors is not None:
+                base.colors = np.array(base.colors)
+            for level, mesh in enumerate(self.lod_levels[1:], 1):
+                factor = 2 ** level
+                mesh.heights = base.heights[::factor, ::factor]
+                if base.colors is not None:
+                    mesh.colors = base.colors[::factor, ::factor]
+
+        for level, (edges, faces, colors, slots, tile_index) in self.lod_topology.items():
+            if colors.flags.writeable:
+                continue
+            colors = np.array(colors)
+            self.lod_topology[level] = (edges, faces, colors, slots, tile_index)
+            if level == self.lod_level:
+                self.colors = colors
+
+    def patch_rows(self, row0, heights, colors=None):
+        """Замена рядов базовой сетки начиная с row0 на месте
+
+        Обновляются высоты, цвета точек, диапазон высот, границы тайлов и
+        цвета граней только затронутых квадратов. False - заплатка не
+        подходит к загруженной сетке (нужна полная перезагрузка).
+        """
+        base = self.lod_levels[0]
+        count, width = heights.shape
+        row1 = row0 + count
+        if (self.tiled_map is not None or row1 > base.rows or width > base.cols
+                or (colors is not None and base.colors is None)):
+            return False
+        if width < base.cols:
+            # Короткие строки дополняются пропусками, как при полном разборе
+            heights = np.pad(heights, ((0, 0), (0, base.cols - width)),
+                             constant_values=np.nan)
+            if colors is not None:
+                colors = np.pad(colors, ((0, 0), (0, base.cols - width)))
+
+        self.ensure_writable()
+        rows = base.heights[row0:row1]
+        holes_changed = not np.array_equal(np.isnan(heights), ~base.valid[row0:row1])
+        # Крайние высоты могли быть только в замененных рядах - тогда считаем заново
+        lost = bool(((rows == self.min_z) | (rows == self.max_z)).any())
+        np.copyto(rows, heights)
+        if base.colors is not None:
+            base.colors[row0:row1] = colors if colors is not None else 0
+
+        old_range = (self.min_z, self.max_z)
+        valid = heights[~np.isnan(heights)]
+        if lost:
+            self.min_z, self.max_z = base.min_z, base.max_z
+        elif len(valid):
+            self.min_z = min(self.min_z, float(valid.min()))
+            self.max_z = max(self.max_z, float(valid.max()))
+        self.colors_key = None
+        range_changed = (self.min_z, self.max_z) != old_range
+        if range_changed:
+            # Дистанция камеры зависит от размеров модели, как при загрузке
+            self.fit_camera_distance()
+            self.layers.invalidate()
         else:
-            return self.load_image(filename)
+            self.layers.invalidate('model')
+
+        if holes_changed:
+            self.rebuild_topology()
+            return True
+
+        for level, (edges, faces, level_colors, slots, tile_index) in self.lod_topology.items():
+            # Уровень k - каждый 2^k-й ряд: затронуты ряды [first, last)
+            factor = 2 ** level
+            first, last = -(-row0 // factor), -(-row1 // factor)
+            if first >= last:
+                continue
+            mesh = self.lod_levels[level]
+            tile_index.update_bounds(first, last)
+            if range_changed or slots is None:
+                # Новый диапазон высот меняет цвета всех граней
+                level_colors[:] = self.face_colors(mesh, faces)
+                continue
+            ids = slots[max(0, first - 1):last].ravel()
+            ids = ids[ids >= 0]
+            ids = np.stack([ids, ids + 1], axis=1).ravel()
+            level_colors[ids] = self.face_colors(mesh, faces[ids])
+
+        # Вершины текущего уровня - только затронутые ряды
+        factor = 2 ** self.lod_level
+        first, last = -(-row0 // factor), -(-row1 // factor)
+        cols = self.mesh.cols
+        self.transform.vertices[first * cols:last * cols, 2] = \
+            self.mesh.heights[first:last].ravel()
+        return True
+
+    def toggle_watch(self):
+        """Включение/выключение слежения за файлом карты"""
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            print("Watch: off")
+            return False
+        if self.loader is not None:
+            print("Watch mode: wait until the map is loaded")
+            return False
+        if (self.filename is None or not self.filename.lower().endswith('.fdf')
+                or self.tiled_map is not None):
+            print("Watch mode supports .fdf files only")
+            return False
+        # Заплатки пишут в массивы модели - копия кэша делается заранее
+        self.ensure_writable()
+        self.watcher = FileWatcher(self.filename)
+        print(f"Watching {self.filename}")
+        return True
+
+    def check_watch(self):
+        """Применение изменений файла: заплатки рядов или полная перезагрузка
+
+        True, если модель изменилась или началась перезагрузка.
+        """
+        changes = self.watcher.poll()
+        for change in changes:
+            start = time.perf_counter()
+            base = self.lod_levels[0]
+            try:
+                patched = (change.patches is not None and self.watcher.rows == base.rows
+                           and all(self.patch_rows(*patch) for patch in change.patches))
+            except Exception as e:
+                print(f"Error patching {self.filename}: {e}")
+                patched = False
+            if not patched:
+                print(f"{self.filename} changed: reloading")
+                self.loader = BackgroundLoader(self, self.filename, preview=False)
+                return True
+            print(f"{self.filename}: updated {change.rows} rows in "
+                  f"{(time.perf_counter() - start) * 1000:.1f} ms "
+                  f"(found and parsed in {change.seconds * 1000:.0f} ms)")
+        return bool(changes)
+
+    def fit_camera_distance(self):
+        """Дистанция перспективы по размеру модели
+
+        Точки с глубиной ниже -distance / 2 уходят за камеру, поэтому для
+        больших карт (полноразмерные изображения, тайлы) дистанция растет.
+        """
+        source = self.tiled_map or self.lod_levels[0]
+        step = getattr(source, 'step', 1)
+        x0, y0 = source.origin_x, source.origin_y
+        x1 = x0 + max(0, source.cols - 1) * step
+        y1 = y0 + max(0, source.rows - 1) * step
+        corners = box_corners(*(np.array([value], dtype=np.float32)
+                                for value in (x0, x1, y0, y1, self.min_z, self.max_z)))
+        radius = float(np.linalg.norm(corners, axis=1).max())
+        self.transform.distance = max(CAMERA_DISTANCE, DISTANCE_PER_RADIUS * radius)
 
     def load_fdf(self, filename):
-        """ FDF """
+        """Загрузка FDF файла"""
         try:
-            with open(filename, 'r') as file:
-                lines = file.readlines()
-
-            self.points = []
-            row = 0
-
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-
-                values = line.split()
-                col = 0
-                for value in values:
-                    if ',' in value:
-                        z_val, color = value.split(',')
-                    else:
-                        z_val = value
-                        color = None
-
-                    try:
-                        z = float(z_val)
-                        point = Point3D(col, row, z)
-                        self.points.append((point, color))
-                        col += 1
-                    except ValueError:
-                        continue
-
-                row += 1
-
-            if not self.points:
+            if self.load_cached(filename, 'fdf-mesh'):
+                return True
+
+            self.mesh, stats = parse_fdf(
+                filename, progress=lambda fraction: self.report_progress('Parsing', fraction))
+            print(stats)
+            if not self.mesh.count:
                 print(f"Error: No valid data in {filename}")
                 return False
 
-            self.min_z = min(p[0].z for p in self.points)
-            self.max_z = max(p[0].z for p in self.points)
+            self.min_z = self.mesh.min_z
+            self.max_z = self.mesh.max_z
+            self.report_progress('Building mesh')
+            self.transform.set_vertices(self.mesh.vertices())
             self.create_mesh()
-            print(f"Loaded FDF: {len(self.points)} points, {len(self.edges)} edges")
+            self.report_progress('Caching')
+            self.store_cached(filename, 'fdf-mesh')
+            self.report_progress('Building LOD')
+            self.build_lod()
+            print(f"Loaded FDF: {self.mesh.count} points, {len(self.edges)} edges "
+                  f"({self.mesh.nbytes / 1e6:.1f} MB)")
             return True
 
         except Exception as e:
@@ -124,99 +548,180 @@ class ExtendedFDFRenderer:
             return False
 
     def load_image(self, filename):
-        """     3D """
+        """Загрузка изображения и преобразование в 3D модель"""
         try:
-            img = Image.open(filename)
-            img = img.convert('L')  #   grayscale
-            img = img.resize((50, 50))  #   
+            variant = f"image-{self.image_max_size or 'full'}" + ''.join(
+                f"-{key}={value}" for key, value in sorted(self.height_scale.items()))
+            if self.load_cached(filename, variant):
+                return True
+
+            # Яркость или значения DEM -> высота, nodata -> дыры; центрируем сетку
+            heights = read_heightmap(
+                filename, self.image_max_size,
+                progress=lambda fraction: self.report_progress('Reading', fraction),
+                **self.height_scale)
+            height, width = heights.shape
+            self.mesh = HeightMesh(heights, origin_x=-width / 2, origin_y=-height / 2)
+
+            if not self.mesh.count:
+                print("Error: Failed to create points from image")
+                return False
 
-            #   numpy 
-            img_array = np.array(img)
-            self.image_data = img_array
+            self.min_z = self.mesh.min_z
+            self.max_z = self.mesh.max_z
+            self.report_progress('Building mesh')
+            self.transform.set_vertices(self.mesh.vertices())
+            self.create_mesh()
+            self.report_progress('Caching')
+            self.store_cached(filename, variant)
+            self.report_progress('Building LOD')
+            self.build_lod()
+            print(f"Loaded image: {width}x{height}, {self.mesh.count} points, "
+                  f"{len(self.edges)} edges ({self.mesh.nbytes / 1e6:.1f} MB)")
+            return True
 
-            #    
-            self.points = []
-            height, width = img_array.shape
+        except Exception as e:
+            print(f"Error loading image: {e}")
+            return False
 
-            for y in range(height):
-                for x in range(width):
-                    #  -> 
-                    brightness = img_array[y, x]
-                    z = (255 - brightness) / 10.0  #    
+    def load_tiled(self, filename):
+        """Открытие тайловой карты; данные читаются по мере необходимости"""
+        try:
+            self.tiled_map = TiledHeightMap(filename)
+            self.tile_bounds = self.tiled_map.tile_bounds()
+            self.tile_window = None
+            self.min_z = self.tiled_map.min_z
+            self.max_z = self.tiled_map.max_z
+            print(f"Opened tiled map: {self.tiled_map.rows}x{self.tiled_map.cols} points, "
+                  f"{self.tiled_map.tile_count} tiles")
+            return True
 
-                    point = Point3D(x - width/2, y - height/2, z)
-                    self.points.append((point, None))
+        except Exception as e:
+            print(f"Error loading tiled map: {e}")
+            return False
 
-            if not self.points:
-                print(f"Error: Failed to create points from image")
-                return False
+    def update_tile_window(self):
+        """Сборка модели только из тайлов, пересекающих экран"""
+        tiles = self.tiled_map
+        x0, x1, y0, y1, z0, z1 = self.tile_bounds
+
+        # 8 углов ограничивающего параллелепипеда каждого тайла
+        screen, _ = self.transform.apply(
+            self.angle_x, self.angle_y, self.angle_z,
+            self.scale, self.offset_x, self.offset_y,
+            vertices=box_corners(x0, x1, y0, y1, z0, z1)
+        )
+        visible = ~np.isnan(z0) & boxes_on_screen(screen, self.width, self.height)
+        visible = visible.reshape(tiles.tiles_y, tiles.tiles_x)
+        self.visible_tiles = int(visible.sum())
+
+        # Шаг прореживания: бюджет точек окна и шаг сетки на экране
+        points = self.visible_tiles * tiles.tile_size ** 2
+        step = max(1, math.ceil(math.sqrt(points / self.tile_budget)))
+        if self.lod_enabled:
+            self.lod_level = lod_for_spacing(self.scale)
+            step = max(step, 2 ** self.lod_level)
+        key = (visible.tobytes(), step)
+        if key == self.tile_window:
+            return
+        self.tile_window = key
 
-            self.min_z = min(p[0].z for p in self.points)
-            self.max_z = max(p[0].z for p in self.points)
+        if not self.visible_tiles:
+            self.mesh = HeightMesh(np.zeros((0, 0)))
             self.create_mesh()
-            print(f"Loaded image: {len(self.points)} points, {len(self.edges)} edges")
-            return True
+            self.tile_index = TileIndex(self.mesh, self.edges, self.faces)
+            return
 
-        except Exception as e:
-            print(f"Error loading image: {e}")
+        rows, cols = np.nonzero(visible)
+        self.mesh = tiles.read_window(rows.min(), rows.max() + 1,
+                                      cols.min(), cols.max() + 1, visible, step)
+        self.transform.set_vertices(self.mesh.vertices())
+        self.create_mesh()
+        self.tile_index = TileIndex(self.mesh, self.edges, self.faces)
+
+    def build_lod(self):
+        """Построение пирамиды уровней детализации (один раз при загрузке)"""
+        self.lod_levels = build_lod_pyramid(self.mesh)
+        self.tile_index = TileIndex(self.mesh, self.edges, self.faces)
+        self.lod_topology = {0: (self.edges, self.faces, self.colors, self.face_slots,
+                                 self.tile_index)}
+        self.lod_level = 0
+        self.colors_key = None
+
+    def select_lod(self):
+        """Выбор уровня, у которого шаг сетки на экране около 1-2 пикселей"""
+        level = 0
+        if self.lod_enabled:
+            level = select_lod_level(self.lod_levels, self.scale)
+        if level == self.lod_level:
+            return
+
+        self.lod_level = level
+        self.mesh = self.lod_levels[level]
+        if level not in self.lod_topology:
+            self.create_mesh()
+            self.lod_topology[level] = (self.edges, self.faces, self.colors, self.face_slots,
+                                        TileIndex(self.mesh, self.edges, self.faces))
+        (self.edges, self.faces, self.colors, self.face_slots,
+         self.tile_index) = self.lod_topology[level]
+        self.transform.set_vertices(self.mesh.vertices())
+
+    def load_cached(self, filename, variant):
+        """Загрузка сетки и топологии из дискового кэша"""
+        self.report_progress('Reading cache')
+        cached = self.cache.load(filename, variant)
+        if not cached:
             return False
 
+        self.mesh = HeightMesh(cached['heights'], cached.get('colors'),
+                               cached['origin_x'], cached['origin_y'])
+        self.edges = cached['edges']
+        self.faces = cached['faces']
+        self.colors = cached['face_colors']
+        self.face_slots = grid_face_slots(self.faces, self.mesh.shape)
+        self.min_z = cached['min_z']
+        self.max_z = cached['max_z']
+        self.transform.set_vertices(self.mesh.vertices())
+        self.build_lod()
+        print(f"Loaded from cache: {self.mesh.count} points, {len(self.edges)} edges")
+        return True
+
+    def store_cached(self, filename, variant):
+        """Сохранение сетки и топологии в дисковый кэш"""
+        self.cache.store(
+            filename, variant,
+            values={
+                'min_z': self.min_z,
+                'max_z': self.max_z,
+                'origin_x': self.mesh.origin_x,
+                'origin_y': self.mesh.origin_y,
+            },
+            heights=self.mesh.heights,
+            colors=self.mesh.colors,
+            edges=self.edges,
+            faces=self.faces,
+            face_colors=self.colors
+        )
+
     def create_mesh(self):
-        """  (  )"""
-        self.edges = []
-        self.faces = []
-        self.colors = []
-
-        #  
-        points_array = [p[0] for p in self.points]
-        max_x = max(int(p.x) for p in points_array)
-        max_y = max(int(p.y) for p in points_array)
-
-        #  2D  
-        grid = [[-1 for _ in range(max_x + 1)] for _ in range(max_y + 1)]
-        for idx, (point, _) in enumerate(self.points):
-            x, y = int(point.x), int(point.y)
-            if 0 <= x <= max_x and 0 <= y <= max_y:
-                grid[y][x] = idx
-
-        #    
-        for y in range(max_y):
-            for x in range(max_x):
-                if (grid[y][x] != -1 and grid[y][x + 1] != -1 and
-                        grid[y + 1][x] != -1 and grid[y + 1][x + 1] != -1):
-
-                    #  
-                    self.edges.append((grid[y][x], grid[y][x + 1]))
-                    self.edges.append((grid[y][x], grid[y + 1][x]))
-                    self.edges.append((grid[y + 1][x], grid[y + 1][x + 1]))
-                    self.edges.append((grid[y][x + 1], grid[y + 1][x + 1]))
-
-                    #     
-                    self.faces.append((
-                        grid[y][x],
-                        grid[y][x + 1],
-                        grid[y + 1][x]
-                    ))
-                    self.faces.append((
-                        grid[y + 1][x + 1],
-                        grid[y][x + 1],
-                        grid[y + 1][x]
-                    ))
-
-                    #      
-                    avg_z = (points_array[grid[y][x]].z +
-                             points_array[grid[y][x + 1]].z +
-                             points_array[grid[y + 1][x]].z +
-                             points_array[grid[y + 1][x + 1]].z) / 4
-                    color = self.get_color_for_height(avg_z)
-                    self.colors.append(color)
-                    self.colors.append(color)
+        """Создание сетки: ребра (E, 2), грани (F, 3) и цвета граней (F, 3)"""
+        # Индекс точки в сетке: row * cols + col
+        self.edges, self.faces = grid_mesh(self.mesh.valid)
+        self.face_slots = grid_face_slots(self.faces, self.mesh.shape)
+        self.colors = self.face_colors(self.mesh, self.faces)
+
+    def face_colors(self, mesh, faces):
+        """Цвета граней (F, 3) по средней высоте квадрата (две грани на квадрат)"""
+        heights = mesh.heights.ravel()
+        avg_z = (heights[faces[0::2]].sum(axis=1) + heights[faces[1::2, 0]]) / 4
+        self.height_lut.update(self.min_z, self.max_z)
+        return np.repeat(unpack_colors(self.height_lut.lookup(avg_z)), 2, axis=0)
 
     def rotate_point(self, point, angle_x, angle_y, angle_z):
-        """ 3D """
+        """Вращение 3D точки (скалярный вариант, для сравнения в fdf_bench)"""
         x, y, z = point.x, point.y, point.z
 
-        #  X
+        # Вращение X
         if angle_x:
             cos_x = math.cos(angle_x)
             sin_x = math.sin(angle_x)
@@ -224,7 +729,7 @@ class ExtendedFDFRenderer:
             z_new = y * sin_x + z * cos_x
             y, z = y_new, z_new
 
-        #  Y
+        # Вращение Y
         if angle_y:
             cos_y = math.cos(angle_y)
             sin_y = math.sin(angle_y)
@@ -232,7 +737,7 @@ class ExtendedFDFRenderer:
             z_new = -x * sin_y + z * cos_y
             x, z = x_new, z_new
 
-        #  Z
+        # Вращение Z
         if angle_z:
             cos_z = math.cos(angle_z)
             sin_z = math.sin(angle_z)
@@ -243,8 +748,8 @@ class ExtendedFDFRenderer:
         return Point3D(x, y, z)
 
     def project_point(self, point):
-        """ 3D   2D"""
-        #  
+        """Проекция 3D точки на 2D (скалярный вариант, для сравнения в fdf_bench)"""
+        # Перспективная проекция
         distance = 500
         factor = distance / (distance + point.z * 2)
 
@@ -253,182 +758,191 @@ class ExtendedFDFRenderer:
 
         return (screen_x, screen_y)
 
+    def project_points(self, points):
+        """Экранные координаты точек (N, 2) той же матрицей камеры, что и модель"""
+        screen, _ = self.transform.apply(self.angle_x, self.angle_y, self.angle_z,
+                                         self.scale, self.offset_x, self.offset_y,
+                                         vertices=points)
+        return screen
+
+    def near_depth(self):
+        """Глубина плоскости камеры (только у перспективы) или None"""
+        return -self.transform.distance / 2 if self.transform.perspective else None
+
+    def toggle_projection(self):
+        """Следующая проекция камеры (изометрия, параллельная, перспектива)"""
+        names = list(PROJECTIONS)
+        index = names.index(self.transform.projection)
+        self.transform.set_projection(names[(index + 1) % len(names)])
+
     def get_color_for_height(self, z, custom_color=None):
-        """   """
+        """Получение цвета по высоте"""
         if custom_color:
-            try:
-                if custom_color.startswith('0x'):
-                    hex_color = custom_color[2:]
-                else:
-                    hex_color = custom_color
-                r = int(hex_color[0:2], 16)
-                g = int(hex_color[2:4], 16)
-                b = int(hex_color[4:6], 16)
-                return (r, g, b)
-            except Exception:
-                pass
-
-        if self.max_z == self.min_z:
-            ratio = 0.5
-        else:
-            ratio = (z - self.min_z) / (self.max_z - self.min_z)
-
-        #    HSV
-        hue = 0.66 * (1 - ratio)  #  -> 
-        saturation = 0.8
-        value = 0.8 + 0.2 * ratio
-
-        # HSV to RGB
-        h = hue * 6
-        i = math.floor(h)
-        f = h - i
-        p = value * (1 - saturation)
-        q = value * (1 - f * saturation)
-        t = value * (1 - (1 - f) * saturation)
-
-        if i == 0:
-            r, g, b = value, t, p
-        elif i == 1:
-            r, g, b = q, value, p
-        elif i == 2:
-            r, g, b = p, value, t
-        elif i == 3:
-            r, g, b = p, q, value
-        elif i == 4:
-            r, g, b = t, p, value
-        else:
-            r, g, b = value, p, q
-
-        return (int(r * 255), int(g * 255), int(b * 255))
+            # Упакованный цвет 0xFFRRGGBB
+            return unpack_color(custom_color)
+
+        # Плавный градиент через HSV, заранее посчитанный в таблицу
+        self.height_lut.update(self.min_z, self.max_z)
+        return self.height_lut.color(z)
+
+    def update_colors(self):
+        """Пересчет буфера цветов вершин при смене диапазона высот или сетки"""
+        self.height_lut.update(self.min_z, self.max_z)
+        key = (self.lod_level, self.tile_window, self.height_lut.version)
+        if key == self.colors_key:
+            return
+        self.colors_key = key
+        colors = self.mesh.colors.ravel() if self.mesh.colors is not None else None
+        self.vertex_colors = self.height_lut.resolve(self.mesh.heights.ravel(), colors)
 
     def draw_model(self):
-        """    """
-        if not self.points:
-            return
+        """Отрисовка модели в выбранном режиме"""
+        if self.tiled_map is not None:
+            self.update_tile_window()
+        else:
+            self.select_lod()
 
-        #   
-        self.animation_time += 0.01
-        projected_points = []
-        points_3d = []
+        if not self.mesh.count:
+            return
 
-        for i, (point_3d, color) in enumerate(self.points):
-            #   
-            animated_z = point_3d.z
-            if self.auto_rotate:
-                animated_z += math.sin(self.animation_time + i * 0.1) * 0.5
+        # Проецируем все точки одним матричным преобразованием
+        z_offset = None
+        if self.auto_rotate:
+            # Небольшая волна высот: один sin по заранее посчитанным фазам
+            self.wave.step()
+            z_offset = self.wave.offsets(self.mesh.size)
 
-            animated_point = Point3D(point_3d.x, point_3d.y, animated_z)
-            rotated = self.rotate_point(
-                animated_point,
+        with self.profiler.stage('transform'):
+            screen, depth = self.transform.apply(
                 self.angle_x,
                 self.angle_y,
-                self.angle_z
+                self.angle_z,
+                self.scale,
+                self.offset_x,
+                self.offset_y,
+                z_offset=z_offset
             )
-            projected = self.project_point(rotated)
-            projected_points.append(projected)
-            points_3d.append(rotated)
 
-        #  
-        if self.render_mode == 'solid' and self.faces:
-            self.draw_solid(projected_points, points_3d)
+        # Тайлы, проекция которых не пересекает экран, не рисуем вовсе
+        margin = 2 + (0.5 * self.scale if self.auto_rotate else 0)
+        with self.profiler.stage('cull'):
+            visible = self.tile_index.visible_tiles(
+                lambda vertices: self.transform.apply(
+                    self.angle_x, self.angle_y, self.angle_z,
+                    self.scale, self.offset_x, self.offset_y, vertices=vertices),
+                self.width, self.height, near=self.near_depth(), margin=margin
+            )
+
+        # Режим отрисовки
+        if self.render_mode == 'solid' and len(self.faces):
+            self.draw_solid(screen, depth, self.tile_index.visible_faces(visible))
         elif self.render_mode == 'points':
-            self.draw_points(projected_points)
+            self.draw_points(screen)
         else:  # wireframe
-            self.draw_wireframe(projected_points)
-
-        #  
-        if self.show_axes:
-            self.draw_axes()
-
-    def draw_wireframe(self, projected_points):
-        """ """
-        for edge in self.edges:
-            if edge[0] < len(projected_points) and edge[1] < len(projected_points):
-                p1 = projected_points[edge[0]]
-                p2 = projected_points[edge[1]]
-
-                #     ()
-                dist = math.sqrt((p1[0] - p2[0])*2 + (p1[1] - p2[1])*2)
-                alpha = max(50, min(255, 255 - dist / 5))
-
-                color = list(self.wireframe_color)
-                color.append(int(alpha))
-
-                pygame.draw.line(self.screen, color[:3], p1, p2, 2)
-
-    def draw_solid(self, projected_points, points_3d):
-        """      """
-        #     (painter's algorithm)
-        sorted_faces = []
-        for i, face in enumerate(self.faces):
-            if i < len(self.colors):
-                #  Z   
-                avg_z = sum(points_3d[v].z for v in face) / 3
-                sorted_faces.append((avg_z, face, self.colors[i]))
-
-        #    Z (   )
-        sorted_faces.sort(reverse=True, key=lambda x: x[0])
-
-        #  
-        for _, face, color in sorted_faces:
-            if (face[0] < len(projected_points) and
-                    face[1] < len(projected_points) and
-                    face[2] < len(projected_points)):
-
-                points = [
-                    projected_points[face[0]],
-                    projected_points[face[1]],
-                    projected_points[face[2]]
-                ]
+            self.draw_wireframe(screen, self.tile_index.visible_edges(visible))
+
+    def draw_wireframe(self, screen, edge_ids):
+        """Отрисовка каркаса: только ребра видимых тайлов, обрезанные по экрану"""
+        with self.profiler.stage('clip'):
+            edges = self.tile_index.edges[edge_ids]
+            start, end, keep = clip_segments(screen[edges[:, 0]], screen[edges[:, 1]],
+                                             self.width, self.height, margin=2)
+
+        with self.profiler.stage('draw_lines'):
+            draw_lines(self.screen, start[keep], end[keep], self.wireframe_color, 2,
+                       self.line_backend, self.raster_threads)
+
+    def draw_solid(self, screen, depth, face_ids):
+        """Отрисовка залитых граней видимых тайлов выбранным способом"""
+        faces = self.tile_index.faces[face_ids]
+        if self.solid_backend == NUMPY:
+            self.draw_solid_zbuffer(screen, depth, faces, face_ids)
+            return
 
+        if self.face_slots is not None:
+            # Сетка: порядок от дальних граней к ближним задает направление взгляда
+            with self.profiler.stage('grid_order'):
+                face_ids = grid_face_order(self.face_slots, face_ids, len(self.faces),
+                                           self.transform.depth_axis())
+                faces = self.tile_index.faces[face_ids]
+        else:
+            # Сортируем по убыванию Z (дальние грани рисуем первыми)
+            with self.profiler.stage('depth_sort'):
+                order = np.argsort(-depth[faces].mean(axis=1), kind='stable')
+                face_ids, faces = face_ids[order], faces[order]
+        colors = self.colors[face_ids].tolist()
+        triangles = screen[faces].tolist()
+
+        # Рисуем грани
+        with self.profiler.stage('draw_faces'):
+            for color, points in zip(colors, triangles):
                 pygame.draw.polygon(self.screen, color, points)
-                pygame.draw.polygon(self.screen, (50, 50, 80), points, 1)
-
-    def draw_points(self, projected_points):
-        """ """
-        for i, (point, color) in enumerate(self.points):
-            if i < len(projected_points):
-                proj = projected_points[i]
-                point_color = self.get_color_for_height(point.z, color)
-
-                #     
-                size = max(2, int(5 + point.z))
-                pygame.draw.circle(self.screen, point_color, (int(proj[0]), int(proj[1])), size)
+                if self.solid_outline:
+                    pygame.draw.polygon(self.screen, self.outline_color, points, 1)
+
+    def draw_solid_zbuffer(self, screen, depth, faces, face_ids):
+        """Заливка граней в буфер поверхности с попиксельной проверкой глубины"""
+        # Грани за плоскостью камеры перспектива выворачивает - отбрасываем
+        face_depth = depth[faces]
+        near = self.near_depth()
+        front = face_depth.min(axis=1) > near if near is not None else None
+        if front is not None and not front.all():
+            faces, face_ids, face_depth = faces[front], face_ids[front], face_depth[front]
+
+        with self.profiler.stage('rasterize'):
+            draw_triangles(self.screen, screen[faces], face_depth, self.colors[face_ids],
+                           self.outline_color if self.solid_outline else None,
+                           self.raster_threads)
+
+    def draw_points(self, screen):
+        """Отрисовка точек, попадающих на экран"""
+        heights = self.mesh.heights.ravel()
+
+        # Размер точки зависит от высоты
+        valid = self.mesh.valid.ravel()
+        size = np.maximum(2, np.trunc(5 + np.where(valid, heights, 0)))
+        x = screen[:, 0]
+        y = screen[:, 1]
+        ids = np.flatnonzero(valid & (x + size >= 0) & (x - size <= self.width) &
+                             (y + size >= 0) & (y - size <= self.height))
+
+        self.update_colors()
+        colors = unpack_colors(self.vertex_colors[ids]).tolist()
+        with self.profiler.stage('draw_points'):
+            for point_color, px, py, radius in zip(colors, x[ids].astype(int).tolist(),
+                                                   y[ids].astype(int).tolist(),
+                                                   size[ids].astype(int).tolist()):
+                pygame.draw.circle(self.screen, point_color, (px, py), radius)
 
     def draw_axes(self):
-        """  """
-        origin = Point3D(0, 0, 0)
+        """Отрисовка осей координат"""
         axes = [
-            (Point3D(10, 0, 0), (255, 50, 50), 'X'),
-            (Point3D(0, 10, 0), (50, 255, 50), 'Y'),
-            (Point3D(0, 0, 10), (50, 50, 255), 'Z')
+            ((255, 50, 50), 'X'),
+            ((50, 255, 50), 'Y'),
+            ((50, 50, 255), 'Z')
         ]
+        # Начало координат и концы осей - одним преобразованием
+        origin, *ends = self.project_points(
+            [(0, 0, 0), (10, 0, 0), (0, 10, 0), (0, 0, 10)]).tolist()
 
-        for axis_end, color, label in axes:
-            axis_end_rot = self.rotate_point(
-                axis_end, self.angle_x, self.angle_y, self.angle_z)
-            start_proj = self.project_point(self.rotate_point(
-                origin, self.angle_x, self.angle_y, self.angle_z))
-            end_proj = self.project_point(axis_end_rot)
+        for (color, label), end_proj in zip(axes, ends):
+            pygame.draw.line(self.screen, color, origin, end_proj, 3)
 
-            pygame.draw.line(self.screen, color, start_proj, end_proj, 3)
-
-            # 
-            font_small = pygame.font.SysFont('Consolas', 18)
-            text = font_small.render(label, True, color)
+            # Подпись
+            text = self.font_small.render(label, True, color)
             self.screen.blit(text, (end_proj[0] + 5, end_proj[1] - 10))
 
-    def draw_ui(self):
-        """ """
-        # 
+    def ui_lines(self):
+        """Строки интерфейса: информация о модели и подсказки"""
         info = [
-            f"Points: {len(self.points)}",
+            f"Points: {self.mesh.count}",
             f"Edges: {len(self.edges)}",
             f"Faces: {len(self.faces)}",
             f"Height: {self.min_z:.1f} - {self.max_z:.1f}",
             f"Scale: {self.scale:.1f}",
-            f"Rotation X: {math.degrees(self.angle_x):.1f}",
-            f"Rotation Y: {math.degrees(self.angle_y):.1f}",
+            f"LOD: {self.lod_level} (step {self.mesh.step})",
+            f"Rotation X: {math.degrees(self.angle_x):.1f}°",
+            f"Rotation Y: {math.degrees(self.angle_y):.1f}°",
             f"Mode: {self.render_mode.upper()}",
             "",
             "CONTROLS:",
@@ -442,20 +956,40 @@ class ExtendedFDFRenderer:
             "T - Auto rotate",
             "G - Grid",
             "X - Axes",
+            "L - LOD",
+            f"B - Lines: {self.line_backend}",
+            f"Z - Solid: {self.solid_backend}",
+            f"O - Outline: {'ON' if self.solid_outline else 'OFF'}",
+            f"V - Projection: {self.transform.projection}",
+            f"P - Profiler: {'ON' if self.profiler.enabled else 'OFF'}",
+            f"F5 - Watch file: {'ON' if self.watcher is not None else 'OFF'}",
+            "F12 - Save trace",
             "ESC - Quit"
         ]
+        if self.tiled_map is not None:
+            info.insert(9, f"Tiles: {self.visible_tiles}/{self.tiled_map.tile_count}")
+        if self.loader is not None:
+            info.insert(0, self.loader.status())
+        if self.sequence is not None:
+            state = 'PAUSED' if self.sequence.paused else f"{self.sequence.fps} fps"
+            info.insert(9, f"Frame: {self.sequence.index + 1}/{len(self.sequence)} ({state}, "
+                           f"late {self.sequence.late})")
+            info.insert(-3, "SPACE - Pause sequence")
+        return info
 
+    def draw_ui(self):
+        """Отрисовка интерфейса"""
         y_offset = 10
-        for line in info:
+        for line in self.ui_lines():
             text = self.font.render(line, True, self.text_color)
             self.screen.blit(text, (10, y_offset))
             y_offset += 24
 
-        # 
+        # Заголовок
         title = self.font_large.render("FdF EXTENDED VIEWER", True, (255, 255, 200))
         self.screen.blit(title, (self.width - 300, 10))
 
-        # 
+        # Статусы
         if self.auto_rotate:
             status = self.font.render("AUTO ROTATE: ON", True, (0, 255, 100))
             self.screen.blit(status, (self.width - 200, 50))
@@ -464,41 +998,42 @@ class ExtendedFDFRenderer:
             status = self.font.render("GRID: ON", True, (100, 200, 255))
             self.screen.blit(status, (self.width - 200, 80))
 
+    def draw_background(self):
+        """Фоновый слой: сетка (если включена)"""
+        if self.show_grid:
+            self.draw_grid()
+
     def draw_grid(self):
-        """ """
+        """Отрисовка сетки"""
         grid_size = 12
         step = 2
 
-        for i in range(-grid_size, grid_size + 1, step):
-            for axis in ['x', 'y']:
-                if axis == 'x':
-                    start = Point3D(i, -grid_size, 0)
-                    end = Point3D(i, grid_size, 0)
-                else:
-                    start = Point3D(-grid_size, i, 0)
-                    end = Point3D(grid_size, i, 0)
+        # Линии x = i и y = i в плоскости z = 0 - одним преобразованием
+        ticks = np.arange(-grid_size, grid_size + 1, step, dtype=np.float32)
+        zeros = np.zeros_like(ticks)
+        ends = np.full_like(ticks, grid_size)
+        start = np.concatenate((np.column_stack((ticks, -ends, zeros)),
+                                np.column_stack((-ends, ticks, zeros))))
+        end = np.concatenate((np.column_stack((ticks, ends, zeros)),
+                              np.column_stack((ends, ticks, zeros))))
+        screen = self.project_points(np.concatenate((start, end))).tolist()
 
-                start_rot = self.rotate_point(
-                    start, self.angle_x, self.angle_y, self.angle_z)
-                end_rot = self.rotate_point(
-                    end, self.angle_x, self.angle_y, self.angle_z)
+        for i, start_proj, end_proj in zip(np.tile(ticks.astype(int), 2).tolist(),
+                                           screen[:len(start)], screen[len(start):]):
+            alpha = 50 if i % 4 == 0 else 30
+            color = (*self.grid_color[:3], alpha)
 
-                start_proj = self.project_point(start_rot)
-                end_proj = self.project_point(end_rot)
-
-                alpha = 50 if i % 4 == 0 else 30
-                color = (*self.grid_color[:3], alpha)
-
-                pygame.draw.line(self.screen, color, start_proj, end_proj, 1)
+            pygame.draw.line(self.screen, color, start_proj, end_proj, 1)
 
     def handle_keys(self):
-        """ """
+        """Обработка зажатых клавиш; True, если камера изменилась"""
+        camera = self.camera_key()
         keys = pygame.key.get_pressed()
         rot_speed = 0.03
         zoom_speed = 1.0
         pan_speed = 5
 
-        # 
+        # Вращение
         if keys[pygame.K_w]:
             self.angle_x -= rot_speed
         if keys[pygame.K_s]:
@@ -512,13 +1047,13 @@ class ExtendedFDFRenderer:
         if keys[pygame.K_e]:
             self.angle_z += rot_speed
 
-        # 
+        # Масштаб
         if keys[pygame.K_PLUS] or keys[pygame.K_EQUALS]:
             self.scale += zoom_speed
         if keys[pygame.K_MINUS]:
             self.scale = max(1, self.scale - zoom_speed)
 
-        # 
+        # Смещение
         if keys[pygame.K_LEFT]:
             self.offset_x -= pan_speed
         if keys[pygame.K_RIGHT]:
@@ -528,78 +1063,202 @@ class ExtendedFDFRenderer:
         if keys[pygame.K_DOWN]:
             self.offset_y += pan_speed
 
+        return self.camera_key() != camera
+
+    def idle_timeout(self):
+        """Сколько ждать событий окна, пока кадр не меняется (с; None - без срока)
+
+        Срок задает ближайшая фоновая работа: ход загрузки, проверка файла,
+        следующий кадр последовательности.
+        """
+        timeouts = []
+        if self.loader is not None:
+            timeouts.append(LOADING_REFRESH)
+        if self.watcher is not None:
+            timeouts.append(self.watcher.interval)
+        if self.sequence is not None and len(self.sequence) > 1 and not self.sequence.paused:
+            timeouts.append(0.5 / self.sequence.fps)
+        return min(timeouts, default=None)
+
+    def wait_events(self, timeout=0):
+        """События окна; timeout - сколько ждать первого (0 - не ждать, None - без срока)"""
+        if timeout == 0:
+            return pygame.event.get()
+        if timeout is None:
+            event = pygame.event.wait()
+        else:
+            event = pygame.event.wait(max(1, int(timeout * 1000)))
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event] + pygame.event.get()
+
+    def handle_events(self, events=None):
+        """Обработка событий окна; False, если пора выходить"""
+        running = True
+        for event in pygame.event.get() if events is None else events:
+            if event.type != pygame.MOUSEMOTION:
+                # Нажатия, изменения окна и т.п. - кадр нужно перерисовать
+                self.dirty = True
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_r:
+                    # Сброс
+                    self.scale = 20
+                    self.offset_x = self.width // 2
+                    self.offset_y = self.height // 2
+                    self.angle_x = math.radians(30)
+                    self.angle_y = math.radians(-45)
+                    self.angle_z = 0
+                elif event.key == pygame.K_t:
+                    self.auto_rotate = not self.auto_rotate
+                elif event.key == pygame.K_g:
+                    self.show_grid = not self.show_grid
+                elif event.key == pygame.K_x:
+                    self.show_axes = not self.show_axes
+                elif event.key == pygame.K_l:
+                    self.lod_enabled = not self.lod_enabled
+                elif event.key == pygame.K_b:
+                    # Переключение растеризатора линий
+                    index = LINE_BACKENDS.index(self.line_backend)
+                    self.line_backend = LINE_BACKENDS[(index + 1) % len(LINE_BACKENDS)]
+                elif event.key == pygame.K_z:
+                    # Переключение способа заливки граней
+                    index = SOLID_BACKENDS.index(self.solid_backend)
+                    self.solid_backend = SOLID_BACKENDS[(index + 1) % len(SOLID_BACKENDS)]
+                elif event.key == pygame.K_o:
+                    self.solid_outline = not self.solid_outline
+                elif event.key == pygame.K_v:
+                    self.toggle_projection()
+                elif event.key == pygame.K_1:
+                    self.render_mode = 'wireframe'
+                elif event.key == pygame.K_2:
+                    self.render_mode = 'points'
+                elif event.key == pygame.K_3:
+                    self.render_mode = 'solid'
+                elif event.key == pygame.K_SPACE and self.sequence is not None:
+                    self.sequence.toggle_pause()
+                elif event.key == pygame.K_p:
+                    self.profiler.toggle()
+                elif event.key == pygame.K_F5:
+                    self.toggle_watch()
+                elif event.key == pygame.K_F12:
+                    self.save_trace()
+        return running
+
+    def save_trace(self):
+        """Сохранение замеров кадров в Chrome trace JSON"""
+        if not self.profiler.count:
+            print("Profiler is off: press P to start recording")
+            return False
+        try:
+            filename = self.profiler.dump()
+        except OSError as e:
+            print(f"Error writing trace: {e}")
+            return False
+        print(f"Saved trace to {filename} (open in ui.perfetto.dev or chrome://tracing)")
+        return True
+
     def run(self, filename):
-        """ """
-        if not self.load_file(filename):
-            print(f"Failed to load file: {filename}")
-            return
+        """Основной цикл"""
+        # Окно работает сразу, карта грузится в фоне
+        self.filename = filename
+        self.loader = BackgroundLoader(self, filename)
 
+        profiler = self.profiler
         running = True
+        self.dirty = True
         while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        running = False
-                    elif event.key == pygame.K_r:
-                        # 
-                        self.scale = 20
-                        self.offset_x = self.width // 2
-                        self.offset_y = self.height // 2
-                        self.angle_x = math.radians(30)
-                        self.angle_y = math.radians(-45)
-                        self.angle_z = 0
-                    elif event.key == pygame.K_t:
-                        self.auto_rotate = not self.auto_rotate
-                    elif event.key == pygame.K_g:
-                        self.show_grid = not self.show_grid
-                    elif event.key == pygame.K_x:
-                        self.show_axes = not self.show_axes
-                    elif event.key == pygame.K_1:
-                        self.render_mode = 'wireframe'
-                    elif event.key == pygame.K_2:
-                        self.render_mode = 'points'
-                    elif event.key == pygame.K_3:
-                        self.render_mode = 'solid'
-
-            # -
+            # Кадр сам не меняется - ждем событие окна или срок фоновой работы
+            active = self.dirty or self.auto_rotate or self.keys_active
+            timeout = 0 if active else self.idle_timeout()
+            profiler.frame()
+            with profiler.stage('idle'):
+                events = self.wait_events(timeout)
+            with profiler.stage('events'):
+                running = self.handle_events(events)
+
+            if self.loader is not None:
+                with profiler.stage('loading'):
+                    if self.poll_loading() is False:
+                        if self.watcher is None:
+                            print(f"Failed to load file: {filename}")
+                            running = False
+                        else:
+                            # Файл могли сохранить не полностью - ждем следующего изменения
+                            print(f"Failed to reload {filename}, keeping the loaded map")
+            # Ход загрузки на HUD, предпросмотр и готовая модель
+            status = self.loader.status() if self.loader is not None else None
+            if status != self.loading_status:
+                self.loading_status = status
+                self.dirty = True
+
+            if self.sequence is not None:
+                with profiler.stage('sequence'):
+                    if self.advance_sequence():
+                        self.dirty = True
+
+            if self.watcher is not None and self.loader is None:
+                with profiler.stage('watch'):
+                    if self.check_watch():
+                        self.dirty = True
+
+            # Авто-вращение
             if self.auto_rotate:
                 self.angle_y += 0.01
                 self.angle_x += 0.005
-
-            #  
-            self.handle_keys()
-
-            # 
-            self.screen.fill(self.bg_color)
-
-            if self.show_grid:
-                self.draw_grid()
-
-            self.draw_model()
-            self.draw_ui()
-
-            pygame.display.flip()
-            self.clock.tick(self.fps)
-
+                self.dirty = True
+
+            # Обработка клавиш
+            with profiler.stage('handle_keys'):
+                self.keys_active = self.handle_keys()
+                if self.keys_active:
+                    self.dirty = True
+
+            if not self.dirty:
+                continue
+            self.dirty = False
+
+            # Отрисовка из кэшированных слоев
+            with profiler.stage('render'):
+                self.render_frame()
+            if profiler.enabled:
+                with profiler.stage('profiler'):
+                    profiler.draw_graph(self.screen, self.font_small)
+
+            with profiler.stage('flip'):
+                pygame.display.flip()
+            # Предел частоты кадров, пока модель вращается или меняется
+            with profiler.stage('wait'):
+                self.clock.tick(self.fps)
+
+        if self.sequence is not None:
+            self.sequence.stop()
+        if self.watcher is not None:
+            self.watcher.stop()
         pygame.quit()
         sys.exit()
 
 
 def main():
-    """ """
-    if len(sys.argv) != 2:
-        print("Usage: python fdf_bonus.py <filename>")
+    """Точка входа"""
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python fdf_bonus.py <filename> [image_max_size]")
         print("Supports: .fdf, .png, .jpg, .jpeg, .bmp, .tiff")
         print("Example: python fdf_bonus.py test_maps/42.fdf")
-        print("Example: python fdf_bonus.py test_images/mountain.jpg")
+        print("Example: python fdf_bonus.py test_images/mountain.jpg 1000")
+        print("Example: python fdf_bonus.py frames/  (directory = heightmap sequence)")
+        print("Headless: python fdf_render.py <file> -o snapshot.png")
         return
 
     filename = sys.argv[1]
     renderer = ExtendedFDFRenderer()
+    if len(sys.argv) == 3:
+        renderer.image_max_size = int(sys.argv[2])
     renderer.run(filename)
 
 
-if _name_ == "_main_":
-    main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
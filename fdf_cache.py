@@ -0,0 +1,156 @@
+"""
+FdF map cache - persistent on-disk cache of parsed maps and mesh topology.
+Each entry is a directory of raw .npy arrays that are memory-mapped on load.
+Entries are keyed by file path, validated against the file size and mtime
+and evicted in LRU order once the cache grows beyond its size limit.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+META_FILE = 'meta.json'
+
+
+def default_cache_dir():
+    """Каталог кэша: $FDF_CACHE_DIR или ~/.cache/fdf"""
+    path = os.environ.get('FDF_CACHE_DIR')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'fdf')
+
+
+class MapCache:
+    """Кэш разобранных карт с вытеснением давно не использованных записей"""
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def _source_info(self, filename):
+        """Путь, размер и время изменения исходного файла"""
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime_ns
+
+    def _entry_dir(self, path, variant):
+        digest = hashlib.sha1(f"{path}|{variant}|v{CACHE_VERSION}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest)
+
+    def load(self, filename, variant=''):
+        """Чтение записи: словарь массивов (memory-mapped) и метаданных или None"""
+        if not self.enabled:
+            return None
+        try:
+            path, size, mtime = self._source_info(filename)
+            entry = self._entry_dir(path, variant)
+            with open(os.path.join(entry, META_FILE)) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        # Файл изменился - запись устарела
+        if (meta.get('version') != CACHE_VERSION or meta.get('size') != size or
+                meta.get('mtime') != mtime):
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        try:
+            data = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+                    for name in meta['arrays']}
+        except (OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        data.update(meta.get('values', {}))
+        # Отметка использования для LRU
+        try:
+            os.utime(os.path.join(entry, META_FILE))
+        except OSError:
+            pass
+        return data
+
+    def store(self, filename, variant='', values=None, **arrays):
+        """Сохранение массивов для файла; ошибки записи не прерывают загрузку"""
+        if not self.enabled:
+            return False
+        tmp = None
+        try:
+            path, size, mtime = self._source_info(filename)
+            entry = self._entry_dir(path, variant)
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # Пишем во временный каталог и переименовываем целиком
+            tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+            names = []
+            for name, array in arrays.items():
+                if array is None:
+                    continue
+                np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+                names.append(name)
+
+            meta = {
+                'version': CACHE_VERSION,
+                'path': path,
+                'variant': variant,
+                'size': size,
+                'mtime': mtime,
+                'arrays': names,
+                'values': values or {},
+            }
+            with open(os.path.join(tmp, META_FILE), 'w') as file:
+                json.dump(meta, file)
+
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        except OSError as e:
+            print(f"Warning: could not write cache: {e}")
+            if tmp:
+                shutil.rmtree(tmp, ignore_errors=True)
+            return False
+
+        self.evict()
+        return True
+
+    def entries(self):
+        """Список записей: (время использования, размер, каталог)"""
+        result = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return result
+
+        for name in names:
+            entry = os.path.join(self.cache_dir, name)
+            meta = os.path.join(entry, META_FILE)
+            if name.startswith('.') or not os.path.isfile(meta):
+                continue
+            try:
+                used = os.path.getmtime(meta)
+                size = sum(f.stat().st_size for f in os.scandir(entry))
+            except OSError:
+                continue
+            result.append((used, size, entry))
+        return result
+
+    def evict(self):
+        """Удаление самых старых записей, пока кэш больше max_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Очистка всего кэша"""
+        for _, _, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
@@ -0,0 +1,110 @@
+"""
+FdF colors - packed per-vertex color buffers and a height-to-color LUT.
+Gradients are evaluated once into a lookup table that is rebuilt only when
+the palette or the height range changes; per-frame coloring is a pure
+integer table lookup.
+"""
+import numpy as np
+from fdf_mesh import COLOR_FLAG
+
+
+LUT_SIZE = 4096
+
+
+def pack_colors(rgb):
+    """Упаковка массива (N, 3) в uint32 0xFFRRGGBB"""
+    rgb = np.asarray(rgb, dtype=np.uint32)
+    return COLOR_FLAG | (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def unpack_colors(packed):
+    """Распаковка массива uint32 цветов в (N, 3) uint8"""
+    packed = np.asarray(packed, dtype=np.uint32)
+    rgb = np.empty(packed.shape + (3,), dtype=np.uint8)
+    rgb[..., 0] = packed >> 16
+    rgb[..., 1] = packed >> 8
+    rgb[..., 2] = packed
+    return rgb
+
+
+def linear_gradient(ratio, low_color, high_color):
+    """Линейный градиент от low_color к high_color (как в FDFRenderer)"""
+    ratio = ratio[:, None]
+    rgb = np.array(low_color) * (1 - ratio) + np.array(high_color) * ratio
+    return np.clip(np.trunc(rgb), 0, 255)
+
+
+def hsv_gradient(ratio):
+    """Градиент через HSV: синий -> красный (как в ExtendedFDFRenderer)"""
+    hue = 0.66 * (1 - ratio)
+    saturation = 0.8
+    value = 0.8 + 0.2 * ratio
+
+    h = hue * 6
+    i = np.floor(h)
+    f = h - i
+    p = value * (1 - saturation)
+    q = value * (1 - f * saturation)
+    t = value * (1 - (1 - f) * saturation)
+
+    sectors = [i == 0, i == 1, i == 2, i == 3, i == 4]
+    r = np.select(sectors, [value, q, p, p, t], value)
+    g = np.select(sectors, [t, value, value, q, p], p)
+    b = np.select(sectors, [p, p, t, value, value], q)
+    return np.trunc(np.stack([r, g, b], axis=-1) * 255)
+
+
+class HeightLUT:
+    """Таблица цветов по высоте; gradient(ratio, *palette) -> (N, 3)"""
+
+    def __init__(self, gradient, size=LUT_SIZE):
+        self.gradient = gradient
+        self.size = size
+        self.table = np.zeros(size, dtype=np.uint32)
+        self.min_z = 0.0
+        self.max_z = 0.0
+        # Номер версии таблицы: меняется при каждой перестройке
+        self.version = 0
+        self._key = None
+
+    def update(self, min_z, max_z, *palette):
+        """Перестройка таблицы, только если изменились палитра или диапазон"""
+        key = (min_z, max_z, palette)
+        if key == self._key:
+            return False
+        self._key = key
+        self.min_z = float(min_z)
+        self.max_z = float(max_z)
+
+        if self.max_z == self.min_z:
+            ratio = np.full(self.size, 0.5)
+        else:
+            ratio = np.linspace(0.0, 1.0, self.size)
+        self.table = pack_colors(self.gradient(ratio, *palette))
+        self.version += 1
+        return True
+
+    def index(self, z):
+        """Номер записи таблицы для высот z (пропуски - нулевая запись)"""
+        span = self.max_z - self.min_z
+        if not span:
+            return np.zeros(np.shape(z), dtype=np.intp)
+        ratio = (np.asarray(z, dtype=np.float32) - self.min_z) * ((self.size - 1) / span)
+        ratio = np.nan_to_num(ratio)
+        return np.clip(np.rint(ratio), 0, self.size - 1).astype(np.intp)
+
+    def lookup(self, z):
+        """Упакованные цвета для массива высот"""
+        return self.table[self.index(z)]
+
+    def resolve(self, heights, colors=None):
+        """Буфер цветов вершин: заданный цвет точки или цвет по высоте"""
+        packed = self.lookup(heights)
+        if colors is not None:
+            packed = np.where(colors != 0, colors, packed)
+        return packed
+
+    def color(self, z):
+        """Цвет одной высоты в виде кортежа (r, g, b)"""
+        packed = int(self.table[self.index(z)])
+        return ((packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF)
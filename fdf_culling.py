@@ -0,0 +1,201 @@
+"""
+FdF viewport culling - spatial tile index over a grid mesh.
+Edges and faces are bucketed by grid tile; each frame whole tiles whose
+projected 3D bounds miss the screen are rejected, and the surviving
+segments are clipped against the screen rectangle in bulk.
+"""
+import warnings
+import numpy as np
+
+
+DEFAULT_TILE_SIZE = 32
+# Запас вокруг экрана, внутри которого концы отрезков не обрезаются
+GUARD_BAND = 1024
+
+
+def box_corners(x0, x1, y0, y1, z0, z1):
+    """8 углов ограничивающих параллелепипедов: массив (T * 8, 3)"""
+    corners = np.stack([
+        np.stack([x, y, z], axis=-1)
+        for x in (x0, x1) for y in (y0, y1) for z in (z0, z1)
+    ], axis=1)
+    return np.nan_to_num(corners).reshape(-1, 3)
+
+
+def boxes_on_screen(screen, width, height, margin=0):
+    """Маска параллелепипедов, чья экранная проекция (T * 8, 2) пересекает экран"""
+    screen = screen.reshape(-1, 8, 2)
+    low = screen.min(axis=1)
+    high = screen.max(axis=1)
+    return ((high[:, 0] >= -margin) & (low[:, 0] <= width + margin) &
+            (high[:, 1] >= -margin) & (low[:, 1] <= height + margin))
+
+
+def gather_ranges(starts, counts):
+    """Индексы всех элементов диапазонов [start, start + count)"""
+    total = int(counts.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return shifts + np.arange(total)
+
+
+def _clip_params(p1, p2, x0, y0, x1, y1):
+    """Параметры Лян-Барски t0, t1 отрезков p1 -> p2 для прямоугольника"""
+    dx = p2[:, 0] - p1[:, 0]
+    dy = p2[:, 1] - p1[:, 1]
+    t0 = np.zeros(len(p1), dtype=np.float32)
+    t1 = np.ones(len(p1), dtype=np.float32)
+    keep = np.isfinite(dx) & np.isfinite(dy)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-dx, p1[:, 0] - x0), (dx, x1 - p1[:, 0]),
+                     (-dy, p1[:, 1] - y0), (dy, y1 - p1[:, 1])):
+            parallel = p == 0
+            keep &= ~(parallel & (q < 0))
+            r = q / p
+            entering = ~parallel & (p < 0)
+            leaving = ~parallel & (p > 0)
+            t0 = np.where(entering, np.maximum(t0, r), t0)
+            t1 = np.where(leaving, np.minimum(t1, r), t1)
+
+    keep &= t0 <= t1
+    return t0, t1, keep
+
+
+def clip_segments(p1, p2, width, height, margin=0, guard=GUARD_BAND):
+    """Отсечение отрезков по экрану (Лян-Барски) для всех сразу
+
+    keep - отрезок пересекает экран, расширенный на margin пикселей
+    (толщина линии). Концы обрезаются только по полосе
+    guard пикселей вокруг экрана: отрезки внутри нее рисуются без
+    изменений, а огромные координаты при сильном приближении не доходят
+    до растеризатора.
+    """
+    _, _, keep = _clip_params(p1, p2, -margin, -margin, width + margin, height + margin)
+    t0, t1, _ = _clip_params(p1, p2, -guard, -guard, width + guard, height + guard)
+    delta = p2 - p1
+    start = np.where((t0 > 0)[:, None], p1 + t0[:, None] * delta, p1)
+    end = np.where((t1 < 1)[:, None], p1 + t1[:, None] * delta, p2)
+    return start, end, keep
+
+
+class TileIndex:
+    """Разбиение ребер и граней сетки на тайлы с 3D границами"""
+
+    def __init__(self, mesh, edges, faces=None, tile_size=DEFAULT_TILE_SIZE):
+        self.mesh = mesh
+        self.tile_size = tile_size
+        rows, cols = mesh.shape
+        self.tiles_y = max(1, -(-rows // tile_size))
+        self.tiles_x = max(1, -(-cols // tile_size))
+        self.bounds = self._tile_bounds()
+
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.edge_order, self.edge_starts, self.edge_counts = self._bucket(self.edges[:, 0])
+        self.faces = None
+        if faces is not None:
+            self.faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+            self.face_order, self.face_starts, self.face_counts = \
+                self._bucket(self.faces[:, 0])
+
+    def update_bounds(self, row0=0, row1=None):
+        """Пересчет 3D границ тайлов после изменения высот (топология та же)
+
+        row0, row1 - измененные ряды сетки; пересчитываются только
+        задевающие их ряды тайлов.
+        """
+        if row1 is None:
+            self.bounds = self._tile_bounds()
+            return
+        size = self.tile_size
+        # Ряд на верхней границе тайла входит и в запас тайла над ним
+        first = max(0, row0 - 1) // size
+        last = min(self.tiles_y, (row1 - 1) // size + 1)
+        if first >= last:
+            return
+        low, high = self._height_range(first, last)
+        self.bounds[4].reshape(self.tiles_y, self.tiles_x)[first:last] = low
+        self.bounds[5].reshape(self.tiles_y, self.tiles_x)[first:last] = high
+
+    def _tile_of(self, vertex):
+        """Номер тайла для индекса вершины row * cols + col"""
+        rows, cols = np.divmod(vertex, max(1, self.mesh.cols))
+        return (rows // self.tile_size) * self.tiles_x + cols // self.tile_size
+
+    def _bucket(self, first_vertex):
+        """Сортировка примитивов по тайлам: порядок, начала и размеры корзин"""
+        tiles = self._tile_of(first_vertex)
+        order = np.argsort(tiles, kind='stable')
+        counts = np.bincount(tiles, minlength=self.tiles_y * self.tiles_x)
+        starts = np.cumsum(counts) - counts
+        return order, starts, counts
+
+    def _height_range(self, first, last):
+        """Минимум и максимум высот тайлов рядов [first, last) с запасом в одну точку"""
+        mesh = self.mesh
+        size = self.tile_size
+        tiles_y = last - first
+        padded = np.full((tiles_y * size + 1, self.tiles_x * size + 1),
+                         np.nan, dtype=np.float32)
+        part = mesh.heights[first * size:last * size + 1]
+        padded[:len(part), :mesh.cols] = part
+
+        # Минимум/максимум по блокам (size + 1) x (size + 1)
+        body = padded[:-1, :-1].reshape(tiles_y, size, self.tiles_x, size)
+        with warnings.catch_warnings():
+            # Тайлы целиком из пропусков дают NaN и предупреждение
+            warnings.simplefilter('ignore', RuntimeWarning)
+            low = np.nanmin(body, axis=(1, 3))
+            high = np.nanmax(body, axis=(1, 3))
+            edge_rows = padded[size::size, :-1].reshape(tiles_y, self.tiles_x, size)
+            edge_cols = padded[:-1, size::size].reshape(tiles_y, size, self.tiles_x)
+            low = np.fmin(low, np.fmin(np.nanmin(edge_rows, axis=2),
+                                       np.nanmin(edge_cols, axis=1)))
+            high = np.fmax(high, np.fmax(np.nanmax(edge_rows, axis=2),
+                                         np.nanmax(edge_cols, axis=1)))
+            corner = padded[size::size, size::size]
+            low = np.fmin(low, corner)
+            high = np.fmax(high, corner)
+        return low, high
+
+    def _tile_bounds(self):
+        """Границы тайлов с запасом в одну точку (ребра на стыке тайлов)"""
+        mesh = self.mesh
+        size = self.tile_size
+        low, high = self._height_range(0, self.tiles_y)
+
+        tx = np.arange(self.tiles_x)
+        ty = np.arange(self.tiles_y)
+        x0 = tx * size * mesh.step + mesh.origin_x
+        x1 = (tx + 1) * size * mesh.step + mesh.origin_x
+        y0 = ty * size * mesh.step + mesh.origin_y
+        y1 = (ty + 1) * size * mesh.step + mesh.origin_y
+        grid_x0, grid_y0 = np.meshgrid(x0, y0)
+        grid_x1, grid_y1 = np.meshgrid(x1, y1)
+        return (grid_x0.ravel(), grid_x1.ravel(), grid_y0.ravel(), grid_y1.ravel(),
+                low.ravel(), high.ravel())
+
+    def visible_tiles(self, project, width, height, near=None, margin=0):
+        """Маска видимых тайлов; project(vertices) -> (экранные (N, 2), глубина (N,))
+
+        Тайлы, у которых хоть один угол ближе плоскости near (перспектива
+        за камерой), считаются видимыми - их проекция ненадежна. margin -
+        запас в пикселях (толщина линий, анимация высот).
+        """
+        low = self.bounds[4]
+        screen, depth = project(box_corners(*self.bounds))
+        visible = boxes_on_screen(screen, width, height, margin)
+        if near is not None:
+            visible |= (depth.reshape(-1, 8) <= near).any(axis=1)
+        return ~np.isnan(low) & visible
+
+    def visible_edges(self, visible):
+        """Индексы ребер из видимых тайлов"""
+        ids = gather_ranges(self.edge_starts[visible], self.edge_counts[visible])
+        return self.edge_order[ids]
+
+    def visible_faces(self, visible):
+        """Индексы граней из видимых тайлов"""
+        ids = gather_ranges(self.face_starts[visible], self.face_counts[visible])
+        return self.face_order[ids]
@@ -0,0 +1,305 @@
+"""
+FdF image input - decoding heightmap images in horizontal bands.
+Uncompressed rasters (TIFF, PGM, BMP) and multi-strip/tiled images are
+decoded band by band so that huge inputs never have to be held in memory
+at once; other formats fall back to a single full decode. Heightmaps are
+converted band by band into one float32 array, optionally downscaled on
+the way (JPEG DCT scaling via draft, box reduction for other formats).
+"""
+import math
+import numpy as np
+from PIL import Image
+
+
+DEFAULT_BAND_ROWS = 256
+# Карты высот - локальные файлы; предупреждение PIL о "бомбе" начинается с ~89M
+MAX_IMAGE_PIXELS = 250_000_000
+if Image.MAX_IMAGE_PIXELS is not None and Image.MAX_IMAGE_PIXELS < MAX_IMAGE_PIXELS:
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Байт на пиксель для несжатых raw режимов PIL
+RAW_PIXEL_BYTES = {
+    '1': None, 'L': 1, 'P': 1, 'I;8': 1,
+    'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2,
+    'I;32': 4, 'I;32L': 4, 'I;32B': 4, 'I': 4,
+    'F': 4, 'F;32F': 4, 'F;32BF': 4,
+    'RGB': 3, 'BGR': 3, 'RGBA': 4, 'RGBX': 4, 'BGRX': 4,
+}
+
+
+def _make_tile(tile, extents, offset=None):
+    """Копия описания тайла PIL с новыми границами (и смещением)"""
+    name, _, old_offset, args = tile
+    offset = old_offset if offset is None else offset
+    if hasattr(tile, '_replace'):
+        return tile._replace(extents=extents, offset=offset)
+    return (name, extents, offset, args)
+
+
+def _split_raw_tile(tile, band_rows):
+    """Разбиение одного несжатого тайла на полосы строк"""
+    name, (x0, y0, x1, y1), offset, args = tile
+    if isinstance(args, str):
+        args = (args, 0, 1)
+    rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+    pixel_bytes = RAW_PIXEL_BYTES.get(rawmode)
+    if pixel_bytes is None:
+        return None
+    if not stride:
+        stride = (x1 - x0) * pixel_bytes
+
+    bands = []
+    for top in range(y0, y1, band_rows):
+        bottom = min(top + band_rows, y1)
+        if orientation < 0:
+            # Строки хранятся снизу вверх (BMP)
+            start = offset + (y1 - bottom) * stride
+        else:
+            start = offset + (top - y0) * stride
+        bands.append((top, bottom, [_make_tile(tile, (x0, top, x1, bottom), start)]))
+    return bands
+
+
+def _plan_bands(img, band_rows):
+    """План полос: [(top, bottom, tiles)] или None, если формат не делится"""
+    tiles = list(getattr(img, 'tile', None) or [])
+    if not tiles:
+        return None
+
+    if len(tiles) == 1 and tiles[0][0] == 'raw':
+        return _split_raw_tile(tiles[0], band_rows)
+
+    # Многотайловые изображения: группируем тайлы по диапазону строк
+    groups = {}
+    for tile in tiles:
+        x0, y0, x1, y1 = tile[1]
+        groups.setdefault((y0, y1), []).append(tile)
+    spans = sorted(groups)
+    if len(spans) < 2 or any(a[1] > b[0] for a, b in zip(spans, spans[1:])):
+        return None
+    return [(top, bottom, groups[(top, bottom)]) for top, bottom in spans]
+
+
+def _decode_band(filename, top, bottom, tiles):
+    """Декодирование одной полосы как отдельного изображения
+
+    Полоса держит свой дескриптор файла (Pillow не закрывает TIFF после
+    load) - вызывающий закрывает ее, когда пиксели скопированы.
+    """
+    band = Image.open(filename)
+    try:
+        band._size = (band.size[0], bottom - top)
+        if hasattr(band, '_tile_size'):
+            # TIFF выделяет буфер по своему размеру, а не по size
+            band._tile_size = band._size
+        band.tile = [_make_tile(tile, (tile[1][0], tile[1][1] - top,
+                                       tile[1][2], tile[1][3] - top))
+                     for tile in tiles]
+        band.load()
+    except Exception:
+        band.close()
+        raise
+    return band
+
+
+def iter_image_bands(filename, band_rows=DEFAULT_BAND_ROWS):
+    """Потоковое чтение изображения полосами: (первая строка, PIL.Image)
+
+    Полоса действительна до следующего шага: после него она закрывается.
+    """
+    with Image.open(filename) as img:
+        yield from _image_bands(img, filename, band_rows)
+
+
+def _image_bands(img, filename, band_rows):
+    """Полосы открытого изображения img (файл filename)"""
+    plan = None
+    try:
+        plan = _plan_bands(img, band_rows)
+    except (TypeError, ValueError):
+        plan = None
+
+    if plan:
+        try:
+            first = _decode_band(filename, *plan[0])
+        except Exception:
+            plan = None
+
+    if not plan:
+        # Формат не поддерживает частичное чтение - декодируем целиком
+        img.load()
+        for top in range(0, img.size[1], band_rows):
+            bottom = min(top + band_rows, img.size[1])
+            yield top, img.crop((0, top, img.size[0], bottom))
+        return
+
+    band = first
+    for index, (top, bottom, tiles) in enumerate(plan):
+        try:
+            if index:
+                band = _decode_band(filename, top, bottom, tiles)
+            yield top, band
+        finally:
+            band.close()
+
+
+# Режимы PIL с высотами без 8-битного квантования и их максимум для инверсии
+DEM_MODES = {
+    'I;16': 65535, 'I;16L': 65535, 'I;16B': 65535, 'I;16N': 65535,
+    'I': 0, 'F': 0,
+}
+# GDAL хранит значение nodata строкой в этом теге TIFF
+GDAL_NODATA_TAG = 42113
+
+
+class HeightScale:
+    """Перевод значений пикселей в высоты: (top - v если invert) * scale + offset
+
+    Для 8-битных изображений по умолчанию светлое ниже: (255 - v) / 10.
+    Для 16-битных и float растров (DEM) значения берутся как есть.
+    Пиксели, равные nodata (и NaN), становятся дырами сетки.
+    """
+
+    def __init__(self, mode, scale=None, offset=None, invert=None, nodata=None):
+        dem = mode in DEM_MODES
+        self.top = DEM_MODES[mode] if dem else 255
+        self.scale = float(scale if scale is not None else (1.0 if dem else 0.1))
+        self.offset = float(offset if offset is not None else 0.0)
+        self.invert = bool(invert if invert is not None else not dem)
+        self.nodata = nodata
+
+    def apply(self, values):
+        """Массив значений пикселей -> новый массив высот float32"""
+        values = np.asarray(values)
+        heights = values.astype(np.float32)
+        if self.invert:
+            np.subtract(np.float32(self.top), heights, out=heights)
+        if self.scale != 1.0:
+            heights *= np.float32(self.scale)
+        if self.offset:
+            heights += np.float32(self.offset)
+        if self.nodata is not None:
+            heights[values == self._nodata_value(values.dtype)] = np.nan
+        return heights
+
+    def _nodata_value(self, dtype):
+        """nodata в типе пикселей: float32 растры хранят его с потерей точности"""
+        if np.issubdtype(dtype, np.floating):
+            return dtype.type(self.nodata)
+        if float(self.nodata).is_integer():
+            return int(self.nodata)
+        return None
+
+
+def image_nodata(img):
+    """Значение nodata из тега GDAL или None"""
+    tags = getattr(img, 'tag_v2', None)
+    if not tags or GDAL_NODATA_TAG not in tags:
+        return None
+    try:
+        return float(str(tags[GDAL_NODATA_TAG]).strip('\x00 '))
+    except ValueError:
+        return None
+
+
+def band_values(band):
+    """Значения пикселей полосы: DEM без преобразования, остальное - яркость"""
+    if band.mode in DEM_MODES:
+        return np.asarray(band)
+    return np.asarray(band.convert('L'))
+
+
+def reduce_factor(size, max_size):
+    """Целый коэффициент уменьшения, при котором большая сторона <= max_size"""
+    if not max_size:
+        return 1
+    return max(1, math.ceil(max(size) / max_size))
+
+
+def reduce_blocks(heights, factor):
+    """Среднее блоков factor x factor без учета дыр (неполные блоки по краям тоже)"""
+    rows, cols = heights.shape
+    out_rows, out_cols = -(-rows // factor), -(-cols // factor)
+    padded = np.full((out_rows * factor, out_cols * factor), np.nan, dtype=np.float32)
+    padded[:rows, :cols] = heights
+    blocks = padded.reshape(out_rows, factor, out_cols, factor)
+    valid = ~np.isnan(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.float32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan).astype(np.float32)
+
+
+def _reduced_bands(bands, factor):
+    """Полосы высот, уменьшенные в factor раз усреднением блоков"""
+    pending = []
+    rows = 0
+    for heights in bands:
+        pending.append(heights)
+        rows += heights.shape[0]
+        if rows < factor:
+            continue
+        # Уменьшаем только целые группы по factor строк, остаток ждет следующей полосы
+        block = np.concatenate(pending) if len(pending) > 1 else pending[0]
+        whole = rows - rows % factor
+        yield reduce_blocks(block[:whole], factor)
+        pending = [block[whole:]] if whole < rows else []
+        rows -= whole
+    if rows:
+        block = np.concatenate(pending) if len(pending) > 1 else pending[0]
+        yield reduce_blocks(block, factor)
+
+
+def iter_height_bands(filename, band_rows=DEFAULT_BAND_ROWS, **scale):
+    """Потоковое чтение изображения полосами высот: (первая строка, float32)
+
+    scale - параметры HeightScale (scale, offset, invert, nodata); nodata по
+    умолчанию берется из тега GDAL.
+    """
+    with Image.open(filename) as img:
+        yield from _height_bands(img, filename, band_rows, **scale)
+
+
+def _height_bands(img, filename, band_rows, **scale):
+    """Полосы высот открытого изображения img: заголовок читается из него же"""
+    if scale.get('nodata') is None:
+        scale['nodata'] = image_nodata(img)
+    heights = HeightScale(img.mode, **scale)
+    for top, band in _image_bands(img, filename, band_rows):
+        yield top, heights.apply(band_values(band))
+
+
+def read_heightmap(filename, max_size=None, band_rows=DEFAULT_BAND_ROWS, progress=None,
+                   **scale):
+    """Чтение изображения как сетки высот float32 (rows, cols), дыры - NaN
+
+    max_size ограничивает большую сторону результата (None - исходное
+    разрешение). Изображение читается полосами и сразу переводится в
+    высоты, поэтому кроме результата в памяти держится только одна полоса.
+    scale - параметры HeightScale; progress(доля) вызывается после каждой полосы.
+    """
+    # Файл открывается один раз: заголовок, план полос и JPEG draft
+    with Image.open(filename) as img:
+        factor = reduce_factor(img.size, max_size)
+        width, height = (math.ceil(side / factor) for side in img.size)
+        if factor > 1 and img.format == 'JPEG':
+            # JPEG умеет декодировать сразу в 1/2, 1/4 или 1/8 размера,
+            # остаток уменьшения - усреднением до того же размера
+            img.draft('L', (width, height))
+            small = img.convert('L')
+            if small.size != (width, height):
+                small = small.resize((width, height), Image.BOX)
+            bands = [HeightScale('L', **scale).apply(np.asarray(small))]
+        else:
+            bands = (heights for _, heights in _height_bands(img, filename, band_rows, **scale))
+            if factor > 1:
+                bands = _reduced_bands(bands, factor)
+
+        heights = np.empty((height, width), dtype=np.float32)
+        top = 0
+        for band in bands:
+            heights[top:top + band.shape[0]] = band
+            top += band.shape[0]
+            if progress:
+                progress(top / height)
+    return heights
@@ -0,0 +1,89 @@
+"""
+FdF layers - retained-mode compositor for the viewer screen.
+Grid, model, axes and HUD are drawn into separate cached surfaces. A layer
+is re-rasterized only when its key (camera, model state, HUD text) changes;
+otherwise a frame is just a few blits of the cached surfaces.
+"""
+import pygame
+
+
+class Layer:
+    """Кэшированная поверхность одного слоя"""
+
+    def __init__(self, name, size, draw, key, background=None):
+        self.name = name
+        self.draw = draw
+        self.key = key
+        # Слой с фоном непрозрачный, остальные накладываются с альфа-каналом
+        self.background = background
+        if background is None:
+            self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        else:
+            self.surface = pygame.Surface(size)
+        self.enabled = True
+        self.redraws = 0
+        self._key = None
+        self._dirty = True
+
+    def invalidate(self):
+        self._dirty = True
+
+    def refresh(self, owner):
+        """Перерисовка слоя, если изменился ключ; True если слой перерисован"""
+        key = self.key()
+        if not self._dirty and key == self._key:
+            return False
+        self._key = key
+        self._dirty = False
+
+        if self.background is None:
+            self.surface.fill((0, 0, 0, 0))
+        else:
+            self.surface.fill(self.background)
+
+        # Методы отрисовки рисуют в owner.screen - подменяем его на слой
+        screen = owner.screen
+        owner.screen = self.surface
+        try:
+            self.draw()
+        finally:
+            owner.screen = screen
+        self.redraws += 1
+        return True
+
+
+class Compositor:
+    """Набор слоев, собираемых в кадр снизу вверх"""
+
+    def __init__(self, owner, size):
+        self.owner = owner
+        self.size = size
+        self.layers = []
+
+    def add(self, name, draw, key, background=None):
+        """Добавление слоя поверх уже существующих"""
+        layer = Layer(name, self.size, draw, key, background)
+        self.layers.append(layer)
+        return layer
+
+    def __getitem__(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        raise KeyError(name)
+
+    def invalidate(self, *names):
+        """Принудительная перерисовка слоев (всех, если имена не заданы)"""
+        for layer in self.layers:
+            if not names or layer.name in names:
+                layer.invalidate()
+
+    def compose(self, target):
+        """Обновление изменившихся слоев и сборка кадра; число перерисованных слоев"""
+        redrawn = 0
+        for layer in self.layers:
+            if not layer.enabled:
+                continue
+            redrawn += layer.refresh(self.owner)
+            target.blit(layer.surface, (0, 0))
+        return redrawn
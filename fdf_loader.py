@@ -0,0 +1,113 @@
+"""
+FdF background loader - keeps the viewer responsive while a map loads.
+The full load runs in a worker thread on a staging copy of the renderer, so
+the frame loop never sees a half-built model. Large maps first publish a
+coarse mesh (every step-th row and column; FDF rows are reached by seeking
+through the file) that is on screen within a fraction of a second, and the
+full-resolution model is swapped in when it is ready. The current stage and
+progress are exposed for the HUD.
+"""
+import os
+import time
+import queue
+import threading
+from PIL import Image
+from fdf_mesh import HeightMesh
+from fdf_parser import sample_fdf
+from fdf_image import read_heightmap, reduce_factor
+
+
+PREVIEW_SIDE = 256
+# Карты меньше этого числа точек загружаются быстрее, чем окупается грубая сетка
+PREVIEW_MIN_POINTS = 512 * 512
+
+
+def preview_mesh(filename, max_side=PREVIEW_SIDE, image_max_size=None, **scale):
+    """Грубая сетка карты с шагом step или None (небольшие и тайловые карты)
+
+    image_max_size и scale - те же параметры, с которыми изображение будет
+    загружено целиком: грубая сетка совпадает с ним по размерам.
+    """
+    name = filename.lower()
+    if os.path.isdir(filename) or name.endswith('.fdft'):
+        return None
+    if name.endswith('.fdf'):
+        mesh = sample_fdf(filename, max_side)
+        if mesh is None or mesh.size * mesh.step ** 2 < PREVIEW_MIN_POINTS:
+            return None
+        return mesh
+
+    with Image.open(filename) as img:
+        width, height = img.size
+    full_width = -(-width // reduce_factor((width, height), image_max_size))
+    full_height = -(-height // reduce_factor((width, height), image_max_size))
+    if full_width * full_height < PREVIEW_MIN_POINTS:
+        return None
+    heights = read_heightmap(filename, max_side, **scale)
+    # Шаг в точках полной сетки (не обязательно целый, если она сама уменьшена)
+    step = full_width / heights.shape[1]
+    if step.is_integer():
+        step = int(step)
+    return HeightMesh(heights, origin_x=-full_width / 2, origin_y=-full_height / 2, step=step)
+
+
+class BackgroundLoader:
+    """Загрузка карты в фоновом потоке с грубым предварительным показом
+
+    renderer.staging_copy() дает копию рендерера со своим преобразованием и
+    таблицей цветов; на ней вызывается load_file (read_fdf_file у базового
+    рендерера). Главный поток забирает
+    события через poll: ('preview', HeightMesh) и ('done', успех).
+    """
+
+    def __init__(self, renderer, filename, preview=True):
+        self.filename = filename
+        self.staging = renderer.staging_copy()
+        self.staging.progress = self.report
+        self.events = queue.Queue()
+        self.stage = 'Starting'
+        self.fraction = None
+        self.started = time.perf_counter()
+        self._preview = renderer.preview_options() if preview else None
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def report(self, stage, fraction=None):
+        """Текущий этап и доля выполнения (вызывается из рабочего потока)"""
+        self.stage = stage
+        self.fraction = fraction
+
+    def _work(self):
+        if self._preview is not None:
+            self.report('Preview')
+            try:
+                mesh = preview_mesh(self.filename, **self._preview)
+            except Exception:
+                # Ошибку чтения сообщит полная загрузка
+                mesh = None
+            if mesh is not None:
+                self.events.put(('preview', mesh))
+        try:
+            load = getattr(self.staging, 'load_file', None) or self.staging.read_fdf_file
+            ok = load(self.filename)
+        except Exception as e:
+            print(f"Error loading {self.filename}: {e}")
+            ok = False
+        self.staging.progress = None
+        self.events.put(('done', ok))
+
+    def poll(self):
+        """Накопившиеся события загрузки (без ожидания)"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def status(self):
+        """Строка состояния для HUD"""
+        text = f"Loading {os.path.basename(self.filename)}: {self.stage}"
+        if self.fraction is not None:
+            text += f" {self.fraction * 100:.0f}%"
+        return text + f" ({time.perf_counter() - self.started:.1f} s)"
@@ -0,0 +1,280 @@
+"""
+FdF mesh storage - compact struct-of-arrays heightmap container.
+Heights are stored as a float32 grid (NaN marks a missing point), x/y are
+implicit from the grid position (origin + index * step) and custom colors
+are packed into uint32.
+"""
+import math
+import numpy as np
+
+
+# Старший байт упакованного цвета: 0xFF - цвет задан, 0 - цвет по высоте
+COLOR_FLAG = 0xFF000000
+
+
+def parse_hex_color(text):
+    """Упаковка hex цвета (0xRRGGBB или RRGGBB) в uint32, 0 если цвет некорректен"""
+    if not text:
+        return 0
+    if text.startswith('0x'):
+        text = text[2:]
+    try:
+        r = int(text[0:2], 16)
+        g = int(text[2:4], 16)
+        b = int(text[4:6], 16)
+    except ValueError:
+        return 0
+    return COLOR_FLAG | (r << 16) | (g << 8) | b
+
+
+def unpack_color(packed):
+    """Распаковка uint32 цвета в кортеж (r, g, b)"""
+    packed = int(packed)
+    return ((packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF)
+
+
+class HeightMesh:
+    """Сетка высот: непрерывные массивы вместо списка объектов Point3D"""
+
+    __slots__ = ('heights', 'colors', 'origin_x', 'origin_y', 'step', '_valid', '_count')
+
+    def __init__(self, heights, colors=None, origin_x=0.0, origin_y=0.0, step=1):
+        self.heights = np.asarray(heights, dtype=np.float32)
+        if self.heights.ndim != 2:
+            raise ValueError("Heights must be a 2D grid")
+        if colors is not None:
+            colors = np.asarray(colors, dtype=np.uint32)
+            if colors.shape != self.heights.shape:
+                raise ValueError("Colors must match the heights grid")
+        self.colors = colors
+        self.origin_x = float(origin_x)
+        self.origin_y = float(origin_y)
+        # Расстояние между соседними точками сетки
+        self.step = step
+        self._valid = None
+        self._count = None
+
+    @classmethod
+    def from_rows(cls, rows, color_rows=None, origin_x=0.0, origin_y=0.0):
+        """Создание сетки из строк разной длины (недостающие точки - NaN)"""
+        height = len(rows)
+        width = max((len(row) for row in rows), default=0)
+        heights = np.full((height, width), np.nan, dtype=np.float32)
+        colors = None
+        if color_rows is not None and any(any(row) for row in color_rows):
+            colors = np.zeros((height, width), dtype=np.uint32)
+
+        for y, row in enumerate(rows):
+            heights[y, :len(row)] = row
+            if colors is not None:
+                colors[y, :len(row)] = color_rows[y]
+
+        return cls(heights, colors, origin_x, origin_y)
+
+    @property
+    def rows(self):
+        return self.heights.shape[0]
+
+    @property
+    def cols(self):
+        return self.heights.shape[1]
+
+    @property
+    def shape(self):
+        return self.heights.shape
+
+    @property
+    def size(self):
+        """Количество ячеек сетки (включая пропуски)"""
+        return self.heights.size
+
+    @property
+    def valid(self):
+        """Маска существующих точек"""
+        if self._valid is None:
+            self._valid = ~np.isnan(self.heights)
+        return self._valid
+
+    @property
+    def count(self):
+        """Количество существующих точек"""
+        if self._count is None:
+            self._count = int(np.count_nonzero(self.valid))
+        return self._count
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def min_z(self):
+        return float(np.nanmin(self.heights)) if self.count else 0.0
+
+    @property
+    def max_z(self):
+        return float(np.nanmax(self.heights)) if self.count else 0.0
+
+    def invalidate(self):
+        """Сброс кэшированной маски после изменения высот"""
+        self._valid = None
+        self._count = None
+
+    def vertices(self):
+        """Массив вершин (rows * cols, 3): индекс вершины = row * cols + col"""
+        rows, cols = self.shape
+        vertices = np.empty((rows, cols, 3), dtype=np.float32)
+        x = np.arange(cols, dtype=np.float32) * self.step + self.origin_x
+        y = np.arange(rows, dtype=np.float32) * self.step + self.origin_y
+        vertices[:, :, 0] = x
+        vertices[:, :, 1] = y[:, None]
+        vertices[:, :, 2] = self.heights
+        return vertices.reshape(-1, 3)
+
+    @property
+    def nbytes(self):
+        """Объем памяти, занимаемый массивами сетки"""
+        total = self.heights.nbytes
+        if self.colors is not None:
+            total += self.colors.nbytes
+        if self._valid is not None:
+            total += self._valid.nbytes
+        return total
+
+    def memory_footprint(self):
+        """Подробный отчет о памяти в байтах"""
+        return {
+            'heights': self.heights.nbytes,
+            'colors': self.colors.nbytes if self.colors is not None else 0,
+            'mask': self._valid.nbytes if self._valid is not None else 0,
+            'total': self.nbytes,
+            'per_point': self.nbytes / max(1, self.count),
+        }
+
+
+def build_lod_pyramid(mesh, min_size=2):
+    """Пирамида прореженных сеток: уровень k берет каждую 2^k-ю точку"""
+    levels = [mesh]
+    while min(levels[-1].shape) > min_size:
+        factor = 2 ** len(levels)
+        levels.append(HeightMesh(
+            mesh.heights[::factor, ::factor],
+            mesh.colors[::factor, ::factor] if mesh.colors is not None else None,
+            mesh.origin_x, mesh.origin_y, mesh.step * factor
+        ))
+    return levels
+
+
+def lod_for_spacing(spacing, target_pixels=2.0):
+    """Номер уровня (прореживание в 2^k раз) для шага сетки spacing пикселей"""
+    if spacing >= target_pixels:
+        return 0
+    if spacing <= 0:
+        return 64
+    return int(math.floor(math.log2(target_pixels / spacing)))
+
+
+def select_lod_level(levels, scale, target_pixels=2.0):
+    """Самый грубый уровень, у которого шаг сетки на экране не больше target_pixels"""
+    level = lod_for_spacing(levels[0].step * scale, target_pixels)
+    return min(level, len(levels) - 1)
+
+
+def _vertex_index(shape):
+    """Сетка индексов вершин row * cols + col"""
+    rows, cols = shape
+    dtype = np.int32 if rows * cols < 2 ** 31 else np.int64
+    return np.arange(rows * cols, dtype=dtype).reshape(rows, cols)
+
+
+def grid_edges(valid):
+    """Ребра между соседними существующими точками: массив (E, 2)
+
+    Сначала все горизонтальные ребра построчно, затем вертикальные.
+    """
+    index = _vertex_index(valid.shape)
+    cols = valid.shape[1]
+    right = index[:, :-1][valid[:, :-1] & valid[:, 1:]]
+    down = index[:-1][valid[:-1] & valid[1:]]
+    return np.concatenate([
+        np.stack([right, right + 1], axis=1),
+        np.stack([down, down + cols], axis=1),
+    ]).reshape(-1, 2)
+
+
+def grid_mesh(valid):
+    """Ребра (E, 2) и треугольники (F, 3) квадратов, у которых есть все 4 точки
+
+    Каждое ребро входит один раз, даже если его делят два квадрата.
+    Квадрат с левым верхним углом top дает грани (top, top + 1, bottom)
+    и (bottom + 1, top + 1, bottom), где bottom = top + cols.
+    """
+    index = _vertex_index(valid.shape)
+    cols = valid.shape[1]
+    quads = valid[:-1, :-1] & valid[:-1, 1:] & valid[1:, :-1] & valid[1:, 1:]
+
+    # Ребро принадлежит сетке, если прилегает хотя бы к одному квадрату
+    horizontal = np.zeros((valid.shape[0], max(0, cols - 1)), dtype=bool)
+    horizontal[:-1] |= quads
+    horizontal[1:] |= quads
+    vertical = np.zeros((max(0, valid.shape[0] - 1), cols), dtype=bool)
+    vertical[:, :-1] |= quads
+    vertical[:, 1:] |= quads
+
+    right = index[:, :-1][horizontal]
+    down = index[:-1][vertical]
+    edges = np.concatenate([
+        np.stack([right, right + 1], axis=1),
+        np.stack([down, down + cols], axis=1),
+    ]).reshape(-1, 2)
+
+    top = index[:-1, :-1][quads]
+    bottom = top + cols
+    faces = np.empty((len(top) * 2, 3), dtype=index.dtype)
+    faces[0::2] = np.stack([top, top + 1, bottom], axis=1)
+    faces[1::2] = np.stack([bottom + 1, top + 1, bottom], axis=1)
+    return edges, faces
+
+
+def grid_face_slots(faces, shape):
+    """Номер первой грани каждого квадрата (rows - 1, cols - 1) или -1 для дыр
+
+    Возвращает None, если грани не в порядке grid_mesh (пары граней
+    квадратов построчно), и тогда порядок обхода по сетке неприменим.
+    """
+    rows, cols = shape
+    faces = np.asarray(faces).reshape(-1, 3)
+    if rows < 2 or cols < 2 or len(faces) % 2:
+        return None
+    top = faces[0::2, 0].astype(np.int64)
+    bottom = top + cols
+    if not (np.array_equal(faces[0::2, 1], top + 1) and np.array_equal(faces[0::2, 2], bottom)
+            and np.array_equal(faces[1::2], np.stack([bottom + 1, top + 1, bottom], axis=1))):
+        return None
+    row, col = np.divmod(top, cols)
+    if len(top) and ((row >= rows - 1).any() or (col >= cols - 1).any()
+                     or (np.diff(top) <= 0).any() or top[0] < 0):
+        return None
+
+    slots = np.full((rows - 1) * (cols - 1), -1, dtype=np.int64)
+    slots[row * (cols - 1) + col] = np.arange(0, len(faces), 2)
+    return slots.reshape(rows - 1, cols - 1)
+
+
+def grid_face_order(slots, face_ids, face_count, depth_axis):
+    """Видимые грани от дальних к ближним обходом сетки, без сортировки
+
+    depth_axis - направление роста глубины в координатах модели (x - столбцы,
+    y - строки). Для поля высот при параллельной проекции дальний квадрат
+    никогда не закрывает ближний, поэтому достаточно идти по строкам и
+    столбцам от дальнего края, а внутри квадрата начинать с грани, в которой
+    лежит дальний угол.
+    """
+    dx, dy = depth_axis[0], depth_axis[1]
+    visible = np.zeros(face_count, dtype=bool)
+    visible[face_ids] = True
+
+    grid = slots[::-1 if dy > 0 else 1, ::-1 if dx > 0 else 1].ravel()
+    grid = grid[grid >= 0]
+    # Вторая грань квадрата содержит угол (row + 1, col + 1)
+    first = 1 if dx + dy > 0 else 0
+    order = np.stack([grid + first, grid + (1 - first)], axis=1).ravel()
+    return order[visible[order]]
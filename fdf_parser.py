@@ -0,0 +1,297 @@
+"""
+FdF bulk parser - tokenizes whole buffers of an .fdf file with NumPy.
+Plain decimal heights and 0xRRGGBB colors are decoded column-wise over all
+tokens of a chunk at once; only unusual tokens (exponents, inf, ...) fall
+back to Python float().
+"""
+import os
+import math
+import time
+import numpy as np
+from fdf_mesh import HeightMesh, COLOR_FLAG
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Начало файла, по которому оценивается длина строки для грубой выборки
+PROBE_BYTES = 256 * 1024
+
+# Токены длиннее этого разбираются через float()
+MAX_FAST_TOKEN = 32
+
+_DIGIT = np.full(256, -1, dtype=np.int8)
+_DIGIT[ord('0'):ord('9') + 1] = np.arange(10)
+
+_HEX = np.full(256, -1, dtype=np.int8)
+_HEX[ord('0'):ord('9') + 1] = np.arange(10)
+_HEX[ord('a'):ord('f') + 1] = np.arange(10, 16)
+_HEX[ord('A'):ord('F') + 1] = np.arange(10, 16)
+
+_POW10 = 10.0 ** np.arange(-MAX_FAST_TOKEN, MAX_FAST_TOKEN + 1)
+
+COMMA, DOT, HASH = ord(','), ord('.'), ord('#')
+PLUS, MINUS, ZERO, LOWER_X = ord('+'), ord('-'), ord('0'), ord('x')
+
+
+class ParseStats:
+    """Статистика разбора: строки, байты и время"""
+
+    def __init__(self, rows=0, nbytes=0, seconds=0.0):
+        self.rows = rows
+        self.nbytes = nbytes
+        self.seconds = seconds
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def mb_per_sec(self):
+        return self.nbytes / 1e6 / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f"Parsed {self.rows} rows ({self.nbytes / 1e6:.1f} MB) in "
+                f"{self.seconds:.2f} s: {self.rows_per_sec:.0f} rows/s, "
+                f"{self.mb_per_sec:.1f} MB/s")
+
+
+def _tokenize(buf):
+    """Границы токенов и маска первых токенов строк"""
+    # Пробельные символы str.split(): \t\n\v\f\r, 0x1c-0x1f и пробел
+    ws = (buf == 32) | ((buf >= 9) & (buf <= 13)) | ((buf >= 28) & (buf <= 31))
+    edges = np.diff(ws.view(np.int8), prepend=np.int8(1), append=np.int8(1))
+    starts = np.flatnonzero(edges == -1)
+    ends = np.flatnonzero(edges == 1)
+
+    # Первый токен после каждого перевода строки начинает новую строку
+    first = np.zeros(len(starts), dtype=bool)
+    first[:1] = True
+    newlines = np.flatnonzero((buf == 10) | (buf == 13))
+    following = np.searchsorted(starts, newlines)
+    first[following[following < len(starts)]] = True
+    return starts, ends, first
+
+
+def _decode_heights(buf, starts, z_ends):
+    """Векторный разбор [+-]digits[.digits]; возвращает значения и маску успеха"""
+    count = len(starts)
+    lengths = (z_ends - starts).astype(np.int32)
+    first = buf[starts]
+    negative = first == MINUS
+    signed = negative | (first == PLUS)
+
+    mantissa = np.zeros(count, dtype=np.float64)
+    digits = np.zeros(count, dtype=np.int32)
+    decimals = np.zeros(count, dtype=np.int32)
+    dots = np.zeros(count, dtype=np.int32)
+    bad = (lengths > MAX_FAST_TOKEN) | (lengths == 0)
+
+    # Один проход по позициям символов сразу для всех токенов
+    width = int(min(lengths.max(initial=0), MAX_FAST_TOKEN))
+    for k in range(width):
+        inside = k < lengths
+        if k == 0:
+            inside &= ~signed
+        char = buf[starts + k]
+        digit = _DIGIT[char]
+        is_digit = inside & (digit >= 0)
+        is_dot = inside & (char == DOT)
+
+        mantissa = np.where(is_digit, mantissa * 10 + digit, mantissa)
+        digits += is_digit
+        decimals += is_digit & (dots > 0)
+        dots += is_dot
+        bad |= inside & ~is_digit & ~is_dot
+
+    # Длинные мантиссы теряют точность в float64 - отдаем их float()
+    ok = ~bad & (dots <= 1) & (digits > 0) & (digits <= 15)
+    values = mantissa / _POW10[decimals + MAX_FAST_TOKEN]
+    np.negative(values, out=values, where=negative)
+    return values, ok
+
+
+def _decode_colors(buf, color_starts, ends):
+    """Векторный разбор цветов 0xRRGGBB / RRGGBB (0 - цвет не задан)"""
+    prefixed = ((color_starts + 1 < ends) &
+                (buf[color_starts] == ZERO) &
+                (buf[color_starts + 1] == LOWER_X))
+    hex_starts = color_starts + 2 * prefixed
+
+    ok = hex_starts + 6 <= ends
+    packed = np.zeros(len(color_starts), dtype=np.uint32)
+    for k in range(6):
+        digit = _HEX[buf[hex_starts + k]]
+        ok &= digit >= 0
+        packed = (packed << np.uint32(4)) | np.maximum(digit, 0).astype(np.uint32)
+
+    return np.where(ok, packed | np.uint32(COLOR_FLAG), np.uint32(0))
+
+
+def parse_fdf_buffer(data):
+    """Разбор блока целых строк FDF в массивы высот и цветов (NaN - пропуск)"""
+    size = len(data)
+    # Дополнение пробелами позволяет читать buf[start + k] без проверок границ
+    buf = np.frombuffer(data + b' ' * (MAX_FAST_TOKEN + 8), dtype=np.uint8)
+    starts, ends, first = _tokenize(buf[:size])
+    if not len(starts):
+        return np.zeros((0, 0), dtype=np.float32), None
+
+    # Строки, у которых первый токен начинается с '#' - комментарии
+    comment = buf[starts[first]] == HASH
+    if comment.any():
+        keep = ~comment[np.cumsum(first) - 1]
+        starts, ends, first = starts[keep], ends[keep], first[keep]
+    rows = np.cumsum(first, dtype=np.int64) - 1
+    row_count = int(rows[-1]) + 1 if len(rows) else 0
+
+    # Поиск запятых внутри токенов
+    commas = np.flatnonzero(buf[:size] == COMMA)
+    z_ends = ends.copy()
+    comma_count = np.zeros(len(starts), dtype=np.int64)
+    colors = np.zeros(len(starts), dtype=np.uint32)
+    if len(commas):
+        owner = np.searchsorted(starts, commas, side='right') - 1
+        inside = owner >= 0
+        owner, commas = owner[inside], commas[inside]
+        inside = commas < ends[owner]
+        owner, commas = owner[inside], commas[inside]
+        comma_count = np.bincount(owner, minlength=len(starts))
+        # Запись в обратном порядке оставляет первую запятую токена
+        z_ends[owner[::-1]] = commas[::-1]
+        colored = np.flatnonzero(comma_count == 1)
+        colors[colored] = _decode_colors(buf, z_ends[colored] + 1, ends[colored])
+
+    heights, ok = _decode_heights(buf, starts, z_ends)
+
+    # Нестандартные числа (1e3, inf, 1_000) разбираем через float()
+    for i in np.flatnonzero(~ok & (comma_count <= 1)).tolist():
+        try:
+            heights[i] = float(data[starts[i]:z_ends[i]].decode())
+            ok[i] = True
+        except (ValueError, UnicodeDecodeError):
+            continue
+
+    # Некорректные токены пропускаются, столбец не увеличивается
+    ok &= comma_count <= 1
+    rows, heights, colors = rows[ok], heights[ok], colors[ok]
+    index = np.arange(len(rows))
+    new_row = np.empty(len(rows), dtype=bool)
+    new_row[:1] = True
+    new_row[1:] = rows[1:] != rows[:-1]
+    cols = index - np.maximum.accumulate(np.where(new_row, index, 0))
+    width = int(cols.max()) + 1 if len(cols) else 0
+
+    grid = np.full((row_count, width), np.nan, dtype=np.float32)
+    grid[rows, cols] = heights
+    color_grid = None
+    if colors.any():
+        color_grid = np.zeros((row_count, width), dtype=np.uint32)
+        color_grid[rows, cols] = colors
+    return grid, color_grid
+
+
+def count_fdf_rows(data):
+    """Число рядов сетки в блоке целых строк (пустые строки и комментарии не считаются)"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    starts, _, first = _tokenize(buf)
+    return int(np.count_nonzero(buf[starts[first]] != HASH))
+
+
+def iter_fdf_chunks(filename, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Потоковое чтение файла блоками целых строк: (heights, colors, nbytes)"""
+    with open(filename, 'rb') as file:
+        tail = b''
+        while True:
+            block = file.read(chunk_size)
+            if not block:
+                break
+            data = tail + block
+            cut = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+            if cut == 0:
+                tail = data
+                continue
+            tail = data[cut:]
+            heights, colors = parse_fdf_buffer(data[:cut])
+            yield heights, colors, cut
+
+        if tail:
+            heights, colors = parse_fdf_buffer(tail)
+            yield heights, colors, len(tail)
+
+
+def stack_chunks(chunks):
+    """Объединение блоков строк разной ширины в одну сетку"""
+    width = max((h.shape[1] for h, _ in chunks), default=0)
+    rows = sum(h.shape[0] for h, _ in chunks)
+    heights = np.full((rows, width), np.nan, dtype=np.float32)
+    colors = None
+    if any(c is not None for _, c in chunks):
+        colors = np.zeros((rows, width), dtype=np.uint32)
+
+    row = 0
+    for chunk_heights, chunk_colors in chunks:
+        count, chunk_width = chunk_heights.shape
+        heights[row:row + count, :chunk_width] = chunk_heights
+        if chunk_colors is not None:
+            colors[row:row + count, :chunk_width] = chunk_colors
+        row += count
+    return heights, colors
+
+
+def parse_fdf(filename, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Разбор FDF файла в HeightMesh; возвращает (mesh, ParseStats)
+
+    progress(доля) вызывается после каждого блока.
+    """
+    start = time.perf_counter()
+    total = max(1, os.path.getsize(filename)) if progress else 1
+    chunks = []
+    nbytes = 0
+    for heights, colors, size in iter_fdf_chunks(filename, chunk_size):
+        chunks.append((heights, colors))
+        nbytes += size
+        if progress:
+            progress(min(1.0, nbytes / total))
+
+    heights, colors = stack_chunks(chunks)
+    stats = ParseStats(heights.shape[0], nbytes, time.perf_counter() - start)
+    return HeightMesh(heights, colors), stats
+
+
+def sample_fdf(filename, max_side, probe_bytes=PROBE_BYTES):
+    """Грубая сетка всей карты без полного разбора: (HeightMesh с шагом step)
+
+    Длина строки оценивается по началу файла, затем читается примерно
+    каждая step-я строка (переход по смещению в байтах), и в ней берется
+    каждый step-й столбец. Для строк разной длины сетка приблизительная -
+    она нужна только для быстрого предварительного показа.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as file:
+        head = file.read(probe_bytes)
+        cut = max(head.rfind(b'\n'), head.rfind(b'\r')) + 1
+        if cut == 0:
+            return None
+        sample, _ = parse_fdf_buffer(head[:cut])
+        if not sample.size:
+            return None
+        row_bytes = cut / sample.shape[0]
+        rows = max(1, round(size / row_bytes))
+        step = max(1, math.ceil(max(rows, sample.shape[1]) / max_side))
+
+        chunks = []
+        for row in range(0, rows, step):
+            offset = int(row * row_bytes)
+            file.seek(offset)
+            if offset:
+                # Дочитываем строку, в середину которой попали
+                file.readline()
+            line = file.readline()
+            if not line:
+                break
+            heights, colors = parse_fdf_buffer(line)
+            if heights.size:
+                chunks.append((heights[:1, ::step], None if colors is None else colors[:1, ::step]))
+    if not chunks:
+        return None
+    heights, colors = stack_chunks(chunks)
+    return HeightMesh(heights, colors, step=step)
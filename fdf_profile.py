@@ -0,0 +1,262 @@
+"""
+FdF profiler - per-stage frame timing for the viewer loop.
+Stages of each frame (events, keys, transform, sorting, drawing, flip) are
+timed into a fixed-size ring buffer. The recent frames are shown as a
+stacked frame-time graph with p50/p99, and the buffer can be written as a
+Chrome trace (chrome://tracing, ui.perfetto.dev). While disabled every
+instrumentation point is a single flag check.
+"""
+import os
+import json
+import time
+import numpy as np
+import pygame
+
+
+DEFAULT_EVENTS = 1 << 16
+DEFAULT_FRAMES = 600
+GRAPH_FRAMES = 240
+GRAPH_SIZE = (420, 200)
+# Верх шкалы графика в миллисекундах и отметки бюджета кадра
+GRAPH_RANGE_MS = 50.0
+BUDGET_MS = (1000 / 60, 1000 / 30)
+
+STAGE_COLORS = [
+    (90, 160, 255), (255, 170, 60), (120, 220, 120), (230, 90, 90),
+    (190, 120, 255), (240, 230, 90), (90, 220, 220), (255, 120, 200),
+]
+
+
+class _NullStage:
+    """Пустой контекст для выключенного профилировщика"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """Замер одного этапа: время начала и длительность"""
+
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        # Время вложенных этапов копится в стеке, чтобы считать собственное время
+        self.profiler.children.append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        profiler = self.profiler
+        if not profiler.enabled:
+            # Профилировщик выключили внутри этапа - замер отбрасываем
+            return False
+        nested = profiler.children.pop()
+        if profiler.children:
+            profiler.children[-1] += duration
+        profiler.record(self.name, self.start, duration, len(profiler.children),
+                        duration - nested)
+        return False
+
+
+class FrameProfiler:
+    """Кольцевой буфер замеров этапов и длительностей кадров"""
+
+    def __init__(self, capacity=DEFAULT_EVENTS, frames=DEFAULT_FRAMES):
+        self.enabled = False
+        self.children = []
+        self.origin = time.perf_counter()
+
+        # Этапы: имя, начало, длительность и вложенность
+        self.capacity = capacity
+        self.names = [None] * capacity
+        self.starts = [0.0] * capacity
+        self.durations = [0.0] * capacity
+        self.depths = [0] * capacity
+        self.count = 0
+
+        # Кадры: длительность и собственное время этапов {имя: секунды}
+        self.frame_capacity = frames
+        self.frame_times = [0.0] * frames
+        self.frame_stages = [None] * frames
+        self.frame_count = 0
+        self._frame_start = None
+        self._current = {}
+
+        self.stage_order = []
+        self._graph = None
+
+    def toggle(self):
+        """Включение/выключение записи; новый замер начинается с чистого кадра"""
+        self.enabled = not self.enabled
+        self.children = []
+        self._frame_start = None
+        self._current = {}
+        return self.enabled
+
+    def stage(self, name):
+        """Контекст замера: with profiler.stage('transform'): ..."""
+        if not self.enabled:
+            return NULL_STAGE
+        return _Stage(self, name)
+
+    def wrap(self, name, func):
+        """Функция, вызов которой замеряется как этап name"""
+        def profiled(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with _Stage(self, name):
+                return func(*args, **kwargs)
+        return profiled
+
+    def record(self, name, start, duration, depth=0, exclusive=None):
+        """Запись этапа в кольцевой буфер; exclusive - время без вложенных этапов"""
+        index = self.count % self.capacity
+        self.names[index] = name
+        self.starts[index] = start
+        self.durations[index] = duration
+        self.depths[index] = depth
+        self.count += 1
+        if exclusive is not None:
+            self._current[name] = self._current.get(name, 0.0) + exclusive
+            if name not in self.stage_order:
+                self.stage_order.append(name)
+
+    def frame(self):
+        """Граница кадров: вызывается в начале каждой итерации цикла"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._frame_start is not None:
+            index = self.frame_count % self.frame_capacity
+            self.frame_times[index] = now - self._frame_start
+            self.frame_stages[index] = self._current
+            self.frame_count += 1
+            self.record('frame', self._frame_start, now - self._frame_start, depth=-1)
+        self._frame_start = now
+        self._current = {}
+
+    def recent_frames(self, limit=None):
+        """Индексы последних кадров от старых к новым"""
+        count = min(self.frame_count, self.frame_capacity)
+        if limit is not None:
+            count = min(count, limit)
+        return [(self.frame_count - count + i) % self.frame_capacity for i in range(count)]
+
+    def percentiles(self, *q):
+        """Перцентили длительности кадра в миллисекундах"""
+        frames = self.recent_frames()
+        if not frames:
+            return [0.0] * len(q)
+        times = np.array([self.frame_times[i] for i in frames]) * 1000
+        return np.percentile(times, q).tolist()
+
+    def stage_percentiles(self, name, *q):
+        """Перцентили собственного времени этапа name в миллисекундах"""
+        times = [self.frame_stages[i].get(name, 0.0) for i in self.recent_frames()]
+        if not times:
+            return [0.0] * len(q)
+        return np.percentile(np.array(times) * 1000, q).tolist()
+
+    def trace_events(self):
+        """События в формате Chrome trace (от старых к новым)"""
+        count = min(self.count, self.capacity)
+        pid = os.getpid()
+        events = []
+        for i in range(self.count - count, self.count):
+            index = i % self.capacity
+            depth = self.depths[index]
+            events.append({
+                'name': self.names[index],
+                'cat': 'frame' if depth < 0 else 'stage',
+                'ph': 'X',
+                'ts': (self.starts[index] - self.origin) * 1e6,
+                'dur': self.durations[index] * 1e6,
+                'pid': pid,
+                'tid': 1,
+            })
+        # Вложенные события должны идти после внешних с тем же началом
+        events.sort(key=lambda event: (event['ts'], -event['dur']))
+        return events
+
+    def dump(self, filename=None):
+        """Запись буфера в JSON для chrome://tracing или Perfetto; имя файла"""
+        if filename is None:
+            filename = time.strftime('fdf_trace_%Y%m%d_%H%M%S.json')
+        trace = {
+            'traceEvents': [
+                {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 1,
+                 'args': {'name': 'render loop'}},
+            ] + self.trace_events(),
+            'displayTimeUnit': 'ms',
+        }
+        with open(filename, 'w') as file:
+            json.dump(trace, file)
+        return filename
+
+    def stage_color(self, name):
+        return STAGE_COLORS[self.stage_order.index(name) % len(STAGE_COLORS)]
+
+    def draw_graph(self, surface, font, position=None):
+        """График длительности последних кадров по этапам с p50/p99"""
+        width, height = GRAPH_SIZE
+        if position is None:
+            position = (surface.get_width() - width - 10, surface.get_height() - height - 10)
+        if self._graph is None:
+            self._graph = pygame.Surface(GRAPH_SIZE, pygame.SRCALPHA)
+        graph = self._graph
+        graph.fill((0, 0, 0, 170))
+
+        p50, p99 = self.percentiles(50, 99)
+        text = font.render(f"frame p50 {p50:.1f} ms  p99 {p99:.1f} ms", True, (230, 230, 230))
+        graph.blit(text, (6, 2))
+
+        # Легенда: цвет и p50 собственного времени каждого этапа
+        x, y = 6, 4 + text.get_height()
+        for name in self.stage_order:
+            label = font.render(f"{name} {self.stage_percentiles(name, 50)[0]:.1f}",
+                                True, self.stage_color(name))
+            if x + label.get_width() > width:
+                x, y = 6, y + label.get_height()
+            graph.blit(label, (x, y))
+            x += label.get_width() + 8
+        plot_top = y + text.get_height() + 2
+
+        bottom_line = height - 4
+        ms_to_px = (bottom_line - plot_top) / GRAPH_RANGE_MS
+        frames = self.recent_frames(GRAPH_FRAMES)
+        bar = width / GRAPH_FRAMES
+        line_width = max(1, int(bar))
+        x = width - len(frames) * bar
+
+        # Столбик кадра: собственное время этапов друг над другом,
+        # серый остаток - время вне этапов
+        for index in frames:
+            bottom = bottom_line
+            for name, seconds in self.frame_stages[index].items():
+                top = max(plot_top, bottom - seconds * 1000 * ms_to_px)
+                pygame.draw.line(graph, self.stage_color(name), (x, bottom), (x, top),
+                                 line_width)
+                bottom = top
+            total = max(plot_top, bottom_line - self.frame_times[index] * 1000 * ms_to_px)
+            if total < bottom:
+                pygame.draw.line(graph, (110, 110, 110), (x, bottom), (x, total), line_width)
+            x += bar
+
+        for budget in BUDGET_MS:
+            y = bottom_line - budget * ms_to_px
+            pygame.draw.line(graph, (255, 255, 255, 90), (0, y), (width, y), 1)
+
+        surface.blit(graph, position)
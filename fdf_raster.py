@@ -0,0 +1,469 @@
+"""
+FdF raster - batched line and triangle rasterization into surface memory.
+All segments are expanded into pixels at once with a vectorized DDA and
+written directly into the 32-bit pixel buffer of the target surface,
+instead of one pygame.draw.line call per edge. Triangles are filled the
+same way with a per-pixel depth test against a float z-buffer, so solid
+mode needs neither sorting nor pygame.draw.polygon. Both backends are
+available at runtime for comparison.
+
+The NumPy backend splits the frame into horizontal bands of rows. Every
+primitive is binned into the bands its rows touch, and the bands are
+rasterized concurrently by a thread pool: the NumPy kernels release the
+GIL, and each thread writes only its own rows of the shared pixel and
+depth buffers. A band keeps the full-frame DDA and triangle setup and just
+skips the rows outside it, so the result does not depend on the number of
+threads.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pygame
+from fdf_culling import clip_segments
+
+
+PYGAME = 'pygame'
+NUMPY = 'numpy'
+LINE_BACKENDS = (PYGAME, NUMPY)
+SOLID_BACKENDS = (PYGAME, NUMPY)
+
+# Максимум пикселей, разворачиваемых за один проход (ограничение памяти)
+DEFAULT_BATCH_PIXELS = 1 << 22
+
+# Допуск барицентрических координат: общие ребра граней без щелей
+EDGE_EPSILON = 1e-5
+
+# Потоки растеризации по умолчанию; полос экрана на поток (балансировка нагрузки)
+RASTER_THREADS = os.cpu_count() or 1
+BANDS_PER_THREAD = 4
+MIN_BAND_ROWS = 16
+# Меньше примитивов рисуем в одном потоке: раздача по полосам не окупается
+MIN_PARALLEL_ITEMS = 4096
+# Нижняя граница пакета потока (пакет делится между потоками по памяти)
+MIN_BATCH_PIXELS = 1 << 18
+
+_pool = None
+_pool_threads = 0
+
+
+def _executor(threads):
+    """Общий пул потоков растеризации не меньше threads потоков"""
+    global _pool, _pool_threads
+    if _pool is None or _pool_threads < threads:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = ThreadPoolExecutor(threads, thread_name_prefix='fdf-raster')
+        _pool_threads = threads
+    return _pool
+
+
+def row_bands(height, threads):
+    """Границы горизонтальных полос экрана: полоса i - строки [b[i], b[i + 1])"""
+    count = max(1, min(threads * BANDS_PER_THREAD, height // MIN_BAND_ROWS))
+    return np.linspace(0, height, count + 1).astype(np.int64)
+
+
+def bin_rows(low, high, bounds):
+    """Номера примитивов каждой полосы по их строкам [low, high] в исходном порядке"""
+    count = len(bounds) - 1
+    first = np.clip(np.searchsorted(bounds, low, side='right') - 1, 0, count - 1)
+    last = np.clip(np.searchsorted(bounds, high, side='right') - 1, 0, count - 1)
+    # Для номеров полос устойчивая сортировка поразрядная - почти линейная
+    order = np.argsort(first.astype(np.int16), kind='stable')
+    groups = np.split(order, np.cumsum(np.bincount(first, minlength=count))[:-1])
+
+    # Примитивы на стыке полос (обычно их немного) попадают в каждую полосу
+    spill = np.flatnonzero(last > first)
+    if len(spill):
+        spill_first, spill_last = first[spill], last[spill]
+        for band in range(1, count):
+            extra = spill[(spill_first < band) & (spill_last >= band)]
+            if len(extra):
+                groups[band] = np.sort(np.concatenate((groups[band], extra)))
+    return groups
+
+
+def split_rows(rasterize, height, low, high, threads=None,
+               batch_pixels=DEFAULT_BATCH_PIXELS):
+    """Растеризация по полосам строк в пуле потоков; сумма результатов
+
+    rasterize(ids, band, batch_pixels) рисует примитивы ids в полосу
+    band = (первая, за последней); low/high - крайние строки примитивов.
+    В одном потоке или для малого числа примитивов - один вызов
+    rasterize(None, None, batch_pixels) на весь кадр.
+    """
+    threads = RASTER_THREADS if threads is None else threads
+    if threads <= 1 or len(low) < MIN_PARALLEL_ITEMS:
+        return rasterize(None, None, batch_pixels)
+    bounds = row_bands(height, threads)
+    jobs = [(ids, (int(bounds[band]), int(bounds[band + 1])))
+            for band, ids in enumerate(bin_rows(low, high, bounds)) if len(ids)]
+    batch = max(MIN_BATCH_PIXELS, batch_pixels // threads)
+    return sum(_executor(threads).map(lambda job: rasterize(job[0], job[1], batch), jobs))
+
+
+def _batches(steps, limit):
+    """Разбиение отрезков на группы, в каждой не больше limit пикселей"""
+    total = np.cumsum(steps)
+    start = 0
+    while start < len(steps):
+        base = total[start - 1] if start else 0
+        stop = int(np.searchsorted(total, base + limit, side='right'))
+        stop = max(stop, start + 1)
+        yield start, stop
+        start = stop
+
+
+def map_colors(surface, colors):
+    """Цвета (N, 3) в значения пикселей 32-битной поверхности"""
+    colors = np.asarray(colors, dtype=np.uint32)
+    shifts = surface.get_shifts()
+    masks = surface.get_masks()
+    return ((colors[..., 0] << shifts[0]) | (colors[..., 1] << shifts[1]) |
+            (colors[..., 2] << shifts[2]) | masks[3]).astype(np.uint32)
+
+
+def _band_steps(y0, dy, steps, band):
+    """Шаги DDA [skip, skip + count), у которых строка пикселя в полосе band
+
+    Строка монотонна по шагу, поэтому диапазон находится решением
+    неравенства с запасом в шаг; точный отбор - по вычисленной строке.
+    Строка над полосой нужна для второго пикселя толстых линий.
+    """
+    top, bottom = band
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k_top = (top - 1 - y0) / dy
+        k_bottom = (bottom - y0) / dy
+    low = np.floor(np.minimum(k_top, k_bottom)) - 1
+    high = np.ceil(np.maximum(k_top, k_bottom)) + 2
+    # Горизонтальные отрезки: целиком в полосе или целиком вне ее
+    flat = dy == 0
+    if flat.any():
+        inside = (y0 >= top - 1) & (y0 < bottom + 1)
+        low = np.where(flat, 0, low)
+        high = np.where(flat, np.where(inside, steps, 0), high)
+    skip = np.clip(low, 0, steps).astype(np.int64)
+    count = np.clip(high, 0, steps).astype(np.int64) - skip
+    return skip, np.maximum(count, 0)
+
+
+def rasterize_lines(pixels, pitch, size, start, end, colors, width=1,
+                    batch_pixels=DEFAULT_BATCH_PIXELS, band=None):
+    """Растеризация отрезков (N, 2) методом DDA в плоский массив пикселей
+
+    pixels - uint32 буфер поверхности, pitch - длина строки в пикселях,
+    size - (ширина, высота); colors - значения пикселей (N,) или одно.
+    width=2 добавляет соседний пиксель поперек основного направления
+    отрезка, как толстые линии pygame. band = (первая, за последней) -
+    писать только в эту полосу строк. Возвращает число пикселей.
+    """
+    w, h = size
+    # Концы отрезков усекаются до целых, как в pygame.draw.line
+    start = np.trunc(np.asarray(start, dtype=np.float32))
+    end = np.trunc(np.asarray(end, dtype=np.float32))
+    colors = np.broadcast_to(np.asarray(colors, dtype=np.uint32), (len(start),))
+
+    # Обрезаем по экрану только отрезки, выходящие за его пределы
+    outside = ~((start.min(axis=1) >= 0) & (end.min(axis=1) >= 0) &
+                (np.maximum(start[:, 0], end[:, 0]) <= w - 1) &
+                (np.maximum(start[:, 1], end[:, 1]) <= h - 1))
+    if outside.any():
+        start = start.copy()
+        end = end.copy()
+        clipped_start, clipped_end, keep = clip_segments(
+            start[outside], end[outside], w - 1, h - 1, guard=0)
+        start[outside] = clipped_start
+        end[outside] = clipped_end
+        drop = np.flatnonzero(outside)[~keep]
+        if len(drop):
+            inside = np.ones(len(start), dtype=bool)
+            inside[drop] = False
+            start, end, colors = start[inside], end[inside], colors[inside]
+    if not len(start):
+        return 0
+
+    delta = end - start
+    abs_dx = np.abs(delta[:, 0])
+    abs_dy = np.abs(delta[:, 1])
+    steps = np.ceil(np.maximum(abs_dx, abs_dy)).astype(np.int64) + 1
+    # Начало и шаг DDA по каждой оси (смещение 0.5 - округление промежуточных точек)
+    div = np.maximum(steps - 1, 1).astype(np.float32)
+    x0 = start[:, 0] + np.float32(0.5)
+    y0 = start[:, 1] + np.float32(0.5)
+    dx = delta[:, 0] / div
+    dy = delta[:, 1] / div
+    # Второй пиксель толщины: по x для крутых отрезков, иначе по y
+    side = np.where(abs_dy > abs_dx, 1, pitch)
+
+    skip = None
+    if band is not None:
+        skip, steps = _band_steps(y0, dy, steps, band)
+
+    drawn = 0
+    for first, last in _batches(steps, batch_pixels):
+        counts = steps[first:last]
+        segment = np.repeat(np.arange(first, last), counts)
+        offsets = np.arange(int(counts.sum()), dtype=np.float32)
+        offsets -= np.repeat((np.cumsum(counts) - counts).astype(np.float32), counts)
+        if skip is not None:
+            offsets += np.repeat(skip[first:last].astype(np.float32), counts)
+
+        x = (x0[segment] + offsets * dx[segment]).astype(np.intp)
+        y = (y0[segment] + offsets * dy[segment]).astype(np.intp)
+        index = y * pitch + x
+        color = colors[segment]
+        if band is None:
+            pixels[index] = color
+            drawn += len(index)
+        else:
+            own = (y >= band[0]) & (y < band[1])
+            pixels[index[own]] = color[own]
+            drawn += int(np.count_nonzero(own))
+
+        if width >= 2:
+            down = side[segment] != 1
+            index += side[segment]
+            # Не выходим за правый и нижний край
+            inside = (x + ~down < w) & (y + down < h)
+            if band is not None:
+                inside &= (y + down >= band[0]) & (y + down < band[1])
+            pixels[index[inside]] = color[inside]
+    return drawn
+
+
+def draw_lines(surface, start, end, colors, width=1, backend=PYGAME, threads=None):
+    """Отрисовка отрезков выбранным способом; colors - (N, 3) или один цвет
+
+    threads - потоки растеризации NumPy (по умолчанию RASTER_THREADS).
+    """
+    if backend == NUMPY and surface.get_bytesize() == 4:
+        # Пишем прямо в память поверхности
+        size = surface.get_size()
+        pitch = surface.get_pitch() // 4
+        start = np.asarray(start, dtype=np.float32)
+        end = np.asarray(end, dtype=np.float32)
+        values = np.broadcast_to(map_colors(surface, colors), (len(start),))
+        # Строки пикселей отрезка (с запасом на округление и второй пиксель)
+        low = np.minimum(start[:, 1], end[:, 1]) - 1
+        high = np.maximum(start[:, 1], end[:, 1]) + 2
+        pixels = None
+        buffer = surface.get_buffer()
+        try:
+            pixels = np.frombuffer(buffer, dtype=np.uint32)
+
+            def rasterize(ids, band, batch_pixels):
+                if ids is None:
+                    return rasterize_lines(pixels, pitch, size, start, end, values, width,
+                                           batch_pixels)
+                return rasterize_lines(pixels, pitch, size, start[ids], end[ids], values[ids],
+                                       width, batch_pixels, band)
+
+            split_rows(rasterize, size[1], low, high, threads)
+        finally:
+            # Освобождаем блокировку поверхности (массив держит и замыкание)
+            pixels = None
+            buffer = None
+        return
+
+    colors = np.broadcast_to(np.asarray(colors, dtype=np.uint8), (len(start), 3))
+    for p1, p2, color in zip(np.asarray(start).tolist(), np.asarray(end).tolist(),
+                             colors.tolist()):
+        pygame.draw.line(surface, color, p1, p2, width)
+
+
+# Вершины стороны i (противолежащей вершине i)
+_SIDES = ((1, 2), (2, 0), (0, 1))
+
+
+def triangle_setup(points, depth, origin, heights=False):
+    """Коэффициенты плоскостей для треугольников (T, 3, 2) с глубиной (T, 3)
+
+    Координаты берутся относительно origin (T, 2): так хватает точности
+    float32. Барицентрическая координата l_i = a[i] * x + b[i] * y + c[i],
+    глубина z = za * x + zb * y + zc. Возвращает (a, b, c, za, zb, zc,
+    side, ok): a, b, c - списки из трех массивов (T,), side - высоты
+    треугольника к сторонам в пикселях (только при heights=True), ok -
+    маска невырожденных треугольников.
+    """
+    x = [points[:, i, 0] - origin[:, 0] for i in range(3)]
+    y = [points[:, i, 1] - origin[:, 1] for i in range(3)]
+    # Удвоенная знаковая площадь; порядок обхода вершин не важен
+    area = (x[1] - x[0]) * (y[2] - y[0]) - (x[2] - x[0]) * (y[1] - y[0])
+    ok = np.abs(area) > 1e-6
+    inv = np.float32(1) / np.where(ok, area, np.float32(1))
+
+    a = [(y[j] - y[k]) * inv for j, k in _SIDES]
+    b = [(x[k] - x[j]) * inv for j, k in _SIDES]
+    c = [(x[j] * y[k] - x[k] * y[j]) * inv for j, k in _SIDES]
+
+    z = [depth[:, i] for i in range(3)]
+    za = a[0] * z[0] + a[1] * z[1] + a[2] * z[2]
+    zb = b[0] * z[0] + b[1] * z[1] + b[2] * z[2]
+    zc = c[0] * z[0] + c[1] * z[1] + c[2] * z[2]
+
+    side = None
+    if heights:
+        # Высота к стороне: 2 * площадь / длина стороны
+        side = [np.abs(area) / np.maximum(np.hypot(x[k] - x[j], y[k] - y[j]), np.float32(1e-6))
+                for j, k in _SIDES]
+    return a, b, c, za, zb, zc, side, ok
+
+
+def rasterize_triangles(pixels, zbuffer, pitch, size, points, depth, colors,
+                        outline=None, batch_pixels=DEFAULT_BATCH_PIXELS, band=None):
+    """Заливка треугольников с проверкой глубины в плоские буферы
+
+    pixels - uint32 буфер поверхности, zbuffer - float32 буфер глубины того
+    же размера (меньше - ближе), pitch - длина строки в пикселях, size -
+    (ширина, высота); points - (T, 3, 2), depth - (T, 3), colors - значения
+    пикселей (T,) или одно. outline - значение пикселя для контура граней
+    (пиксели ближе 1 пикселя к стороне) или None. band = (первая, за
+    последней) - заливать только эту полосу строк. Возвращает число
+    записанных пикселей.
+    """
+    w, h = size
+    points = np.asarray(points, dtype=np.float32)
+    depth = np.asarray(depth, dtype=np.float32)
+    colors = np.broadcast_to(np.asarray(colors, dtype=np.uint32), (len(points),))
+    if not len(points):
+        return 0
+
+    # Ограничивающие прямоугольники по центрам пикселей, обрезанные по экрану
+    p0, p1, p2 = points[:, 0], points[:, 1], points[:, 2]
+    low = np.floor(np.minimum(np.minimum(p0, p1), p2) - 0.5).astype(np.int32) + 1
+    high = np.floor(np.maximum(np.maximum(p0, p1), p2) - 0.5).astype(np.int32)
+    np.maximum(low, 0, out=low)
+    np.minimum(high, np.array([w - 1, h - 1], dtype=np.int32), out=high)
+    box_w = high[:, 0] - low[:, 0] + 1
+    box_h = high[:, 1] - low[:, 1] + 1
+    skip = np.zeros(len(points), dtype=np.int64)
+    if band is not None:
+        # Начало координат треугольника прежнее: пиксели те же, что без полос
+        skip = np.maximum(band[0] - low[:, 1], 0).astype(np.int64)
+        box_h = np.minimum(high[:, 1], band[1] - 1) - low[:, 1] - skip + 1
+
+    # Треугольники без единого центра пикселя в прямоугольнике (мелкие грани
+    # дальнего плана, грани за экраном) отбрасываем до расчета коэффициентов
+    ids = np.flatnonzero((box_w > 0) & (box_h > 0))
+    low, box_w, colors, skip = low[ids], box_w[ids], colors[ids], skip[ids]
+    # Коэффициенты относительно центра левого верхнего пикселя прямоугольника
+    a, b, c, za, zb, zc, side, ok = triangle_setup(
+        points[ids], depth[ids], low.astype(np.float32) + np.float32(0.5),
+        heights=outline is not None)
+    # У вырожденных треугольников не будет ни одной строки
+    box_h = np.where(ok, box_h[ids], 0)
+    c = [value + np.float32(EDGE_EPSILON) for value in c]
+
+    # Границы строки для каждой стороны: l_i = a_i * dx + b_i * dy + c_i >= 0
+    # дает dx >= p_i * dy + q_i (a_i > 0) или dx <= p_i * dy + q_i (a_i < 0).
+    # Стороны вдоль строк отсекает ограничивающий прямоугольник
+    left = []
+    right = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(3):
+            slope = -b[i] / a[i]
+            shift = -c[i] / a[i]
+            left.append((np.where(a[i] > 0, slope, np.float32(0)),
+                         np.where(a[i] > 0, shift, np.float32(-np.inf))))
+            right.append((np.where(a[i] < 0, slope, np.float32(0)),
+                          np.where(a[i] < 0, shift, np.float32(np.inf))))
+    if outline is not None:
+        # Расстояние до стороны в пикселях: d_i = l_i * (высота к стороне i)
+        near = [tuple(v[i] * side[i] for v in (a, b, c)) for i in range(3)]
+
+    drawn = 0
+    for first, last in _batches(box_h, batch_pixels // 4):
+        # Строки прямоугольников: (треугольник, dy); строки одного треугольника
+        # идут подряд, поэтому его коэффициенты размножаются через repeat
+        rows = box_h[first:last]
+        tri = np.repeat(np.arange(first, last), rows)
+        dy = np.arange(int(rows.sum()), dtype=np.int64)
+        dy -= np.repeat(np.cumsum(rows) - rows - skip[first:last], rows)
+        fy = dy.astype(np.float32)
+
+        def bound(edges, reduce):
+            result = None
+            for p, q in edges:
+                value = np.repeat(p[first:last], rows) * fy + np.repeat(q[first:last], rows)
+                result = value if result is None else reduce(result, value, out=result)
+            return result
+
+        x0 = np.maximum(np.ceil(bound(left, np.maximum)), 0)
+        x1 = np.minimum(np.floor(bound(right, np.minimum)), np.repeat(box_w[first:last] - 1, rows))
+        keep = np.flatnonzero(x1 >= x0)
+        tri, dy, fy, x0 = tri[keep], dy[keep], fy[keep], x0[keep]
+        spans = (x1[keep] - x0).astype(np.int64) + 1
+
+        if outline is not None:
+            # d_i линейно по строке, поэтому контур строки - начало dx < prefix
+            # и конец dx > suffix (или вся строка вдоль стороны)
+            prefix = np.full(len(tri), -np.inf, dtype=np.float32)
+            suffix = np.full(len(tri), np.inf, dtype=np.float32)
+            for ad, bd, cd in near:
+                slope = ad[tri]
+                rest = 1 - bd[tri] * fy - cd[tri]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    limit = rest / slope
+                np.maximum(prefix, np.where(slope > 0, limit, -np.inf), out=prefix)
+                np.minimum(suffix, np.where(slope < 0, limit, np.inf), out=suffix)
+                prefix[(slope == 0) & (rest > 0)] = np.inf
+
+        start = (low[tri, 1] + dy) * pitch + low[tri, 0] + x0.astype(np.int64)
+        z0 = za[tri] * x0 + zb[tri] * fy + zc[tri]
+
+        for row_first, row_last in _batches(spans, batch_pixels):
+            counts = spans[row_first:row_last]
+            row = np.repeat(np.arange(row_first, row_last), counts)
+            offsets = np.arange(int(counts.sum()), dtype=np.int64)
+            offsets -= np.repeat(np.cumsum(counts) - counts, counts)
+
+            index = start[row] + offsets
+            row_tri = tri[row]
+            z = z0[row] + za[row_tri] * offsets.astype(np.float32)
+
+            # Ближайший фрагмент каждого пикселя, затем запись победителей
+            np.minimum.at(zbuffer, index, z)
+            win = np.flatnonzero(z <= zbuffer[index])
+            index = index[win]
+            row_tri = row_tri[win]
+            color = colors[row_tri]
+            if outline is not None:
+                row = row[win]
+                dx = x0[row] + offsets[win].astype(np.float32)
+                edge = (dx < prefix[row]) | (dx > suffix[row])
+                color = np.where(edge, np.uint32(outline), color)
+            pixels[index] = color
+            drawn += len(index)
+    return drawn
+
+
+def draw_triangles(surface, points, depth, colors, outline=None, threads=None):
+    """Заливка треугольников с z-буфером; colors - (T, 3), outline - цвет или None"""
+    w, h = surface.get_size()
+    if surface.get_bytesize() != 4:
+        raise ValueError("z-buffered triangles need a 32-bit surface")
+    pitch = surface.get_pitch() // 4
+    zbuffer = np.full(pitch * h, np.inf, dtype=np.float32)
+    if outline is not None:
+        outline = map_colors(surface, [outline])[0]
+    points = np.asarray(points, dtype=np.float32)
+    depth = np.asarray(depth, dtype=np.float32)
+    values = np.broadcast_to(map_colors(surface, colors), (len(points),))
+    pixels = None
+    buffer = surface.get_buffer()
+    try:
+        pixels = np.frombuffer(buffer, dtype=np.uint32)
+
+        def rasterize(ids, band, batch_pixels):
+            if ids is None:
+                return rasterize_triangles(pixels, zbuffer, pitch, (w, h), points, depth,
+                                           values, outline, batch_pixels)
+            return rasterize_triangles(pixels, zbuffer, pitch, (w, h), points[ids],
+                                       depth[ids], values[ids], outline, batch_pixels, band)
+
+        split_rows(rasterize, h, points[:, :, 1].min(axis=1, initial=np.inf),
+                   points[:, :, 1].max(axis=1, initial=-np.inf), threads)
+    finally:
+        # Освобождаем блокировку поверхности
+        pixels = None
+        buffer = None
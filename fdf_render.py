@@ -0,0 +1,195 @@
+"""
+FdF headless renderer - scripted snapshots without a display.
+Loads a map (FDF, image or tiled .fdft), sets the camera from the command
+line, renders one frame into an offscreen surface and writes it as PNG.
+"""
+import os
+import sys
+import math
+import argparse
+import numpy as np
+from fdf_culling import box_corners
+from fdf_raster import LINE_BACKENDS, SOLID_BACKENDS, PYGAME, NUMPY
+from fdf_transform import PROJECTIONS
+
+
+RENDER_MODES = ('wireframe', 'points', 'solid')
+FIT_MARGIN = 0.9
+
+
+def parse_size(text):
+    """Размер кадра в виде WIDTHxHEIGHT"""
+    try:
+        width, height = (int(value) for value in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {text} (expected WIDTHxHEIGHT)")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    return width, height
+
+
+def add_render_options(parser):
+    """Общие параметры камеры и отрисовки (одиночный и пакетный режимы)"""
+    parser.add_argument('--size', type=parse_size, default=(1200, 800),
+                        help="frame size WIDTHxHEIGHT (default: 1200x800)")
+    parser.add_argument('--angles', type=float, nargs=3, metavar=('X', 'Y', 'Z'),
+                        help="rotation angles in degrees")
+    parser.add_argument('--scale', type=float,
+                        help="zoom; by default the model is fitted into the frame")
+    parser.add_argument('--offset', type=float, nargs=2, metavar=('X', 'Y'),
+                        help="screen position of the model origin")
+    parser.add_argument('--projection', choices=list(PROJECTIONS),
+                        help="camera projection (default: isometric for --basic, "
+                             "perspective otherwise)")
+    parser.add_argument('--mode', choices=RENDER_MODES, default='wireframe',
+                        help="render mode (extended renderer only)")
+    parser.add_argument('--lines', choices=LINE_BACKENDS, default=PYGAME,
+                        help="line rasterizer")
+    parser.add_argument('--solid', choices=SOLID_BACKENDS, default=NUMPY,
+                        help="solid mode: z-buffer (numpy) or sorted polygons (pygame)")
+    parser.add_argument('--threads', type=int, metavar='N',
+                        help="rasterizer threads for the numpy backends (default: CPU count)")
+    parser.add_argument('--no-outline', action='store_true',
+                        help="do not outline faces in solid mode")
+    parser.add_argument('--image-size', type=int, metavar='PIXELS',
+                        help="longest side of image heightmaps (default: native resolution)")
+    parser.add_argument('--height-scale', type=float, metavar='K',
+                        help="height per pixel value (default: 0.1 for 8-bit, 1 for DEM)")
+    parser.add_argument('--height-offset', type=float, metavar='Z',
+                        help="added to every height (default: 0)")
+    parser.add_argument('--invert', action=argparse.BooleanOptionalAction,
+                        help="bright is low (default: on for 8-bit, off for DEM)")
+    parser.add_argument('--nodata', type=float,
+                        help="pixel value treated as a hole (default: GDAL tag)")
+    parser.add_argument('--basic', action='store_true',
+                        help="use the basic FDF renderer (fdf.py)")
+    parser.add_argument('--hud', action='store_true', help="draw the text overlay")
+    parser.add_argument('--no-grid', action='store_true', help="hide the grid")
+    parser.add_argument('--no-axes', action='store_true', help="hide the axes")
+    parser.add_argument('--no-lod', action='store_true', help="always draw full detail")
+    parser.add_argument('--no-cache', action='store_true', help="bypass the map cache")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='fdf_render.py',
+        description="Render an FdF map to a PNG file without opening a window")
+    parser.add_argument('input', help="map file (.fdf, .fdft or image)")
+    parser.add_argument('-o', '--output', help="output PNG (default: <input>.png)")
+    add_render_options(parser)
+    return parser
+
+
+def create_renderer(args):
+    """Рендерер без окна с настройками из аргументов"""
+    width, height = args.size
+    if args.basic:
+        from fdf import FDFRenderer
+        renderer = FDFRenderer(width, height, headless=True)
+    else:
+        from fdf_bonus import ExtendedFDFRenderer
+        renderer = ExtendedFDFRenderer(width, height, headless=True)
+        renderer.render_mode = args.mode
+        renderer.solid_backend = args.solid
+        renderer.solid_outline = not args.no_outline
+        renderer.image_max_size = args.image_size
+        renderer.height_scale = {
+            key: value for key, value in (
+                ('scale', args.height_scale), ('offset', args.height_offset),
+                ('invert', args.invert), ('nodata', args.nodata))
+            if value is not None
+        }
+
+    if args.projection is not None:
+        renderer.transform.set_projection(args.projection)
+    renderer.line_backend = args.lines
+    if args.threads is not None:
+        renderer.raster_threads = max(1, args.threads)
+    renderer.show_hud = args.hud
+    renderer.show_grid = not args.no_grid
+    renderer.show_axes = not args.no_axes
+    renderer.lod_enabled = not args.no_lod
+    renderer.cache.enabled = not args.no_cache
+    return renderer
+
+
+def load_map(renderer, filename):
+    """Загрузка карты подходящим методом рендерера"""
+    if hasattr(renderer, 'load_file'):
+        return renderer.load_file(filename)
+    return renderer.read_fdf_file(filename)
+
+
+def model_box(renderer):
+    """Ограничивающий параллелепипед модели: (x0, x1, y0, y1, z0, z1)"""
+    source = getattr(renderer, 'tiled_map', None) or renderer.mesh
+    step = getattr(source, 'step', 1)
+    x0, y0 = source.origin_x, source.origin_y
+    x1 = x0 + max(0, source.cols - 1) * step
+    y1 = y0 + max(0, source.rows - 1) * step
+    return x0, x1, y0, y1, renderer.min_z, renderer.max_z
+
+
+def fit_view(renderer, margin=FIT_MARGIN):
+    """Масштаб и смещение, при которых модель целиком помещается в кадр"""
+    corners = box_corners(*(np.array([value]) for value in model_box(renderer)))
+    screen, _ = renderer.transform.apply(
+        renderer.angle_x, renderer.angle_y, renderer.angle_z, 1.0, 0.0, 0.0,
+        vertices=corners)
+    low = screen.min(axis=0)
+    high = screen.max(axis=0)
+    span = np.maximum(high - low, 1e-6)
+
+    # Проекция линейна по масштабу: подбираем его по размеру рамки
+    scale = margin * min(renderer.width / span[0], renderer.height / span[1])
+    center = (low + high) / 2 * scale
+    renderer.scale = float(scale)
+    renderer.offset_x = float(renderer.width / 2 - center[0])
+    renderer.offset_y = float(renderer.height / 2 - center[1])
+
+
+def apply_camera(renderer, args):
+    """Параметры камеры из аргументов командной строки"""
+    if args.angles is not None:
+        renderer.angle_x, renderer.angle_y, renderer.angle_z = (
+            math.radians(angle) for angle in args.angles)
+    if args.scale is None:
+        fit_view(renderer)
+    else:
+        renderer.scale = args.scale
+    if args.offset is not None:
+        renderer.offset_x, renderer.offset_y = args.offset
+
+
+def render_file(renderer, filename, output, args):
+    """Загрузка, настройка камеры и сохранение кадра; True при успехе"""
+    if not load_map(renderer, filename):
+        return False
+    apply_camera(renderer, args)
+    try:
+        renderer.save_frame(output)
+    except Exception as e:
+        print(f"Error writing {output}: {e}")
+        return False
+    return True
+
+
+def output_name(filename):
+    """Имя PNG рядом с исходным файлом"""
+    return os.path.splitext(filename)[0] + '.png'
+
+
+def main(argv=None):
+    """Точка входа"""
+    args = build_parser().parse_args(argv)
+    output = args.output or output_name(args.input)
+    renderer = create_renderer(args)
+    if not render_file(renderer, args.input, output, args):
+        print(f"Failed to render {args.input}")
+        return 1
+    print(f"Wrote {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""
+FdF tiled maps - out-of-core, memory-mapped heightmap format (.fdft).
+The map is split into fixed-size square tiles stored one after another,
+with a per-tile min/max table so that tiles can be culled without reading
+their data. Includes a streaming converter from .fdf files and images.
+
+Usage: python fdf_tiles.py <input.fdf|image> <output.fdft> [tile_size]
+"""
+import os
+import sys
+import struct
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from fdf_mesh import HeightMesh
+from fdf_parser import iter_fdf_chunks
+from fdf_image import iter_height_bands
+
+
+MAGIC = b'FDFT'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIIIdd')
+HEADER_SIZE = 64
+FLAG_COLORS = 1
+DEFAULT_TILE_SIZE = 256
+DEFAULT_CACHE_TILES = 256
+
+
+class TiledHeightMap:
+    """Карта высот, разбитая на тайлы и отображенная в память"""
+
+    def __init__(self, filename, cache_tiles=DEFAULT_CACHE_TILES):
+        with open(filename, 'rb') as file:
+            header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{filename} is not a tiled FDF map")
+        (magic, version, self.rows, self.cols, self.tile_size, flags,
+         self.origin_x, self.origin_y) = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{filename} is not a tiled FDF map (version {VERSION})")
+
+        self.filename = filename
+        self.has_colors = bool(flags & FLAG_COLORS)
+        self.tiles_y = -(-self.rows // self.tile_size)
+        self.tiles_x = -(-self.cols // self.tile_size)
+        count = self.tiles_y * self.tiles_x
+        tile_shape = (self.tiles_y, self.tiles_x, self.tile_size, self.tile_size)
+
+        # Таблица min/max и данные тайлов
+        offset = HEADER_SIZE
+        table = np.memmap(filename, dtype=np.float32, mode='r', offset=offset,
+                          shape=(self.tiles_y, self.tiles_x, 2))
+        self.tile_min = np.array(table[:, :, 0])
+        self.tile_max = np.array(table[:, :, 1])
+        offset += table.nbytes
+        self.heights = np.memmap(filename, dtype=np.float32, mode='r',
+                                 offset=offset, shape=tile_shape)
+        offset += self.heights.nbytes
+        self.colors = None
+        if self.has_colors:
+            self.colors = np.memmap(filename, dtype=np.uint32, mode='r',
+                                    offset=offset, shape=tile_shape)
+
+        # LRU кэш декодированных тайлов
+        self.cache_tiles = cache_tiles
+        self._cache = OrderedDict()
+        self.loads = 0
+        self.tile_count = count
+
+    @property
+    def min_z(self):
+        values = self.tile_min[~np.isnan(self.tile_min)]
+        return float(values.min()) if values.size else 0.0
+
+    @property
+    def max_z(self):
+        values = self.tile_max[~np.isnan(self.tile_max)]
+        return float(values.max()) if values.size else 0.0
+
+    def tile(self, ty, tx):
+        """Высоты и цвета тайла (через LRU кэш)"""
+        key = (ty, tx)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        heights = np.array(self.heights[ty, tx])
+        colors = np.array(self.colors[ty, tx]) if self.colors is not None else None
+        self._cache[key] = (heights, colors)
+        self.loads += 1
+        while len(self._cache) > self.cache_tiles:
+            self._cache.popitem(last=False)
+        return heights, colors
+
+    def tile_bounds(self):
+        """Границы тайлов в координатах модели: x0, x1, y0, y1, z0, z1 (T,)"""
+        size = self.tile_size
+        tx = np.arange(self.tiles_x)
+        ty = np.arange(self.tiles_y)
+        x0 = tx * size + self.origin_x
+        x1 = np.minimum((tx + 1) * size, self.cols) - 1 + self.origin_x
+        y0 = ty * size + self.origin_y
+        y1 = np.minimum((ty + 1) * size, self.rows) - 1 + self.origin_y
+        grid_x0, grid_y0 = np.meshgrid(x0, y0)
+        grid_x1, grid_y1 = np.meshgrid(x1, y1)
+        return (grid_x0.ravel(), grid_x1.ravel(), grid_y0.ravel(), grid_y1.ravel(),
+                self.tile_min.ravel(), self.tile_max.ravel())
+
+    def read_window(self, ty0, ty1, tx0, tx1, visible=None, step=1):
+        """Сборка HeightMesh из прямоугольника тайлов [ty0, ty1) x [tx0, tx1)"""
+        size = self.tile_size
+        row0, col0 = ty0 * size, tx0 * size
+        rows = min(ty1 * size, self.rows) - row0
+        cols = min(tx1 * size, self.cols) - col0
+        out_rows = -(-rows // step)
+        out_cols = -(-cols // step)
+
+        heights = np.full((out_rows, out_cols), np.nan, dtype=np.float32)
+        colors = np.zeros((out_rows, out_cols), dtype=np.uint32) if self.has_colors else None
+
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                if visible is not None and not visible[ty, tx]:
+                    continue
+                tile_heights, tile_colors = self.tile(ty, tx)
+                # Первая точка тайла, попадающая на шаг прореживания
+                top = (ty - ty0) * size
+                left = (tx - tx0) * size
+                skip_y = -top % step
+                skip_x = -left % step
+                part = tile_heights[skip_y::step, skip_x::step]
+                out_y = (top + skip_y) // step
+                out_x = (left + skip_x) // step
+                h = min(part.shape[0], out_rows - out_y)
+                w = min(part.shape[1], out_cols - out_x)
+                heights[out_y:out_y + h, out_x:out_x + w] = part[:h, :w]
+                if colors is not None:
+                    colors[out_y:out_y + h, out_x:out_x + w] = \
+                        tile_colors[skip_y::step, skip_x::step][:h, :w]
+
+        return HeightMesh(heights, colors, self.origin_x + col0,
+                          self.origin_y + row0, step=step)
+
+
+class TiledMapWriter:
+    """Потоковая запись карты полосами по tile_size строк"""
+
+    def __init__(self, filename, rows, cols, tile_size=DEFAULT_TILE_SIZE,
+                 has_colors=False, origin_x=0.0, origin_y=0.0):
+        self.filename = filename
+        self.rows = rows
+        self.cols = cols
+        self.tile_size = tile_size
+        self.has_colors = has_colors
+        self.tiles_y = -(-rows // tile_size)
+        self.tiles_x = -(-cols // tile_size)
+        self.table = np.full((self.tiles_y, self.tiles_x, 2), np.nan, dtype=np.float32)
+
+        flags = FLAG_COLORS if has_colors else 0
+        tile_bytes = tile_size * tile_size * 4
+        self.table_offset = HEADER_SIZE
+        self.heights_offset = self.table_offset + self.table.nbytes
+        self.colors_offset = self.heights_offset + self.tiles_y * self.tiles_x * tile_bytes
+        total = self.colors_offset + (self.tiles_y * self.tiles_x * tile_bytes
+                                      if has_colors else 0)
+
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, rows, cols, tile_size, flags,
+                                    origin_x, origin_y).ljust(HEADER_SIZE, b'\0'))
+        self.file.truncate(total)
+        self.next_row = 0
+
+    def write_band(self, heights, colors=None):
+        """Запись следующей полосы: ровно tile_size строк (последняя - меньше)"""
+        size = self.tile_size
+        ty = self.next_row // size
+        band = np.full((size, self.tiles_x * size), np.nan, dtype=np.float32)
+        band[:heights.shape[0], :heights.shape[1]] = heights
+        band_colors = None
+        if self.has_colors:
+            band_colors = np.zeros(band.shape, dtype=np.uint32)
+            if colors is not None:
+                band_colors[:colors.shape[0], :colors.shape[1]] = colors
+
+        tile_bytes = size * size * 4
+        for tx in range(self.tiles_x):
+            tile = np.ascontiguousarray(band[:, tx * size:(tx + 1) * size])
+            index = ty * self.tiles_x + tx
+            self.file.seek(self.heights_offset + index * tile_bytes)
+            self.file.write(tile.tobytes())
+            if band_colors is not None:
+                self.file.seek(self.colors_offset + index * tile_bytes)
+                self.file.write(band_colors[:, tx * size:(tx + 1) * size].tobytes())
+            if not np.isnan(tile).all():
+                self.table[ty, tx] = (np.nanmin(tile), np.nanmax(tile))
+
+        self.next_row += heights.shape[0]
+
+    def close(self):
+        """Запись таблицы min/max и закрытие файла"""
+        self.file.seek(self.table_offset)
+        self.file.write(self.table.tobytes())
+        self.file.close()
+
+
+def _convert_fdf(source, target, tile_size):
+    """Конвертация FDF в два прохода через временный файл строк"""
+    chunks = []
+    width = 0
+    has_colors = False
+    with tempfile.TemporaryFile() as spool:
+        # Проход 1: разбор блоков и запись во временный файл
+        for heights, colors, _ in iter_fdf_chunks(source):
+            if colors is None:
+                colors = np.zeros(heights.shape, dtype=np.uint32)
+            else:
+                has_colors = True
+            chunks.append((spool.tell(), heights.shape))
+            spool.write(heights.tobytes())
+            spool.write(colors.tobytes())
+            width = max(width, heights.shape[1])
+        rows = sum(shape[0] for _, shape in chunks)
+
+        # Проход 2: сборка полос по tile_size строк
+        writer = TiledMapWriter(target, rows, width, tile_size, has_colors)
+        band = np.full((tile_size, width), np.nan, dtype=np.float32)
+        band_colors = np.zeros((tile_size, width), dtype=np.uint32)
+        filled = 0
+        for offset, (count, chunk_width) in chunks:
+            spool.seek(offset)
+            heights = np.frombuffer(spool.read(count * chunk_width * 4), dtype=np.float32)
+            colors = np.frombuffer(spool.read(count * chunk_width * 4), dtype=np.uint32)
+            heights = heights.reshape(count, chunk_width)
+            colors = colors.reshape(count, chunk_width)
+
+            row = 0
+            while row < count:
+                take = min(tile_size - filled, count - row)
+                band[filled:filled + take, :chunk_width] = heights[row:row + take]
+                band_colors[filled:filled + take, :chunk_width] = colors[row:row + take]
+                filled += take
+                row += take
+                if filled == tile_size:
+                    writer.write_band(band, band_colors)
+                    band.fill(np.nan)
+                    band_colors.fill(0)
+                    filled = 0
+
+        if filled:
+            writer.write_band(band[:filled], band_colors[:filled])
+        writer.close()
+    return rows, width
+
+
+def _convert_image(source, target, tile_size, **scale):
+    """Конвертация изображения полосами (высоты как в load_image)"""
+    writer = None
+    band = None
+    filled = 0
+    for top, heights in iter_height_bands(source, tile_size, **scale):
+        if writer is None:
+            from PIL import Image
+            with Image.open(source) as img:
+                width, height = img.size
+            writer = TiledMapWriter(target, height, width, tile_size,
+                                    origin_x=-width / 2, origin_y=-height / 2)
+            band = np.empty((tile_size, width), dtype=np.float32)
+
+        row = 0
+        while row < heights.shape[0]:
+            take = min(tile_size - filled, heights.shape[0] - row)
+            band[filled:filled + take] = heights[row:row + take]
+            filled += take
+            row += take
+            if filled == tile_size:
+                writer.write_band(band)
+                filled = 0
+
+    if writer is None:
+        raise ValueError(f"No image data in {source}")
+    if filled:
+        writer.write_band(band[:filled])
+    writer.close()
+    return writer.rows, writer.cols
+
+
+def convert_to_tiles(source, target, tile_size=DEFAULT_TILE_SIZE, **scale):
+    """Потоковая конвертация .fdf или изображения в тайловый формат
+
+    scale - параметры перевода пикселей в высоты (см. fdf_image.HeightScale).
+    """
+    if source.lower().endswith('.fdf'):
+        return _convert_fdf(source, target, tile_size)
+    return _convert_image(source, target, tile_size, **scale)
+
+
+def main():
+    """Точка входа конвертера"""
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python fdf_tiles.py <input.fdf|image> <output.fdft> [tile_size]")
+        print("Example: python fdf_tiles.py test_maps/42.fdf 42.fdft 256")
+        return
+
+    source, target = sys.argv[1], sys.argv[2]
+    tile_size = int(sys.argv[3]) if len(sys.argv) == 4 else DEFAULT_TILE_SIZE
+    try:
+        rows, cols = convert_to_tiles(source, target, tile_size)
+    except Exception as e:
+        print(f"Error converting {source}: {e}")
+        return
+    size = os.path.getsize(target)
+    print(f"Wrote {target}: {rows}x{cols} points, tile {tile_size}, {size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+FdF transform pipeline - batched vertex rotation and projection.
+All vertices are kept in one (N, 3) array and transformed with a single
+composed matrix per frame instead of one rotate_point/project_point call per point.
+The camera combines rotation, a pluggable projection (isometric, parallel
+or perspective), scale and screen offset into one homogeneous 3x4 matrix.
+It is rebuilt only when the camera parameters change, and the model, grid
+and axes are all projected with it, so switching the projection at runtime
+only swaps the matrix.
+"""
+import math
+import numpy as np
+
+
+ISOMETRIC = 'isometric'
+PARALLEL = 'parallel'
+PERSPECTIVE = 'perspective'
+
+
+def rotation_matrix(angle_x, angle_y, angle_z):
+    """Матрица поворота Rz * Ry * Rx (тот же порядок, что и в rotate_point)"""
+    cos_x, sin_x = math.cos(angle_x), math.sin(angle_x)
+    cos_y, sin_y = math.cos(angle_y), math.sin(angle_y)
+    cos_z, sin_z = math.cos(angle_z), math.sin(angle_z)
+
+    rot_x = np.array([[1.0, 0.0, 0.0],
+                      [0.0, cos_x, -sin_x],
+                      [0.0, sin_x, cos_x]])
+    rot_y = np.array([[cos_y, 0.0, sin_y],
+                      [0.0, 1.0, 0.0],
+                      [-sin_y, 0.0, cos_y]])
+    rot_z = np.array([[cos_z, -sin_z, 0.0],
+                      [sin_z, cos_z, 0.0],
+                      [0.0, 0.0, 1.0]])
+    return rot_z @ rot_y @ rot_x
+
+
+def isometric_matrix():
+    """Матрица изометрической проекции 2x3 (как в FDFRenderer.project_point)"""
+    cos_30 = math.cos(math.radians(30))
+    sin_30 = math.sin(math.radians(30))
+    return np.array([[cos_30, -cos_30, 0.0],
+                     [sin_30, sin_30, 1.0]])
+
+
+def as_vertex_array(points):
+    """Преобразование списка точек (x, y, z) в массив (N, 3) float32"""
+    vertices = np.asarray(points, dtype=np.float32)
+    return vertices.reshape(-1, 3)
+
+
+class Projection:
+    """Проекция повернутой модели на плоскость экрана
+
+    plane - строки экранных x и y (2x3) в повернутых координатах, depth -
+    единичная нормаль к экрану (глубина растет от зрителя). Перспективная
+    проекция дополнительно делит экранные координаты на w = 1 + 2 * depth / d.
+    """
+
+    name = None
+    perspective = False
+
+    def __init__(self, plane):
+        self.plane = np.asarray(plane, dtype=np.float64)
+        normal = np.cross(self.plane[0], self.plane[1])
+        self.depth = normal / np.linalg.norm(normal)
+
+
+class IsometricProjection(Projection):
+    """Изометрическая проекция"""
+
+    name = ISOMETRIC
+
+    def __init__(self):
+        super().__init__(isometric_matrix())
+
+
+class ParallelProjection(Projection):
+    """Параллельная проекция вдоль оси Z повернутой модели"""
+
+    name = PARALLEL
+
+    def __init__(self):
+        super().__init__(np.eye(2, 3))
+
+
+class PerspectiveProjection(ParallelProjection):
+    """Перспектива: factor = d / (d + 2z)"""
+
+    name = PERSPECTIVE
+    perspective = True
+
+
+PROJECTIONS = {projection.name: projection for projection in
+               (IsometricProjection, ParallelProjection, PerspectiveProjection)}
+
+
+def make_projection(name):
+    """Объект проекции по имени"""
+    if name not in PROJECTIONS:
+        raise ValueError(f"Unknown projection: {name}")
+    return PROJECTIONS[name]()
+
+
+class VertexTransform:
+    """Камера: пакетное преобразование всех вершин модели за один проход"""
+
+    def __init__(self, projection=ISOMETRIC, distance=500):
+        self._projection = make_projection(projection)
+        self.distance = distance
+        self.vertices = np.zeros((0, 3), dtype=np.float32)
+
+        # Кэш составной матрицы для последних параметров камеры
+        self._params = None
+        self._matrix = None
+        self._depth = None
+
+    @property
+    def projection(self):
+        return self._projection.name
+
+    @property
+    def perspective(self):
+        return self._projection.perspective
+
+    def set_projection(self, projection):
+        """Смена проекции: меняется только матрица, вершины не трогаются"""
+        if projection != self.projection:
+            self._projection = make_projection(projection)
+
+    def set_vertices(self, vertices):
+        """Установка массива вершин (N, 3)"""
+        self.vertices = as_vertex_array(vertices)
+
+    def update(self, angle_x, angle_y, angle_z, scale, offset_x, offset_y):
+        """Пересчет составной матрицы (только если параметры изменились)"""
+        params = (angle_x, angle_y, angle_z, scale, offset_x, offset_y,
+                  self._projection, self.distance)
+        if params == self._params:
+            return
+        self._params = params
+        rotation = rotation_matrix(angle_x, angle_y, angle_z)
+        self._depth = self._projection.depth @ rotation
+
+        # Поворот, проекция, масштаб и смещение в одной матрице 3x4;
+        # строка w = 1 + 2 * depth / d (для параллельных проекций w = 1)
+        matrix = np.zeros((3, 4))
+        matrix[:2, :3] = self._projection.plane @ rotation * scale
+        matrix[:2, 3] = offset_x, offset_y
+        matrix[2, 3] = 1.0
+        if self._projection.perspective:
+            matrix[2, :3] = self._depth * (2 / self.distance)
+            # Смещение умножается на w, чтобы деление на w его не затронуло
+            matrix[:2, :3] += np.outer(matrix[:2, 3], matrix[2, :3])
+        self._matrix = matrix
+
+    @property
+    def matrix(self):
+        """Составная матрица 3x4 (после update)"""
+        return self._matrix
+
+    def depth_axis(self):
+        """Направление роста глубины в координатах модели (после update)"""
+        return self._depth
+
+    def apply(self, angle_x, angle_y, angle_z, scale, offset_x, offset_y,
+              vertices=None, z_offset=None):
+        """Преобразование вершин в экранные координаты (N, 2) и глубину (N,)"""
+        self.update(angle_x, angle_y, angle_z, scale, offset_x, offset_y)
+        if vertices is None:
+            vertices = self.vertices
+        else:
+            vertices = as_vertex_array(vertices)
+
+        matrix = self._matrix.astype(np.float32)
+        screen = vertices @ matrix[:2, :3].T
+        screen += matrix[:2, 3]
+        depth = vertices @ self._depth.astype(np.float32)
+
+        if z_offset is not None:
+            # Преобразование линейно: смещение по Z добавляется столбцом матрицы,
+            # без копии массива вершин
+            for axis in range(2):
+                screen[:, axis] += z_offset * matrix[axis, 2]
+            depth += z_offset * np.float32(self._depth[2])
+
+        if self._projection.perspective:
+            # Перспективное деление: w = 1 + 2 * depth / d из уже готовой глубины
+            w = depth * np.float32(2 / self.distance)
+            w += 1
+            screen /= w[:, None]
+        return screen, depth
@@ -0,0 +1,247 @@
+"""
+FdF file watch - incremental reload of .fdf maps edited in place.
+A background thread polls the file and keeps a CRC of every block of rows.
+When the file changes it finds the changed blocks: the unchanged head
+matches at the old offsets and the unchanged tail matches shifted by the
+size difference, so only the middle is split into lines again. Each block
+also knows how many grid rows it holds (blank and comment lines are not
+rows), so changed lines map to mesh rows. Only the changed rows are parsed;
+the viewer patches them into the loaded mesh. A change in the number of
+rows of any block asks for a full reload.
+"""
+import os
+import time
+import zlib
+import queue
+import threading
+import numpy as np
+from fdf_parser import parse_fdf_buffer, count_fdf_rows
+
+
+WATCH_INTERVAL = 0.5
+BLOCK_LINES = 32
+NEWLINE = ord('\n')
+
+
+def block_bounds(data, block_lines, base=0):
+    """Смещения начал блоков по block_lines строк и конец данных; число строк"""
+    ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == NEWLINE) + 1
+    lines = len(ends) + (1 if data and data[-1] != NEWLINE else 0)
+    bounds = np.concatenate(([0], ends[block_lines - 1::block_lines], [len(data)]))
+    if len(bounds) > 1 and bounds[-2] == bounds[-1]:
+        bounds = bounds[:-1]
+    return bounds.astype(np.int64) + base, lines
+
+
+def block_hashes(data, bounds):
+    """CRC32 каждого блока [bounds[i], bounds[i + 1])"""
+    view = memoryview(data)
+    return np.array([zlib.crc32(view[start:end])
+                     for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())],
+                    dtype=np.uint32)
+
+
+def block_rows(data, bounds):
+    """Число рядов сетки в каждом блоке [bounds[i], bounds[i + 1])"""
+    view = memoryview(data)
+    return np.array([count_fdf_rows(view[start:end])
+                     for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())],
+                    dtype=np.int64)
+
+
+class RowBlocks:
+    """Хэши блоков строк файла для поиска измененных строк"""
+
+    def __init__(self, data, block_lines=BLOCK_LINES):
+        self.block_lines = block_lines
+        self.size = len(data)
+        self.bounds, self.lines = block_bounds(data, block_lines)
+        self.hashes = block_hashes(data, self.bounds)
+        self.block_rows = block_rows(data, self.bounds)
+
+    @property
+    def rows(self):
+        """Число рядов сетки в файле"""
+        return int(self.block_rows.sum())
+
+    def _matches(self, view, block, shift=0):
+        start, end = self.bounds[block] + shift, self.bounds[block + 1] + shift
+        return (0 <= start and end <= len(view)
+                and zlib.crc32(view[start:end]) == self.hashes[block])
+
+    def update(self, data):
+        """Измененные диапазоны рядов сетки [(row0, row1, байты)] или None
+
+        None - изменилось число строк или рядов (нужна полная перезагрузка).
+        Хэши обновляются под новое содержимое файла.
+        """
+        view = memoryview(data)
+        blocks = len(self.hashes)
+        shift = len(data) - self.size
+
+        # Совпадающие начало (по старым смещениям) и конец (со сдвигом)
+        first = 0
+        while first < blocks and self._matches(view, first):
+            first += 1
+        if first == blocks and not shift:
+            return []
+        last = blocks
+        while (last > first and self.bounds[last - 1] + shift >= self.bounds[first]
+               and self._matches(view, last - 1, shift)):
+            last -= 1
+
+        # Середина заново делится на строки; их число должно совпасть
+        start, end = int(self.bounds[first]), int(self.bounds[last]) + shift
+        middle = data[start:end]
+        bounds, lines = block_bounds(middle, self.block_lines, base=start)
+        old_lines = min(last * self.block_lines, self.lines) - first * self.block_lines
+        ends_line = not middle or middle[-1] == NEWLINE or last == blocks
+        if lines != old_lines or not ends_line or len(bounds) - 1 != last - first:
+            self.__init__(data, self.block_lines)
+            return None
+        hashes = block_hashes(data, bounds)
+        changed = np.flatnonzero(hashes != self.hashes[first:last])
+
+        # Ряды измененных блоков: их число (с учетом пустых строк и
+        # комментариев) должно остаться прежним, иначе ряды сдвигаются
+        rows = self.block_rows[first:last].copy()
+        view = memoryview(data)
+        for block in changed.tolist():
+            rows[block] = count_fdf_rows(view[bounds[block]:bounds[block + 1]])
+        if not np.array_equal(rows, self.block_rows[first:last]):
+            self.__init__(data, self.block_lines)
+            return None
+
+        self.bounds = np.concatenate((self.bounds[:first], bounds[:-1],
+                                      self.bounds[last:] + shift))
+        self.hashes[first:last] = hashes
+        self.size = len(data)
+
+        # Соседние измененные блоки объединяются в один диапазон
+        ranges = []
+        for block in (changed + first).tolist():
+            if ranges and ranges[-1][1] == block:
+                ranges[-1][1] = block + 1
+            else:
+                ranges.append([block, block + 1])
+        # Номер первого ряда блока - сумма рядов предыдущих блоков
+        row_starts = np.concatenate(([0], np.cumsum(self.block_rows))).tolist()
+        return [(row_starts[block0], row_starts[block1],
+                 data[self.bounds[block0]:self.bounds[block1]])
+                for block0, block1 in ranges]
+
+
+class FileChange:
+    """Изменение файла: заплатки строк [(row0, heights, colors)] или None
+
+    patches = None - нужна полная перезагрузка. seconds - время от
+    обнаружения изменения до готовых заплаток.
+    """
+
+    __slots__ = ('patches', 'seconds')
+
+    def __init__(self, patches, seconds):
+        self.patches = patches
+        self.seconds = seconds
+
+    @property
+    def rows(self):
+        return sum(len(heights) for _, heights, _ in self.patches or ())
+
+
+def parse_rows(ranges):
+    """Разбор измененных рядов; None, если их число не совпало с ожидаемым"""
+    patches = []
+    for row0, row1, data in ranges:
+        heights, colors = parse_fdf_buffer(data)
+        if len(heights) != row1 - row0:
+            return None
+        patches.append((row0, heights, colors))
+    return patches
+
+
+def file_signature(filename):
+    """Время изменения и размер файла или None"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """Слежение за .fdf файлом в фоновом потоке
+
+    Поток раз в interval секунд проверяет время изменения и размер файла,
+    при изменении находит измененные строки и разбирает только их.
+    poll отдает накопившиеся FileChange без ожидания.
+    """
+
+    def __init__(self, filename, interval=WATCH_INTERVAL, block_lines=BLOCK_LINES):
+        self.filename = filename
+        self.interval = interval
+        self.block_lines = block_lines
+        self.blocks = None
+        self.changes = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    @property
+    def ready(self):
+        """Хэши строк посчитаны - изменения отслеживаются"""
+        return self.blocks is not None
+
+    @property
+    def rows(self):
+        """Число рядов сетки в файле (без пустых строк и комментариев)"""
+        return self.blocks.rows if self.blocks is not None else None
+
+    def _read(self, signature):
+        """Содержимое файла или None, если его прямо сейчас переписывают"""
+        try:
+            with open(self.filename, 'rb') as file:
+                data = file.read()
+        except OSError as e:
+            print(f"Error reading {self.filename}: {e}")
+            return None
+        if file_signature(self.filename) != signature:
+            return None
+        return data
+
+    def _watch(self):
+        signature = None
+        delay = 0
+        while not self._stop.wait(delay):
+            delay = self.interval
+            current = file_signature(self.filename)
+            if current is None or current == signature:
+                continue
+            data = self._read(current)
+            if data is None:
+                continue
+            signature = current
+
+            start = time.perf_counter()
+            if self.blocks is None:
+                self.blocks = RowBlocks(data, self.block_lines)
+                continue
+            ranges = self.blocks.update(data)
+            if ranges == []:
+                continue
+            patches = parse_rows(ranges) if ranges is not None else None
+            self.changes.put(FileChange(patches, time.perf_counter() - start))
+
+    def poll(self):
+        """Накопившиеся изменения файла (без ожидания)"""
+        changes = []
+        while True:
+            try:
+                changes.append(self.changes.get_nowait())
+            except queue.Empty:
+                return changes
+
+    def stop(self):
+        """Остановка фонового потока"""
+        self._stop.set()
+        self._thread.join(timeout=1)